@@ -1,7 +1,9 @@
 import os
 import time
 import asyncio
+import traceback
 import chainlit as cl
+import redis.asyncio as aioredis
 from dotenv import load_dotenv
 from typing import Literal, Dict, Optional
 
@@ -15,12 +17,135 @@ from langgraph.store.redis.aio import AsyncRedisStore
 from langgraph.checkpoint.redis.aio import AsyncRedisSaver
 
 from src.graphs.reviewer_graph import create_reviewer_graph
+from src.graphs.tools.reviewer_tools import CSO_ARCHIVE_PATH
+from src.utils.resources import get_archive_reader, get_blob_store, get_embeddings, get_resource, get_retriever, get_shared_frames, warm_up
+from src.storage.blob_store import report_refs
+from src.storage.semantic_cache import SemanticCache
+from src.storage.transcript_index import TranscriptIndex, transcript_entries
+from src.utils.check_tool_calls import last_turn_tool_call_args
+from src.utils.tracing import span, metrics_snapshot, recent_spans
+from src.utils.loop_watchdog import LoopWatchdog, LOOP_WATCHDOG_ENABLED
 
 load_dotenv()
 
 # Get Redis connection from environment or use default for local development
 redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379")
 
+# Cross-user semantic answer cache for repeated / paraphrased opening questions (e.g. the starters)
+answer_cache_enabled = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# the cached reports are owned by the cache (and by each thread served from it), not only by the thread that ran them
+ANSWER_CACHE_BLOB_OWNER = "answer-cache"
+
+
+def get_answer_cache() -> SemanticCache:
+    # built on first use: no embeddings client (nor FAISS) at import time, and none at all with the cache disabled
+    return get_resource(
+        "answer_cache",
+        lambda: SemanticCache(
+            embedder=get_embeddings(),
+            threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.92")),
+            max_entries=int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "5000")),
+            dependency_resolver=lambda table_ids: get_archive_reader().read_timestamps(CSO_ARCHIVE_PATH, table_ids),
+        ),
+    )
+
+
+# Paginated session restore from a per-thread transcript in Redis (no checkpoint deserialization on chat start)
+transcript_index_enabled = os.environ.get("TRANSCRIPT_INDEX_ENABLED", "true").lower() == "true"
+restore_page_size = int(os.environ.get("RESTORE_PAGE_SIZE", "20"))
+transcript_index = TranscriptIndex(aioredis.Redis.from_url(redis_url)) if transcript_index_enabled else None
+
+
+async def send_load_earlier(start: int) -> None:
+    await cl.Message(
+        content=f"*{start} earlier message(s) not shown.*",
+        actions=[cl.Action(name="load_earlier", payload={"before": start}, label="Load earlier messages")],
+        author="Assistant",
+    ).send()
+
+
+async def send_transcript_page(entries: list, start: int) -> None:
+    """
+    Send a page of restored messages, preceded by a "load earlier" action if older messages exist.
+    """
+    if start > 0:
+        await send_load_earlier(start)
+    for entry in entries:
+        await cl.Message(content=entry["content"], type="user_message" if entry["role"] == "user" else "assistant_message").send()
+
+
+async def send_earlier_page(entries: list, start: int) -> None:
+    """
+    Send an older page of restored messages as a collapsed step labelled with its positions in the conversation,
+    followed by a "load earlier" action if even older messages exist.
+    """
+    name = f"Earlier messages {start + 1}-{start + len(entries)} (before the restored conversation)"
+    async with cl.Step(name=name, show_input=False, default_open=False) as step:
+        step.output = "\n\n---\n\n".join(
+            f"**{'You' if entry['role'] == 'user' else 'Assistant'}:**\n\n{entry['content']}" for entry in entries
+        )
+    if start > 0:
+        await send_load_earlier(start)
+
+
+async def record_transcript_turn(thread_id: str, question: str, answer: str) -> None:
+    """
+    Append a turn (the user's message and the displayed answer) to the thread's transcript.
+    """
+    if transcript_index is not None:
+        entries = [{"role": "user", "content": question}]
+        if answer:
+            entries.append({"role": "assistant", "content": answer})
+        await transcript_index.append(thread_id, entries)
+
+
+# Event-loop lag histogram and the stacks of callbacks blocking the loop (LOOP_WATCHDOG_THRESHOLD_MS)
+loop_watchdog = LoopWatchdog() if LOOP_WATCHDOG_ENABLED else None
+
+
+def _report_warm_up(future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        error = future.exception()
+        print(f"Warning: warm-up failed, resources load on first use instead:\n{''.join(traceback.format_exception(error))}")
+
+
+@cl.on_app_startup
+async def on_app_startup():
+    # Runs on the server's loop. `run_app` runs on a short-lived loop of its own, whose `asyncio.run` shutdown waits
+    # for the default executor: warm-up started there would block startup. The watchdog watches the serving loop too.
+    # The retrieval artifacts / LLM clients load in the background, so the worker serves straight away.
+    asyncio.get_running_loop().run_in_executor(None, warm_up).add_done_callback(_report_warm_up)
+    if loop_watchdog is not None:
+        loop_watchdog.start()
+
+
+# Latency breakdown per span (retrieval stages, archive reads, planner, analyst LLM calls, code execution, ...).
+# Off by default; when on, requests must send `Authorization: Bearer $METRICS_TOKEN`.
+metrics_enabled = os.environ.get("METRICS_ENABLED", "false").lower() == "true"
+metrics_token = os.environ.get("METRICS_TOKEN", "")
+if metrics_enabled and not metrics_token:
+    print("Warning: METRICS_ENABLED is set without a METRICS_TOKEN, the /metrics endpoint is not served")
+elif metrics_enabled:
+    import hmac
+    from fastapi import HTTPException, Request
+    from chainlit.server import app as chainlit_server
+
+    async def metrics_endpoint(request: Request, recent: int = 0):
+        authorization = request.headers.get("authorization", "")
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {metrics_token}".encode()):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        return {
+            "spans": metrics_snapshot(),
+            "retrieval": get_retriever().info(),
+            "shared_frames": get_shared_frames().info(),
+            "event_loop": loop_watchdog.info() if loop_watchdog is not None else None,
+            "recent": recent_spans(limit=recent) if recent else [],
+        }
+
+    chainlit_server.add_api_route("/metrics", metrics_endpoint, methods=["GET"])
+    # chainlit serves its frontend from a catch-all route, so this route has to be matched before it
+    chainlit_server.router.routes.insert(0, chainlit_server.router.routes.pop())
+
         
 async def run_app():
     async with (
@@ -37,6 +162,7 @@ async def run_app():
             checkpointer=checkpointer,
         )
         print("Graph Built.")
+
         
         
         @cl.oauth_callback
@@ -75,6 +201,10 @@ async def run_app():
             try:
                 thread_id = cl.user_session.get("user").identifier
                 await checkpointer.adelete_thread(thread_id=thread_id)
+                if transcript_index is not None:
+                    await transcript_index.delete(thread_id)
+                # the reports / contexts no other thread references
+                await asyncio.to_thread(get_blob_store().release, thread_id)
                 print("Chat thread has been reset successfully")
             except Exception as e:
                 print(f"Error resetting chat thread: {e}")
@@ -111,10 +241,23 @@ async def run_app():
             # Check if there's an existing conversation state to restore
             thread_id = cl.user_session.get("user").identifier
             config = {"configurable": {"thread_id": thread_id}}
-            existing_state = await graph.aget_state(config)
-            
+            with span("session.restore"):
+                if transcript_index is not None:
+                    # only the latest page is restored, older messages are loaded on demand ("load_earlier")
+                    entries, first = await transcript_index.page(thread_id, restore_page_size)
+                    if not entries:
+                        # threads started before the transcript index: backfill it once from the checkpoint
+                        existing_state = await graph.aget_state(config)
+                        if existing_state and existing_state.values.get("messages"):
+                            await transcript_index.backfill(thread_id, existing_state.values["messages"])
+                            entries, first = await transcript_index.page(thread_id, restore_page_size)
+                else:
+                    existing_state = await graph.aget_state(config)
+                    entries = transcript_entries(existing_state.values.get("messages", []) if existing_state else [])
+                    first = 0
+
             # Only restore messages if there are actual past messages
-            if existing_state and "messages" in existing_state.values and existing_state.values["messages"]:
+            if entries:
                 # Add the Reset Chat button element in a restoring previous conversation message, if the chat-session is not new
                 # Create and add Reset Chat button to the header (top-left, aligned with Readme)
                 reset_chat_element = cl.CustomElement(name="ResetChatButton")
@@ -123,14 +266,18 @@ async def run_app():
                     elements=[reset_chat_element],
                     author="Assistant"
                 ).send()
+                await send_transcript_page(entries, first)
 
-                for past_msg in existing_state.values.get("messages", []):
-                    if isinstance(past_msg, HumanMessage):
-                        msg = cl.Message(content=past_msg.content, type="user_message")
-                        await msg.send()
-                    elif isinstance(past_msg, AIMessage) and past_msg.content:
-                        msg = cl.Message(content=past_msg.content, type="assistant_message")
-                        await msg.send()
+        @cl.action_callback("load_earlier")
+        async def load_earlier(action):
+            """
+            Send the previous page of the restored conversation. Chainlit can only append below the current messages,
+            so the page is rendered as one collapsed, labelled step instead of messages mixed with the latest ones.
+            """
+            thread_id = cl.user_session.get("user").identifier
+            entries, first = await transcript_index.page(thread_id, restore_page_size, before=action.payload["before"])
+            await action.remove()
+            await send_earlier_page(entries, first)
         @cl.on_message
         async def on_message(message: cl.Message):
             start = time.time()
@@ -140,10 +287,16 @@ async def run_app():
 
             thread_id = cl.user_session.get("user").identifier
             config = {"configurable": {"thread_id": thread_id}}
+            # the stored reports / contexts of an active thread do not expire
+            await asyncio.to_thread(get_blob_store().touch, thread_id)
 
             # Add the Reset Chat button if this is the first message
             existing_state = await graph.aget_state(config)
-            if existing_state and existing_state.values.get("messages", []) == []:
+            is_new_thread = existing_state and existing_state.values.get("messages", []) == []
+            if transcript_index is not None and not is_new_thread and await transcript_index.length(thread_id) == 0:
+                # a thread started before the transcript index, not restored since: backfill before appending to it
+                await transcript_index.backfill(thread_id, existing_state.values.get("messages", []))
+            if is_new_thread:
                 reset_chat_element = cl.CustomElement(name="ResetChatButton")
                 reset_msg = cl.Message(
                     content="",
@@ -152,20 +305,79 @@ async def run_app():
                 )
                 await reset_msg.send()                
 
+            # Serve opening questions from the semantic answer cache, if a close enough question was answered before
+            use_answer_cache = answer_cache_enabled and is_new_thread
+            if use_answer_cache:
+                answer_cache = get_answer_cache()
+                query_vector = await asyncio.to_thread(answer_cache.embed, message.content)
+                cache_hit = await asyncio.to_thread(answer_cache.lookup, message.content, "", query_vector)
+                if cache_hit is not None:
+                    # the thread references the cached reports too, so they survive the reset of the thread that ran them
+                    missing = await asyncio.to_thread(get_blob_store().add_owner, report_refs(cache_hit[0]["reports"]), thread_id)
+                    if missing:
+                        # the reports have expired: drop the stale entries and answer as usual
+                        await asyncio.to_thread(answer_cache.invalidate, cache_hit[0]["table_ids"])
+                        cache_hit = None
+                if cache_hit is not None:
+                    payload, _ = cache_hit
+                    # record the turn in the thread, so that follow-ups (and provenance) work as usual
+                    await graph.aupdate_state(
+                        config,
+                        {
+                            "messages": [
+                                HumanMessage(content=message.content, name="user"),
+                                AIMessage(content=payload["answer"]),
+                            ],
+                            "question": message.content,
+                            "relevant_tables_metadata": {table_id: {} for table_id in payload["table_ids"]},
+                            "reports": payload["reports"],
+                        },
+                        as_node="reviewer_agent",
+                    )
+                    await pls_wait_msg.remove()
+                    await cl.Message(f"*Answered from cache in {round(time.time() - start, 2)} seconds...*").send()
+                    await cl.Message(content=payload["answer"]).send()
+                    await record_transcript_turn(thread_id, message.content, payload["answer"])
+                    return
+
             streaming_started = False
-            async for chunk, metadata in graph.astream(
-                input={"messages": [HumanMessage(content=message.content, name="user")]},
-                stream_mode="messages",
-                config=config
-            ):
-                if chunk.content and metadata["langgraph_node"] == "reviewer_agent" and isinstance(chunk, AIMessageChunk):
-                    if not streaming_started:
-                        await pls_wait_msg.remove()
-                        await cl.Message(f"*Thought for {round(time.time() - start, 2)} seconds...*").send()
-                        streaming_started = True
-                    await msg.stream_token(chunk.content)
+            with span("request.graph"):
+                async for chunk, metadata in graph.astream(
+                    input={"messages": [HumanMessage(content=message.content, name="user")]},
+                    stream_mode="messages",
+                    config=config
+                ):
+                    if chunk.content and metadata["langgraph_node"] == "reviewer_agent" and isinstance(chunk, AIMessageChunk):
+                        if not streaming_started:
+                            await pls_wait_msg.remove()
+                            await cl.Message(f"*Thought for {round(time.time() - start, 2)} seconds...*").send()
+                            streaming_started = True
+                        await msg.stream_token(chunk.content)
 
             await msg.send()
+            await record_transcript_turn(thread_id, message.content, msg.content)
+
+            # Cache the answer of an opening question, keyed by its embedding and tied to the analysed tables' versions
+            if use_answer_cache:
+                final_state = (await graph.aget_state(config)).values
+                final_msg = final_state.get("messages", [])[-1:]
+                reports = final_state.get("reports", {})
+                table_ids = []
+                for args in last_turn_tool_call_args(final_state.get("messages", []), "data_analyst_tool"):
+                    table_ids.extend(t for t in args.get("table_ids", []) if t in reports and t not in table_ids)
+
+                if table_ids and final_msg and isinstance(final_msg[0], AIMessage) and final_msg[0].content:
+                    timestamps = await asyncio.to_thread(get_archive_reader().read_timestamps, CSO_ARCHIVE_PATH, table_ids)
+                    payload = {
+                        "answer": final_msg[0].content,
+                        "table_ids": table_ids,
+                        "reports": {table_id: reports[table_id] for table_id in table_ids},
+                    }
+                    missing = await asyncio.to_thread(get_blob_store().add_owner, report_refs(payload["reports"]), ANSWER_CACHE_BLOB_OWNER)
+                    if not missing:
+                        await asyncio.to_thread(
+                            answer_cache.store, message.content, payload, "", timestamps, query_vector
+                        )
             
         
 asyncio.run(run_app())
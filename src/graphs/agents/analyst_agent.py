@@ -1,8 +1,14 @@
 from textwrap import dedent
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
-from src.graphs.llms.gemini import get_llm
+from src.utils.resources import get_resource, get_shared_llm
+from src.utils.message_compaction import compact_tool_history, estimate_tokens
+from src.utils.tracing import span, record_token_usage
+from src.utils.text_coercion import _to_text
 from src.models.graph_states import AnalystSubgraphState
+from src.utils.sql_engine import SQL_ENGINE_ENABLED
+from src.utils.shared_frames import SHARED_FRAMES_ENABLED
+from src.utils.table_align import ALIGN_TABLES_ENABLED
 from src.graphs.tools.analyst_tools import python_code_executor
 
 
@@ -32,18 +38,65 @@ SYSTEM_PROMPT_ANALYST = dedent(
     """
 )
 
-TOOLS = [python_code_executor]
+# Merged planning: without a planner-made plan, the first response holds both the plan and the first tool-call.
+MERGED_PLANNING_INSTRUCTIONS = dedent(
+    """\
+        # NO ANALYSIS-PLAN PROVIDED:
+            - In my first response, I write a concise "Analysis-Plan" of 3-4 steps as plain text, AND in the same response I call the `python_code_executor` tool for the first step.
+            - In the following responses, I follow that plan (adapting it to the data), as with a provided plan.
+    """
+)
 
-llm = get_llm(model="gemini-2.5-flash")
-llm_with_code_exec_tool = llm.bind_tools(
-    tools=TOOLS,
-    allowed_function_names=["python_code_executor"]
+# The `sql(...)` helper is preloaded in the Python-shell when DuckDB is available (see `src.utils.sql_engine`).
+SQL_HELPER_INSTRUCTIONS = dedent(
+    """\
+        # SQL HELPER:
+            - A function `sql(query: str) -> pandas.DataFrame` is preloaded in the Python-shell (no import needed). It runs a DuckDB SQL query over the tables, referenced by their Table ID (e.g. `SELECT Year, SUM(VALUE) AS total FROM <TABLE_ID> WHERE ... GROUP BY Year`).
+            - I prefer `sql(...)` for filters, aggregations and joins across tables, especially on large tables; I `print` the (small) result.
+            - Column names with spaces or special characters must be double-quoted in SQL (e.g. `"Type of Dwelling"`).
+    """
+)
+# The table is preloaded as `df` in the Python-shell (see `src.utils.shared_frames`).
+SHARED_FRAME_INSTRUCTIONS = dedent(
+    """\
+        # PRELOADED TABLE:
+            - The table is preloaded in the Python-shell as the pandas DataFrame `df` (the same data as the CSV file). I use `df` directly instead of reading the CSV file again.
+    """
+)
+# `align_tables(...)` is preloaded in the Python-shell (see `src.utils.table_align`); only shown for cross-table questions.
+ALIGN_TABLES_INSTRUCTIONS = dedent(
+    """\
+        # CROSS-TABLE QUESTIONS:
+            - Other tables are analysed for the same question: {related_table_ids}.
+            - A function `align_tables(table_ids: list, on: list = None, select: dict = None, how: str = "inner") -> pandas.DataFrame` is preloaded in the Python-shell (no import needed). It joins tables on their common dimensions (time, geography, statistic) by category code and returns one tidy DataFrame: a column per common dimension, the other dimensions of each table, and one value column per Table ID.
+            - When the question compares or combines this table with another one, I use `align_tables([...])` instead of merging the CSV files myself. I restrict the categories of each table first with `select={"<TABLE_ID>": {"<dimension label>": "<category label or list of labels>"}}`, and `on=[...]` limits the join to given dimensions.
+    """
 )
+DEFAULT_ANALYSIS_PLAN = "No explicit plan: analyse the table step-by-step to answer the question."
+
+TOOLS = [python_code_executor]
+
+# History compaction: only the latest tool outputs are re-sent verbatim, older ones are collapsed into bullets.
+KEEP_LAST_TOOL_OUTPUTS = 2
+MAX_TOOL_OUTPUT_CHARS = 4000
+
+
+def _get_llm_with_code_exec_tool():
+    return get_resource(
+        "analyst_llm_with_code_exec_tool",
+        lambda: get_shared_llm(model="gemini-2.5-flash").bind_tools(
+            tools=TOOLS,
+            allowed_function_names=["python_code_executor"]
+        ),
+    )
+
 
 async def analyst_node(state: AnalystSubgraphState) -> str:
     """
     The analyst agent has access to the Python-Shell tool and uses it answer the user query by analysing the data available in context.
 
+    Without an `analysis_plan` (merged planning), the first response writes the plan and makes the first tool-call.
+
     Args:
         state (State): The state containing the messages and other data.
     
@@ -52,35 +105,62 @@ async def analyst_node(state: AnalystSubgraphState) -> str:
     """
     try:
         question = state["question"]
-        analysis_plan = state["analysis_plan"]
+        analysis_plan = state.get("analysis_plan")
         context = state["context"]
         old_messages = state["messages"]
         report = state.get("report", [])
+        prompt_tokens = state.get("prompt_tokens", [])
 
         system_prompt = SYSTEM_PROMPT_ANALYST
+        if SHARED_FRAMES_ENABLED:
+            system_prompt += "\n" + SHARED_FRAME_INSTRUCTIONS
+        if SQL_ENGINE_ENABLED:
+            system_prompt += "\n" + SQL_HELPER_INSTRUCTIONS
+        related_table_ids = state.get("related_table_ids") or []
+        if ALIGN_TABLES_ENABLED and related_table_ids:
+            system_prompt += "\n" + ALIGN_TABLES_INSTRUCTIONS.replace("{related_table_ids}", ", ".join(related_table_ids))
         iters = state.get("iters", 0)
         iters += 1
 
-        context = f"CONTEXT:\n{context}\n\nANALYSIS PLAN:\n{analysis_plan}"
+        # NOTE: `context` is returned unchanged, so the plan is not re-wrapped into the context on every iteration
+        plan_in_response = not analysis_plan
+        if plan_in_response:
+            system_prompt = system_prompt + "\n" + MERGED_PLANNING_INSTRUCTIONS
+            prompt_context = f"CONTEXT:\n{context}"
+        else:
+            prompt_context = f"CONTEXT:\n{context}\n\nANALYSIS PLAN:\n{analysis_plan}"
         msgs = [
             SystemMessage(content=system_prompt, name="analyst_node"),
-            SystemMessage(content=context, name="analyst_node"),
+            SystemMessage(content=prompt_context, name="analyst_node"),
             HumanMessage(content=question, name="analyst_node"),
-        ] + old_messages
+        ] + compact_tool_history(
+            old_messages,
+            keep_last=KEEP_LAST_TOOL_OUTPUTS,
+            max_tool_chars=MAX_TOOL_OUTPUT_CHARS,
+        )
         
-        if iters <= 10:
-            # print("Running data-analyst agent...")
-            res = await llm_with_code_exec_tool.ainvoke(msgs)
-        else:
-            # print("Stopping tool-calls as max-iterations reached. Generating final response...")
-            res = await llm.ainvoke(msgs)
-            return {"messages": [res], "iters": iters, "context": context, "report": report}
+        with span("analyst.llm", table_id=state.get("table_id"), iteration=iters):
+            if iters <= 10:
+                # print("Running data-analyst agent...")
+                res = await _get_llm_with_code_exec_tool().ainvoke(msgs)
+            else:
+                # print("Stopping tool-calls as max-iterations reached. Generating final response...")
+                res = await get_shared_llm(model="gemini-2.5-flash").ainvoke(msgs)
+            record_token_usage(res, estimated_input_tokens=estimate_tokens(msgs))
+
+        # track prompt-token usage per iteration (provider count if available, else an estimate)
+        usage = getattr(res, "usage_metadata", None) or {}
+        prompt_tokens = prompt_tokens + [usage.get("input_tokens") or estimate_tokens(msgs)]
+
+        # merged planning: keep the plan written in the first response for the next iterations
+        if plan_in_response:
+            analysis_plan = _to_text(res.content).strip() or DEFAULT_ANALYSIS_PLAN
 
-        if isinstance(res, AIMessage):
-            return {"messages": [res], "iters": iters, "context": context, "report": report}
+        if isinstance(res, AIMessage) or iters > 10:
+            return {"messages": [res], "iters": iters, "context": context, "report": report, "prompt_tokens": prompt_tokens, "analysis_plan": analysis_plan}
         else:
             res = AIMessage("Error generating code. Please try again.")
-            return {"messages": [res], "iters": iters, "context": context, "report": report}
+            return {"messages": [res], "iters": iters, "context": context, "report": report, "prompt_tokens": prompt_tokens, "analysis_plan": analysis_plan}
     except Exception as e:
         res = AIMessage(f"Error occurred during analysis: {str(e)}")
         return {"messages": [res], "iters": iters, "context": context, "report": report}
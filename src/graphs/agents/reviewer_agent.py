@@ -3,14 +3,26 @@ from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
 from src.utils.text_coercion import coerce_ai_to_text
 from src.utils.check_tool_calls import has_tool_calls
-from src.graphs.llms.gemini import get_llm
+from src.utils.message_compaction import condense_conversation, estimate_tokens
+from src.utils.resources import get_resource, get_shared_llm
+from src.utils.tracing import span, record_token_usage
 from src.models.graph_states import ParentState
 from src.graphs.tools.reviewer_tools import hybrid_retrieval_tool, data_analyst_tool, provenance_tool
 
 
 TOOLS = [hybrid_retrieval_tool, data_analyst_tool, provenance_tool]
-llm = get_llm(model="gemini-2.5-flash")
-llm_with_tools_poc = llm.bind_tools(TOOLS)
+
+
+def _get_llm_with_tools():
+    return get_resource(
+        "reviewer_llm_with_tools",
+        lambda: get_shared_llm(model="gemini-2.5-flash").bind_tools(TOOLS),
+    )
+
+
+# Rolling-summary memory: only the current turn is sent verbatim, older turns are condensed.
+KEEP_TURNS = 1
+MAX_CONDENSED_TURNS = 4
 
 reviewer_system_prompt = dedent(
     """\
@@ -52,11 +64,15 @@ async def reviewer_agent(state: ParentState):
 
         response["question"] = messages[-1].content
     
-    res = await llm_with_tools_poc.ainvoke(
-        [SystemMessage(content=reviewer_system_prompt, name="reviewer_agent")] + messages,
-        config={"response_mime_type": "text/plain"},
+    history = condense_conversation(messages, keep_turns=KEEP_TURNS, max_condensed_turns=MAX_CONDENSED_TURNS)
+    prompt = [SystemMessage(content=reviewer_system_prompt, name="reviewer_agent")] + history
+    with span("reviewer.llm", iteration=iter):
+        res = await _get_llm_with_tools().ainvoke(
+            prompt,
+            config={"response_mime_type": "text/plain"},
 
-    )
+        )
+        record_token_usage(res, estimated_input_tokens=estimate_tokens(prompt))
 
     if iter > 12:
         response["messages"] = [AIMessage("Max iterations reached, ending...")]
@@ -0,0 +1,300 @@
+"""
+Load-test of the full reviewer graph (`create_reviewer_graph`) without Gemini quota: fake chat / embedding models
+with configurable latencies, a stub retriever and a synthetic archive.
+
+Usage:
+    python -m src.graphs.load_test [--sessions 40] [--concurrency 10] [--turns 2] [--latency 0.5] [--tables 50]
+                                   [--questions questions.jsonl] [--redis-url redis://localhost:6379] [--json out.json]
+
+Each session is a thread of `--turns` questions; `--concurrency` sessions run at a time. The scripted reviewer calls
+`hybrid_retrieval_tool`, then `data_analyst_tool` on the retrieved tables (or `provenance_tool` for follow-ups asking
+for the code), then answers; the scripted analyst / planner are those of `src.graphs.planning_benchmark`. Everything
+else is the real code path: tools, analyst subgraph, code execution, blob store, checkpointer (`MemorySaver`, or
+`AsyncRedisSaver` with `--redis-url`).
+
+Questions come from `--questions` (JSONL, one {"question": ...} per line), else a built-in list. The run happens in
+`--workdir` (a temporary folder by default), which gets the synthetic archive and the `cache/` folder.
+
+Reports: throughput (turns/s), turn latency (p50 / p95 / p99 / max), event-loop lag (p50 / p99 / max, measured by
+`LoopWatchdog`) with the code sites that blocked the loop for longer than `--stall-ms`, memory per session (RSS growth
+and checkpointed state size) and errors.
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from src.utils import tracing
+from src.utils.fake_llms import ScriptedChatModel
+from src.utils.loop_watchdog import LoopWatchdog, stall_sites
+from src.utils.resources import llm_resource_name, set_resource
+from src.retrieval.context_store import RENDERERS
+from src.retrieval.local_embeddings import HashingEmbeddings
+from src.storage.json_stat_archive_db import JSONStatArchiveDB
+from src.storage.synthetic_archive import write_synthetic_archive
+from src.graphs.planning_benchmark import QUESTIONS, fake_analyst, fake_planner
+
+
+FOLLOW_UP_QUESTION = "Show me the code used for that analysis."
+
+
+# ---------- FAKES ----------
+
+class StubRetriever:
+    """
+    Retriever stand-in: a deterministic pick of `k` tables per query, context blocks rendered from the archive.
+    """
+
+    def __init__(self, metadata: Dict[str, Dict], k: int = 2, latency: float = 0.0):
+        self.metadata = metadata
+        self.table_ids = sorted(metadata)
+        self.k = k
+        self.latency = latency
+
+    def search(self, query: str) -> List[str]:
+        time.sleep(self.latency)
+        start = zlib.crc32(query.encode("utf-8")) % len(self.table_ids)
+        return [self.table_ids[(start + i) % len(self.table_ids)] for i in range(self.k)]
+
+    def get_context_blocks(self, table_ids: list, kind: str = "retrieval") -> dict:
+        render = RENDERERS[kind]
+        blocks = {}
+        for table_id in table_ids:
+            text = render(table_id, self.metadata[table_id])
+            blocks[table_id] = (text, len(text) // 4)
+        return blocks
+
+
+def fake_reviewer(messages) -> AIMessage:
+    """
+    Scripted reviewer: retrieval -> analysis (or provenance for follow-ups asking for the code) -> answer.
+    """
+    question = next(m.content for m in reversed(messages) if isinstance(m, HumanMessage))
+    last = messages[-1]
+    call_id = f"call_{time.perf_counter_ns()}"
+
+    if isinstance(last, HumanMessage):
+        if "code" in question.lower():
+            analysed = re.findall(r"Analysis for Table ID: (\S+)", "\n".join(str(m.content) for m in messages))
+            if analysed:
+                return AIMessage(content="", tool_calls=[
+                    {"name": "provenance_tool", "args": {"table_id": analysed[-1]}, "id": call_id, "type": "tool_call"}
+                ])
+        return AIMessage(content="", tool_calls=[
+            {"name": "hybrid_retrieval_tool", "args": {"user_prompt": question}, "id": call_id, "type": "tool_call"}
+        ])
+
+    if isinstance(last, ToolMessage) and last.name == "hybrid_retrieval_tool" and "table-IDs are:" in last.content:
+        table_ids = [t.strip() for t in last.content.split("table-IDs are:")[1].split(",")]
+        return AIMessage(content="", tool_calls=[
+            {"name": "data_analyst_tool", "args": {"table_ids": table_ids, "question": question}, "id": call_id, "type": "tool_call"}
+        ])
+
+    summary = str(last.content)[:400] if isinstance(last, ToolMessage) else ""
+    return AIMessage(content=f"## Answer\n\n{summary}\n\nWould you like the code used for this analysis?")
+
+
+def install_fakes(args, metadata: Dict[str, Dict]) -> None:
+    reviewer = ScriptedChatModel(script={"": [fake_reviewer]}, key_pattern="", latency=args.latency)
+    analyst = ScriptedChatModel(script={"": [fake_analyst(args.steps)]}, latency=args.latency)
+    planner = ScriptedChatModel(structured_script={"": [fake_planner]}, latency=args.latency)
+
+    from src.models.structured_outputs import AnalysisPlanSubModel
+    set_resource("reviewer_llm_with_tools", reviewer)
+    set_resource("analyst_llm_with_code_exec_tool", analyst)
+    set_resource(llm_resource_name("gemini-2.5-flash"), analyst)
+    set_resource("planner_structured_llm", planner.with_structured_output(AnalysisPlanSubModel))
+    set_resource("embeddings", HashingEmbeddings(dim=256))
+    set_resource("retriever", StubRetriever(metadata, k=args.tables_per_question, latency=args.retrieval_latency))
+
+    from src.storage.blob_store import RedisBlobStore, SQLiteBlobStore
+    set_resource("blob_store", RedisBlobStore(args.redis_url) if args.redis_url else SQLiteBlobStore())
+
+
+# ---------- SCENARIO ----------
+
+def load_questions(path: Optional[str]) -> List[str]:
+    if not path:
+        return list(QUESTIONS)
+    questions = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                questions.append(row.get("question") or row.get("message") or row.get("title"))
+    return [q for q in questions if q]
+
+
+def prepare_workdir(args) -> Dict[str, Dict]:
+    """
+    Write the synthetic archive where the tools expect it (relative to `--workdir`) and return the table metadata.
+    """
+    from src.graphs.tools.reviewer_tools import CSO_ARCHIVE_PATH, CSV_SAVE_DIR
+    from src.retrieval.index_builder import get_table_metadata
+
+    os.makedirs(CSV_SAVE_DIR, exist_ok=True)
+    os.makedirs(os.path.dirname(CSO_ARCHIVE_PATH), exist_ok=True)
+    if not os.path.exists(CSO_ARCHIVE_PATH):
+        write_synthetic_archive(CSO_ARCHIVE_PATH, args.tables, n_categories=args.categories)
+    return {table_id: get_table_metadata(ds) for table_id, ds, _ in JSONStatArchiveDB().read(CSO_ARCHIVE_PATH)}
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def run_session(graph, thread_id: str, questions: List[str]) -> List[Tuple[float, Optional[str]]]:
+    results = []
+    config = {"configurable": {"thread_id": thread_id}}
+    for question in questions:
+        start = time.perf_counter()
+        try:
+            await graph.ainvoke({"messages": [HumanMessage(content=question, name="user")]}, config=config)
+            error = None
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+        results.append((time.perf_counter() - start, error))
+    return results
+
+
+async def checkpoint_bytes(graph, thread_ids: List[str]) -> float:
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+    serde = JsonPlusSerializer()
+    sizes = []
+    for thread_id in thread_ids:
+        state = await graph.aget_state({"configurable": {"thread_id": thread_id}})
+        sizes.append(len(serde.dumps_typed(state.values)[1]))
+    return float(np.mean(sizes)) if sizes else 0.0
+
+
+async def run_load(graph, args, questions: List[str]) -> Dict:
+    run_id = int(time.time())
+    sessions = []
+    for i in range(args.sessions):
+        turns = []
+        for t in range(args.turns):
+            # every second turn is a follow-up asking for the code (provenance), the others are new questions
+            turns.append(FOLLOW_UP_QUESTION if t % 2 else questions[(i * args.turns + t) % len(questions)])
+        sessions.append((f"load-{run_id}-{i}", turns))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def _bounded(thread_id, turns):
+        async with semaphore:
+            return await run_session(graph, thread_id, turns)
+
+    watchdog = LoopWatchdog(interval_ms=50, threshold_ms=args.stall_ms, max_stalls=1000, print_stalls=False)
+    watchdog.start()
+    rss_start = rss_bytes()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_bounded(thread_id, turns) for thread_id, turns in sessions))
+    elapsed = time.perf_counter() - start
+    watchdog.stop()
+    loop = watchdog.info()
+    rss_end = rss_bytes()
+
+    latencies = [latency for session in results for latency, _ in session]
+    errors = [error for session in results for _, error in session if error]
+    # counted from the span ring buffer: raise TRACE_BUFFER_SIZE for long runs
+    executions = tracing.recent_spans(limit=10**6, name="executor.run")
+    state_bytes = await checkpoint_bytes(graph, [thread_id for thread_id, _ in sessions[:20]])
+
+    def pct(values, q):
+        return round(float(np.percentile(values, q)), 3) if values else None
+
+    return {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "turns": len(latencies),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_turns_per_s": round(len(latencies) / elapsed, 2),
+        "latency_p50_s": pct(latencies, 50),
+        "latency_p95_s": pct(latencies, 95),
+        "latency_p99_s": pct(latencies, 99),
+        "latency_max_s": pct(latencies, 100),
+        "loop_lag_p50_ms": loop["lag_p50_ms"],
+        "loop_lag_p99_ms": loop["lag_p99_ms"],
+        "loop_lag_max_ms": loop["lag_max_ms"],
+        "loop_stalls": loop["stalls"],
+        "loop_stall_sites": dict(list(stall_sites(loop["recent_stalls"]).items())[:5]),
+        "rss_start_mb": round(rss_start / 2**20, 1),
+        "rss_end_mb": round(rss_end / 2**20, 1),
+        "rss_per_session_kb": round((rss_end - rss_start) / args.sessions / 1024, 1),
+        "checkpoint_kb_per_session": round(state_bytes / 1024, 1),
+        "code_executions": len(executions),
+        "code_execution_errors": sum(1 for s in executions if s["attributes"].get("failed")),
+        "errors": len(errors),
+        "first_errors": errors[:3],
+    }
+
+
+async def main_async(args) -> Dict:
+    from src.graphs.reviewer_graph import create_reviewer_graph
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    metadata = prepare_workdir(args)
+    install_fakes(args, metadata)
+    questions = load_questions(args.questions)
+    tracing.reset()
+
+    if args.redis_url:
+        from langgraph.checkpoint.redis.aio import AsyncRedisSaver
+
+        async with AsyncRedisSaver.from_conn_string(args.redis_url) as checkpointer:
+            await checkpointer.asetup()
+            report = await run_load(create_reviewer_graph(checkpointer=checkpointer), args, questions)
+    else:
+        from langgraph.checkpoint.memory import MemorySaver
+        report = await run_load(create_reviewer_graph(checkpointer=MemorySaver()), args, questions)
+
+    report["spans"] = tracing.metrics_snapshot()
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=2, help="questions per session (every second one is a follow-up)")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake LLM call")
+    parser.add_argument("--retrieval-latency", type=float, default=0.05, help="seconds per stub search")
+    parser.add_argument("--steps", type=int, default=2, help="code executions of the fake analyst per table")
+    parser.add_argument("--tables", type=int, default=50, help="tables in the synthetic archive")
+    parser.add_argument("--categories", type=int, default=30, help="category-dimension size of the synthetic tables")
+    parser.add_argument("--tables-per-question", type=int, default=2)
+    parser.add_argument("--questions", default=None, help="JSONL file of {\"question\": ...} lines")
+    parser.add_argument("--stall-ms", type=float, default=100, help="event-loop stall threshold of the watchdog")
+    parser.add_argument("--redis-url", default=None, help="use AsyncRedisSaver on this Redis instead of MemorySaver")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "cso_load_test"))
+    parser.add_argument("--json", dest="json_path", default=None)
+    args = parser.parse_args()
+    # paths are resolved before the run moves into `--workdir`
+    args.json_path = os.path.abspath(args.json_path) if args.json_path else None
+    args.questions = os.path.abspath(args.questions) if args.questions else None
+
+    report = asyncio.run(main_async(args))
+    print(json.dumps({k: v for k, v in report.items() if k != "spans"}, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"config": vars(args), "report": report}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Separate planner call vs merged planning (`MERGED_PLANNING`) in `data_analyst_tool`, on fake or recorded LLMs.
+
+Usage:
+    python -m src.graphs.planning_benchmark [--questions 4] [--tables 2] [--steps 3] [--latency 0.8] [--json out.json]
+    python -m src.graphs.planning_benchmark --record session.json    # live Gemini calls, every response is recorded
+    python -m src.graphs.planning_benchmark --replay session.json    # offline replay of a recorded session
+
+Both paths run the real `data_analyst_tool` / `analyst_graph` / `python_code_executor` over synthetic tables; only the
+LLM clients are replaced (through `src.utils.resources.set_resource`). The default fake analyst runs `--steps` code
+executions and then answers, each call taking `--latency` seconds. A replay uses the recorded responses and latencies.
+
+Reports per path: wall latency (p50 / max), time to the first code execution, LLM round trips (serial calls before the
+first code execution, total calls), and quality indicators (code-execution errors, analyst iterations, plan steps,
+answer length). With fake LLMs the quality indicators only check the plumbing; record a live session to compare them.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from langchain_core.messages import AIMessage, ToolMessage
+
+from src.utils import tracing
+from src.utils.analyse_table import create_table_analysis
+from src.utils.fake_llms import RecordingRunnable, ScriptedChatModel, scripted_from_recording
+from src.utils.resources import llm_resource_name, reset_resource, set_resource
+from src.storage.json_stat_archive_db import JSONStatArchiveDB
+
+
+QUESTIONS = [
+    "What was the total for Dublin in the latest year?",
+    "How did the value change between the first and the last year?",
+    "Which county had the highest value in 2023?",
+    "What is the average value per year across all counties?",
+    "Compare Cork and Galway over the whole period.",
+    "Which year had the lowest total?",
+]
+PATHS = ("separate", "merged")
+
+
+# ---------- SCENARIO ----------
+
+def build_tables(folder: str, n_tables: int, seed: int = 0) -> Dict[str, str]:
+    """
+    Write synthetic CSO-like tables as CSVs and return {table_id: analyst context}.
+    """
+    rng = np.random.default_rng(seed)
+    counties = ["Dublin", "Cork", "Galway", "Limerick", "Waterford", "Kerry"]
+    contexts = {}
+    for i in range(n_tables):
+        table_id = f"BENCH{i:02d}"
+        df = pd.DataFrame(
+            [(year, county, int(rng.integers(1000, 100000))) for year in range(2015, 2025) for county in counties],
+            columns=["Year", "County", "VALUE"],
+        )
+        csv_fp = os.path.join(folder, f"{table_id}.csv")
+        df.to_csv(csv_fp, index=False)
+        contexts[table_id] = "\n".join([
+            f"**Table ID**: {table_id}",
+            f"**Table Name (and Category)**: Synthetic county totals {i} (Benchmark: Planning)",
+            f"**CSV File Path**: {csv_fp}",
+            f"**Statistics-Units**: \"Total\": (Number)",
+        ] + create_table_analysis(df, table_id))
+    return contexts
+
+
+def fake_analyst(steps: int):
+    """
+    Scripted analyst: `steps` code executions on the CSV of the context, then an answer (writing the plan first
+    under merged planning).
+    """
+    call_ids = iter(range(10**9))
+
+    def respond(messages) -> AIMessage:
+        prompt = "\n".join(m.content for m in messages if isinstance(m.content, str))
+        csv_fp = re.search(r"\*\*CSV File Path\*\*: (\S+)", prompt).group(1)
+        n_tool_outputs = sum(1 for m in messages if isinstance(m, ToolMessage))
+        if n_tool_outputs >= steps:
+            return AIMessage(content=f"Answer based on {n_tool_outputs} statistics: the total is 12345.")
+        tool_call = {
+            "name": "python_code_executor",
+            "args": {
+                # the value column is the last one (`VALUE` in CSO CSVs, `value` in pyjstat frames)
+                "code": f"import pandas as pd\ndf = pd.read_csv({csv_fp!r})\nprint(df[df.columns[-1]].describe().iloc[{n_tool_outputs % 8}])",
+                "description": f"Statistic {n_tool_outputs + 1}",
+            },
+            "id": f"call_{next(call_ids)}",
+            "type": "tool_call",
+        }
+        # merged planning: the first response also carries the plan
+        content = "1. Load the table\n2. Aggregate by year\n3. Answer" if "NO ANALYSIS-PLAN PROVIDED" in prompt and n_tool_outputs == 0 else ""
+        return AIMessage(content=content, tool_calls=[tool_call])
+
+    return respond
+
+
+def fake_planner(messages) -> Dict:
+    """
+    Scripted planner: a fixed 3-step plan for the table of the prompt.
+    """
+    table_id = re.search(r"\*\*Table ID\*\*: (\S+)", "\n".join(m.content for m in messages)).group(1)
+    return {"table_id": table_id, "analysis_plan": ["Load the table", "Aggregate by year", "Answer"]}
+
+
+def install_llms(mode: str, path: str, args, session: Dict) -> None:
+    """
+    Install the analyst / planner clients of a path: fakes, recorders around the live clients, or a replay.
+    """
+    if mode == "record":
+        from src.graphs.llms.gemini import get_llm
+        analyst = RecordingRunnable(get_llm(model="gemini-2.5-flash"))
+        planner = RecordingRunnable(get_llm(model="gemini-2.5-flash"))
+        session[path] = {"analyst": analyst.records, "planner": planner.records}
+        from src.graphs.agents.analyst_agent import TOOLS
+        analyst_with_tools = analyst.bind_tools(tools=TOOLS, allowed_function_names=["python_code_executor"])
+    else:
+        if mode == "replay":
+            analyst = ScriptedChatModel(script=scripted_from_recording(session[path]["analyst"]))
+            planner = ScriptedChatModel(structured_script=scripted_from_recording(session[path]["planner"]))
+        else:
+            analyst = ScriptedChatModel(script={"": [fake_analyst(args.steps)]}, latency=args.latency)
+            planner = ScriptedChatModel(structured_script={"": [fake_planner]}, latency=args.latency)
+        analyst_with_tools = analyst
+
+    from src.models.structured_outputs import AnalysisPlanSubModel
+    set_resource("analyst_llm_with_code_exec_tool", analyst_with_tools)
+    set_resource(llm_resource_name("gemini-2.5-flash"), analyst)
+    set_resource("planner_structured_llm", planner.with_structured_output(AnalysisPlanSubModel))
+
+
+# ---------- RUN ----------
+
+async def run_path(path: str, contexts: Dict[str, str], questions: List[str]) -> Dict:
+    from src.graphs.tools import reviewer_tools
+
+    reviewer_tools.MERGED_PLANNING = path == "merged"
+    reviewer_tools.PLAN_CACHE_ENABLED = False
+    rows = []
+    for question in questions:
+        tracing.reset()
+        state = {"relevant_tables_metadata": {t: {"context": c} for t, c in contexts.items()}, "reports": {}}
+        start = time.time()
+        command = await reviewer_tools.data_analyst_tool.coroutine(
+            table_ids=list(contexts), question=question, state=state, tool_call_id="planning-benchmark"
+        )
+        elapsed = time.time() - start
+
+        executions = tracing.recent_spans(limit=10**6, name="executor.run")
+        analyst_calls = tracing.recent_spans(limit=10**6, name="analyst.llm")
+        planner_calls = tracing.recent_spans(limit=10**6, name="planner.batch")
+        first_execution = min((s["start"] for s in executions), default=None)
+        answer = command.update["messages"][0].content
+        rows.append({
+            "latency_s": elapsed,
+            "first_execution_s": first_execution - start if first_execution else None,
+            # serial LLM round trips before the first code execution (the planner calls of all tables run concurrently)
+            "round_trips_before_code": (1 if planner_calls else 0) + 1,
+            "llm_calls": sum(s["attributes"].get("tables", 0) for s in planner_calls) + len(analyst_calls),
+            "execution_errors": sum(1 for s in executions if s["attributes"].get("failed")),
+            "analyst_iterations": len(analyst_calls),
+            "answer_chars": len(answer),
+        })
+
+    def stat(key, fn):
+        values = [r[key] for r in rows if r[key] is not None]
+        return round(float(fn(values)), 3) if values else None
+
+    return {
+        "path": path,
+        "questions": len(rows),
+        "latency_p50_s": stat("latency_s", np.median),
+        "latency_max_s": stat("latency_s", np.max),
+        "first_execution_p50_s": stat("first_execution_s", np.median),
+        "round_trips_before_code": stat("round_trips_before_code", np.mean),
+        "llm_calls_mean": stat("llm_calls", np.mean),
+        "execution_errors": stat("execution_errors", np.sum),
+        "analyst_iterations_mean": stat("analyst_iterations", np.mean),
+        "answer_chars_mean": stat("answer_chars", np.mean),
+    }
+
+
+async def main_async(args) -> List[Dict]:
+    session = {}
+    mode = "record" if args.record else "replay" if args.replay else "fake"
+    if mode == "replay":
+        with open(args.replay) as f:
+            session = json.load(f)
+
+    # no retrieval / archive access: the table contexts are already in the state
+    set_resource("retriever", None)
+    set_resource("archive_reader", JSONStatArchiveDB())
+
+    # a fixed folder: recorded code reads the CSVs from their recorded paths
+    os.makedirs(args.tables_dir, exist_ok=True)
+    contexts = build_tables(args.tables_dir, args.tables)
+    questions = (QUESTIONS * (args.questions // len(QUESTIONS) + 1))[:args.questions]
+    results = []
+    for path in PATHS:
+        install_llms(mode, path, args, session)
+        results.append(await run_path(path, contexts, questions))
+
+    for name in ("analyst_llm_with_code_exec_tool", llm_resource_name("gemini-2.5-flash"), "planner_structured_llm"):
+        reset_resource(name)
+    if mode == "record":
+        with open(args.record, "w") as f:
+            json.dump(session, f, indent=2)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=4)
+    parser.add_argument("--tables", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=3, help="code executions of the fake analyst")
+    parser.add_argument("--latency", type=float, default=0.8, help="seconds per fake LLM call")
+    parser.add_argument("--record", default=None, help="run on live Gemini and record the session to this file")
+    parser.add_argument("--replay", default=None, help="replay a recorded session")
+    parser.add_argument("--tables-dir", default="cache/planning_benchmark", help="where the synthetic CSVs are written")
+    parser.add_argument("--json", dest="json_path", default=None)
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    for row in results:
+        print(json.dumps(row))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import os
+import pandas as pd
 from typing import  Annotated, List, Dict
 from langgraph.types import Command
 from langchain_core.tools import tool
@@ -6,6 +8,9 @@ from langgraph.prebuilt import InjectedState
 from langchain_core.tools import tool, InjectedToolCallId
 
 from src.utils.python_runner import run_python_safely
+from src.utils.resources import get_shared_frames
+from src.utils.shared_frames import SHARED_FRAMES_ENABLED
+from src.utils.tracing import span, set_attributes
 
 
 @tool(name_or_callable="python_code_executor", parse_docstring=True)
@@ -26,7 +31,20 @@ def python_code_executor(
         str: The output of the executed code.
     """
     # print("Executing code in python_code_executor: ", description, "\n")
-    result = run_python_safely(code)
+    table_id = state.get("table_id")
+    with span("executor.run", table_id=table_id):
+        if SHARED_FRAMES_ENABLED and table_id:
+            # the prepared table, from the in-memory frame cache (loaded from the cached CSV if it was evicted)
+            csv_fp = f"cache/{table_id}.csv"
+
+            def _load_csv():
+                return pd.read_csv(csv_fp) if os.path.exists(csv_fp) else None
+
+            with get_shared_frames().attach(table_id, loader=_load_csv) as df:
+                result = run_python_safely(code, extra_globals={"df": df} if df is not None else None)
+        else:
+            result = run_python_safely(code)
+        set_attributes(stdout_chars=len(result.get("stdout", "")), failed="error" in result, truncated="output_path" in result)
 
     existing_reports : List[Dict] = state.get("report", [])
     
@@ -57,6 +75,9 @@ def python_code_executor(
             "code": code,
             "result": result.get("stdout", ""),
         }
+        if result.get("output_path"):
+            # the output was truncated to its head / tail: the full output is kept in the spill file
+            current_report["output_path"] = result["output_path"]
         existing_reports.append(current_report)
         return Command(
             update={
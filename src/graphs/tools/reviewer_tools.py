@@ -1,27 +1,78 @@
 import os
 import gc
+import asyncio
 import pandas as pd
 from pyjstat import pyjstat
 from textwrap import dedent
 from pyjstat import pyjstat
 from typing import List, Annotated
 from langgraph.types import Command
+from langgraph.config import get_config
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
 from langgraph.prebuilt import InjectedState
 from langchain_core.tools import tool, InjectedToolCallId
 
-from src.storage.json_stat_archive_db import JSONStatArchiveDB
 from src.utils.analyse_table import create_table_analysis
-from src.retrieval.hybrid_retrieval import HybridRetrieval
+from src.retrieval.context_store import CSV_PATH_PLACEHOLDER
+from src.utils.resources import (
+    get_archive_reader, get_blob_store, get_embeddings, get_resource, get_retriever, get_shared_frames, get_shared_llm
+)
+from src.utils.shared_frames import SHARED_FRAMES_ENABLED
+from src.utils.tracing import span, record_token_usage
+from src.utils.message_compaction import estimate_tokens
 from src.models.structured_outputs import AnalysisPlanSubModel
+from src.storage.semantic_cache import SemanticCache
+from src.storage.blob_store import resolve_report
+from src.utils.single_flight import AsyncSingleFlight, atomic_write
 from src.graphs.analyst_graph import analyst_graph
-from src.graphs.llms.gemini import get_llm
 
 
-retriever = HybridRetrieval(top_k_stage_1=200, top_k_stage_2=20)
-cso_archive_reader = JSONStatArchiveDB(compression_level=12)
-llm = get_llm(model="gemini-2.5-flash")
+CSO_ARCHIVE_PATH = "artifacts/cso_bkp/cso_archive/jsonstat_archive.sqlite"
+CSV_SAVE_DIR = "cache/"
+
+# Planner: concurrent structured-output calls (one per table), and plans reused for similar questions on a table
+PLANNER_MAX_CONCURRENCY = int(os.environ.get("PLANNER_MAX_CONCURRENCY", "4"))
+PLAN_CACHE_ENABLED = os.environ.get("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_THRESHOLD = float(os.environ.get("PLAN_CACHE_THRESHOLD", "0.95"))
+# Merged planning: skip the planner call, the analyst's first response writes the plan along with its first tool-call
+MERGED_PLANNING = os.environ.get("MERGED_PLANNING", "false").lower() == "true"
+
+# Concurrent preparations of the same table version (several sessions asking about it at once) share one run
+_table_flight = AsyncSingleFlight()
+
+PLANNER_SYSTEM_MESSAGE = dedent(
+    """\
+        # ROLE: I am a planner agent.
+
+        # RETURN FORMAT (Pydantic):
+            - table_id: str = Field(description="The ID of the table.")
+            - analysis_plan: list[str] = Field(description="The low-level analysis plan for the table-ID. Contains a list of steps.")
+
+        # INSTRUCTIONS:
+        - Create a high-level plan for the data-analyst agent to carry out its analysis step-by-step.
+        - Be concise, do not go over 3-4 steps.
+    """
+)
+
+
+def _get_planner():
+    return get_resource(
+        "planner_structured_llm",
+        lambda: get_shared_llm(model="gemini-2.5-flash").with_structured_output(AnalysisPlanSubModel),
+    )
+
+
+def _get_plan_cache() -> SemanticCache:
+    # plans are namespaced by table-ID and invalidated when the table is updated in the archive
+    return get_resource(
+        "plan_cache",
+        lambda: SemanticCache(
+            embedder=get_embeddings(),
+            threshold=PLAN_CACHE_THRESHOLD,
+            dependency_resolver=lambda table_ids: get_archive_reader().read_timestamps(CSO_ARCHIVE_PATH, table_ids),
+        ),
+    )
 
 @tool("hybrid_retrieval_tool", parse_docstring=True)
 def hybrid_retrieval_tool(
@@ -37,7 +88,7 @@ def hybrid_retrieval_tool(
     Returns:
         Command: The command to update the chat with the relevant table IDs.
     """
-    relevant_tables_ids = retriever.search(query=user_prompt)
+    relevant_tables_ids = get_retriever().search(query=user_prompt)
 
     if not relevant_tables_ids:
         return Command(
@@ -68,6 +119,51 @@ def hybrid_retrieval_tool(
         )
 
 
+def prepare_table_context(table_id: str) -> str:
+    """
+    Build the analyst context of a table: the JSON-Stat metadata block and the profile of its cached CSV (decoded from
+    the archive and written atomically on first use). The decoded table is also published for the code executor.
+
+    Args:
+        table_id (str): The table-ID.
+
+    Returns:
+        str: The context of the table.
+    """
+    csv_fp = CSV_SAVE_DIR + f"{table_id}.csv"
+
+    # check if "<table_id>.csv" exists. If not, read the pyjstat-file from artifacts and save the DataFrame as "<table_id>.csv"
+    if not os.path.exists(csv_fp):
+        with span("archive.read", table_id=table_id):
+            datasets = [ds for _, ds, _ in get_archive_reader().read(CSO_ARCHIVE_PATH, table_id=table_id, with_labels=True)]
+        with span("jsonstat.decode", table_id=table_id):
+            df: pd.DataFrame = pyjstat.from_json_stat(datasets[-1])[0]
+        del datasets
+        # written to a temporary file and renamed: a concurrent reader never sees a partial CSV
+        with span("table.write_csv", table_id=table_id, rows=len(df)):
+            atomic_write(csv_fp, lambda tmp_fp: df.to_csv(tmp_fp, index=False))
+    else:
+        with span("table.read_csv", table_id=table_id):
+            df = pd.read_csv(csv_fp)
+
+    # create analysis context from the CSV file
+    with span("table.profile", table_id=table_id, rows=len(df)):
+        csv_context_list = create_table_analysis(df, table_id)
+
+    # hand the decoded table to the code executor (preloaded as `df`) instead of re-parsing the CSV there
+    if SHARED_FRAMES_ENABLED:
+        with span("table.cache_frame", table_id=table_id, rows=len(df)):
+            get_shared_frames().publish(table_id, df, version=os.path.getmtime(csv_fp))
+
+    # create analysis context from the JSON-Stat file metadata (pre-rendered at index-build time)
+    metadata_context, _ = get_retriever().get_context_blocks([table_id], kind="metadata")[table_id]
+    json_context_list = [metadata_context.replace(CSV_PATH_PLACEHOLDER, csv_fp)]
+
+    del df
+    gc.collect()
+    return "\n".join(json_context_list + csv_context_list)
+
+
 @tool("data_analyst_tool", parse_docstring=True)
 async def data_analyst_tool(
     table_ids: List[str],
@@ -101,98 +197,116 @@ async def data_analyst_tool(
             }
         )
     
-    # step-1: prepare the static context for the data-analyst agent, if not already done
-    csv_save_dir = "cache/"
+    cso_archive_reader = get_archive_reader()
+    blob_store = get_blob_store()
+
+    # step-1: prepare the static context for the data-analyst agent, if not already done (the state holds blob
+    # references to the contexts; inline contexts of older states are used as-is). Concurrent requests for the same
+    # table version share one preparation.
     contexts_dict = {}
     relevant_tables_metadata = {}
+    timestamps = await asyncio.to_thread(cso_archive_reader.read_timestamps, CSO_ARCHIVE_PATH, table_ids)
 
     for table_id in table_ids:
-        if state["relevant_tables_metadata"][table_id].get("context", None):
-            relevant_tables_metadata[table_id]["context"] = state["relevant_tables_metadata"][table_id]["context"]
+        stored_context = state["relevant_tables_metadata"][table_id].get("context", None)
+        if stored_context:
+            stored_context = await asyncio.to_thread(blob_store.resolve, stored_context)
+        if stored_context:
+            contexts_dict[table_id] = stored_context
         else:
-            csv_fp = csv_save_dir + f"{table_id}.csv"
-
-            # check if "<table_id>.csv" exists. If not, read the pyjstat-file from artifacts and save the DataFrame as "<table_id>.csv"
-            if not os.path.exists(csv_fp):
-                for _, ds, _ in cso_archive_reader.read("artifacts/cso_bkp/cso_archive/jsonstat_archive.sqlite", table_id=table_id, with_labels=True):
-                    df: pd.DataFrame = pyjstat.from_json_stat(ds)[0]
-                df.to_csv(csv_fp, index=False)
-            else:
-                df = pd.read_csv(csv_fp)
-            
-            # create analysis context from the CSV file
-            csv_context_list = create_table_analysis(df, table_id)
-
-            # create analysis context from the JSON-Stat file metadata (stored in the vector-store)
-            doc = retriever.vector_store.docstore.search(table_id)
-            json_context_list = [
-                f"**Table ID**: {doc.id}",
-                f"**Table Name (and Category)**: {doc.metadata['table_name']} ({doc.metadata['subject']}: {doc.metadata['product']})",
-                f"**CSV File Path**: {csv_fp}",
-                f"**Statistics-Units**: {', '.join(doc.metadata['statistics_units'])}",
-            ]
-
-            contexts_dict[table_id] = "\n".join(json_context_list + csv_context_list)
-
-            del df
-            gc.collect()
-
-            relevant_tables_metadata[table_id] = {
-                "context": contexts_dict[table_id]
-            }
+            contexts_dict[table_id] = await _table_flight.do(
+                (table_id, timestamps.get(table_id)),
+                lambda table_id=table_id: asyncio.to_thread(prepare_table_context, table_id),
+            )
+        relevant_tables_metadata[table_id] = {"context": contexts_dict[table_id]}
 
     
-    # step-2: prepare the plan for the data-analyst agent, overwriting any existing plan
-    system_message = dedent(
-        """\
-            # ROLE: I am a planner agent.
-
-            # RETURN FORMAT (Pydantic):
-                - table_id: str = Field(description="The ID of the table.")
-                - analysis_plan: list[str] = Field(description="The low-level analysis plan for the table-ID. Contains a list of steps.")
-
-            # INSTRUCTIONS:
-            - Create a high-level plan for the data-analyst agent to carry out its analysis step-by-step.
-            - Be concise, do not go over 3-4 steps.
-        """
-    )
+    # step-2: prepare the plan for the data-analyst agent, overwriting any existing plan (reusing cached plans of
+    # similar questions on the same table)
+    plan_cache = _get_plan_cache() if PLAN_CACHE_ENABLED else None
+    question_vector = await asyncio.to_thread(plan_cache.embed, question) if plan_cache else None
 
-    inputs = []
+    tables_to_plan = []
     for table_id in table_ids:
-        context = contexts_dict[table_id]
-        human_message = f"Question : {question}\n\n Context:\n{context}"
-        inputs.append((SystemMessage(content=system_message, name="planner_agent"), HumanMessage(content=human_message, name="user")))
-
-    msgs = llm.with_structured_output(AnalysisPlanSubModel).batch(inputs)
-
-    res_list = [msg.model_dump() for msg in msgs]
-
-    for res_dict in res_list:
-        table_id = res_dict["table_id"]
-        analysis_plan = res_dict["analysis_plan"]
-
-        if table_id in table_ids:
+        # the lookup checks the table's archive timestamp (SQLite): off the event loop, like the embedding
+        hit = await asyncio.to_thread(plan_cache.lookup, question, namespace=table_id, vector=question_vector) if plan_cache else None
+        if hit:
+            relevant_tables_metadata[table_id]["analysis_plan"] = hit[0]["analysis_plan"]
+        else:
+            tables_to_plan.append(table_id)
+
+    if MERGED_PLANNING:
+        for table_id in tables_to_plan:
+            relevant_tables_metadata[table_id]["analysis_plan"] = ""
+    elif tables_to_plan:
+        inputs = []
+        for table_id in tables_to_plan:
+            context = contexts_dict[table_id]
+            human_message = f"Question : {question}\n\n Context:\n{context}"
+            inputs.append([SystemMessage(content=PLANNER_SYSTEM_MESSAGE, name="planner_agent"), HumanMessage(content=human_message, name="user")])
+
+        with span("planner.batch", tables=len(inputs), cached=len(table_ids) - len(inputs)):
+            record_token_usage(estimated_input_tokens=sum(estimate_tokens(msgs) for msgs in inputs))
+            msgs = await _get_planner().abatch(inputs, config={"max_concurrency": PLANNER_MAX_CONCURRENCY})
+
+        # `abatch` keeps the input order, so each plan belongs to its input's table
+        for table_id, msg in zip(tables_to_plan, msgs):
+            analysis_plan = msg.model_dump()["analysis_plan"]
             relevant_tables_metadata[table_id]["analysis_plan"] = analysis_plan
-    
+            if plan_cache:
+                await asyncio.to_thread(
+                    plan_cache.store,
+                    question,
+                    {"analysis_plan": analysis_plan},
+                    namespace=table_id,
+                    dependencies={table_id: timestamps.get(table_id)},
+                    vector=question_vector,
+                )
+
 
     # step-3: invoke the data-analyst agent asynchronously in batch-mode
     batch = []
     for table_id in table_ids:
         context = relevant_tables_metadata[table_id]["context"]
         analysis_plan = relevant_tables_metadata[table_id]["analysis_plan"]
-        batch.append(
-            {"table_id": table_id, "question": question, "context": context, "analysis_plan": analysis_plan}
-        )
-    responses = await analyst_graph.abatch(batch)
+        batch.append({
+            "table_id": table_id,
+            "question": question,
+            "context": context,
+            "analysis_plan": analysis_plan,
+            # cross-table questions: the analyst can align this table with the others (`align_tables`)
+            "related_table_ids": [other for other in table_ids if other != table_id],
+        })
+    with span("analysis.batch", tables=len(batch)):
+        responses = await analyst_graph.abatch(batch)
+
+    if MERGED_PLANNING and plan_cache and tables_to_plan:
+        for table_id, response in zip(table_ids, responses):
+            if table_id in tables_to_plan and response.get("analysis_plan"):
+                await asyncio.to_thread(
+                    plan_cache.store,
+                    question,
+                    {"analysis_plan": response["analysis_plan"]},
+                    namespace=table_id,
+                    dependencies={table_id: timestamps.get(table_id)},
+                    vector=question_vector,
+                )
 
-    # step-4: prepare the final response to return
+    # step-4: prepare the final response to return. The checkpointed state only keeps blob references to the reports
+    # and contexts, which `provenance_tool` / the next analysis resolve lazily
+    # the blobs are owned by the thread, and deleted when it is reset (see `BlobStore.release`)
+    thread_id = get_config().get("configurable", {}).get("thread_id")
     content = []
-    reports_dict = state.get("reports", {})
+    reports_dict = dict(state.get("reports", {}))
+    tables_metadata = dict(state["relevant_tables_metadata"])
 
     for i in range(len(responses)):
         table_id = batch[i]["table_id"]
         response = responses[i]
-        reports_dict[table_id] = reports_dict.get(table_id, []) + response["report"]
+        report_refs = await asyncio.to_thread(blob_store.put_many, response["report"], thread_id)
+        reports_dict[table_id] = reports_dict.get(table_id, []) + report_refs
+        context_ref = await asyncio.to_thread(blob_store.put, contexts_dict[table_id], thread_id)
+        tables_metadata[table_id] = {**tables_metadata.get(table_id, {}), "context": context_ref}
         content.append(f"### Analysis for Table ID: {table_id}\n")
         content.append(response["messages"][-1].content)
         content.append("")
@@ -208,7 +322,8 @@ async def data_analyst_tool(
                     name="data_analyst_tool",
                 )
             ],
-            "reports": reports_dict
+            "reports": reports_dict,
+            "relevant_tables_metadata": tables_metadata,
         }
     )
 
@@ -231,12 +346,15 @@ def provenance_tool(
     """
     report_text_list = []
     reports_dict = state.get("reports", {})
-    report = reports_dict.get(table_id, [])
+    report = resolve_report(reports_dict.get(table_id, []), get_blob_store())
 
     for i, entry in enumerate(report):
         report_text_list.append(f"### Task {i+1}: {entry['task']}\n")
         report_text_list.append(f"**Code:**\n```python\n{entry['code']}\n```")
         report_text_list.append(f"**Output:**\n```python\n{entry['result']}\n```")
+        if entry.get("output_path"):
+            # the spill file is a server path: only say that the output shown is partial
+            report_text_list.append("*The output was truncated: only its head and tail are shown.*")
         report_text_list.append("")
 
     report_text = "\n".join(report_text_list)
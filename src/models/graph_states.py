@@ -1,5 +1,4 @@
-
-from typing import List, Dict, Annotated
+from typing import List, Dict, Annotated, Optional, Union
 from pydantic import BaseModel, Field
 from typing_extensions import TypedDict
 from langgraph.graph.message import add_messages
@@ -11,6 +10,7 @@ class ReportModel(BaseModel):
     task: str = Field(description="The task to be performed by the data-analysis agent.")
     code: str = Field(description="The code to be executed by the data-analysis agent that performs the requested task.")
     result: str = Field(description="The result of code execution.")
+    output_path: Optional[str] = Field(default=None, description="The file holding the full output, when the result was truncated.")
 
 
 class AnalystSubgraphState(TypedDict):
@@ -20,8 +20,10 @@ class AnalystSubgraphState(TypedDict):
     question: str = Field(description="The question asked by the user.")
     analysis_plan: str = Field(description="The rough analysis plan for the agent to follow.")
     context: str = Field(default=None, description="The context for the agent to use.")
+    related_table_ids: List[str] = Field(default=[], description="The other tables analysed for the same question.")
     iters: int = Field(default=0, description="The number of iterations the agent has gone through.")
     report: List[ReportModel] = Field(default=[], description="The report generated by the agent.")
+    prompt_tokens: List[int] = Field(default=[], description="The prompt-token count sent to the LLM on each iteration.")
 
 
 class RelevantTablesModel(BaseModel):
@@ -38,5 +40,5 @@ class ParentState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages] = Field(default=[], description="The messages for the parent graph.")
     question: str = Field(default=None, description="The question asked by the user.")
     iter: int = Field(default=0, description="The iteration count for the current state.")
-    relevant_tables_metadata: List[RelevantTablesModel] = Field(default=[], description="List of relevant table IDs, their contexts, and analysis plans.")
-    reports: Dict[str, List[ReportModel]] = Field(default={}, description="Dictionary mapping table IDs to their analysis reports.")
\ No newline at end of file
+    relevant_tables_metadata: List[RelevantTablesModel] = Field(default=[], description="List of relevant table IDs, their contexts (blob references), and analysis plans.")
+    reports: Dict[str, List[Union[str, ReportModel]]] = Field(default={}, description="Dictionary mapping table IDs to their analysis reports (blob references, see `src.storage.blob_store`; inline entries in older states).")
\ No newline at end of file
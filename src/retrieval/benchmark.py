@@ -0,0 +1,286 @@
+"""
+Retrieval quality + latency benchmark for `HybridRetrieval`.
+
+Usage:
+    python -m src.retrieval.benchmark [--questions labelled.jsonl ...] [--n-docstore-questions 200]
+                                      [--embeddings cached|gemini|hashing] [--stage-2-variant sq8 [--rerank-k 0]]
+                                      [--out results.json] [--baseline previous.json]
+    python -m src.retrieval.benchmark --synthetic-docs 5000 --embeddings hashing   # without the real artifacts
+
+The labelled set is the union of the given JSONL files (`{"question": str, "table_ids": [...]}`; lines without
+labels, e.g. backlog entries, are only used for latency) and questions sampled from the `sample_questions` of the
+docstore metadata. Stage 3 is replaced by a stub that keeps the stage-2 order, so no LLM quota is used; embeddings
+come from an on-disk cache (`cached`, filled by a `gemini` run), the live API (`gemini`), or `hashing` (offline).
+
+Reports per-stage p50/p95 latency, peak traced memory and recall@k / MRR of stages 1, 2 and 3, and a sweep of the
+stage-3 skip margin (`CLEAR_WINNER_MARGIN`: skip rate and precision of the skipped questions), as JSON.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.retrieval.hybrid_retrieval import HybridRetrieval, TableSelection, TableSelectionSubclass
+from src.retrieval.compressed_index import sample_questions_from_docstore
+
+
+class StubTableSelector:
+    """
+    Stage-3 stand-in: "selects" the first `n` candidate tables of the prompt, i.e. keeps the stage-2 order.
+    """
+
+    def __init__(self, n: int = 5, latency: float = 0.0):
+        self.n = n
+        self.latency = latency
+
+    def with_structured_output(self, schema):
+        return self
+
+    def invoke(self, prompt: str) -> TableSelection:
+        if self.latency:
+            time.sleep(self.latency)
+        table_ids = re.findall(r"\*\*Table ID\*\*: (\S+)", prompt)[:self.n]
+        return TableSelection(
+            relevant_tables=[TableSelectionSubclass(table_id=t, explanation="stub") for t in table_ids]
+        )
+
+
+def load_question_set(paths: List[str]) -> List[Dict]:
+    """
+    Load questions from JSONL files. Accepts `question` (or `title` + `body`) and optional `table_ids`.
+    """
+    questions = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                text = item.get("question") or " ".join(p for p in (item.get("title"), item.get("body")) if p)
+                if text:
+                    questions.append({"question": text, "table_ids": list(item.get("table_ids") or [])})
+    return questions
+
+
+def recall_at_k(ranked: List[str], expected: List[str], k: int) -> float:
+    return len(set(ranked[:k]) & set(expected)) / len(expected)
+
+
+def reciprocal_rank(ranked: List[str], expected: List[str]) -> float:
+    for rank, table_id in enumerate(ranked, start=1):
+        if table_id in expected:
+            return 1 / rank
+    return 0.0
+
+
+def _timed(fn, *args):
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    return result, elapsed, tracemalloc.get_traced_memory()[1]
+
+
+def run_benchmark(
+    retriever: HybridRetrieval, questions: List[Dict], ks: List[int], margins: List[float] = (0.05, 0.1, 0.15, 0.2, 0.3)
+) -> Dict:
+    """
+    Run every question through the three stages, timing each stage separately.
+    """
+    timings = {"stage_1": [], "stage_2": [], "stage_3": [], "total": []}
+    n_stage_3_skipped, stage_3_candidates = 0, []
+    peaks = {"stage_1": 0, "stage_2": 0, "stage_3": 0}
+    ranked_lists = {"stage_1": [], "stage_2": [], "stage_3": []}
+    gaps, top_candidates = [], []
+
+    tracemalloc.start()
+    try:
+        for q in questions:
+            stage_1, t1, m1 = _timed(retriever._stage_1, q["question"])
+            stage_2, t2, m2 = _timed(retriever._stage_2, q["question"], list(stage_1))
+            candidates = retriever._select_candidates(stage_1, stage_2)
+            winner = retriever._clear_winner(stage_1, stage_2, candidates) if candidates else None
+            gaps.append(retriever._clear_winner_gap(stage_1, stage_2, candidates) if candidates else None)
+            top_candidates.append(candidates[:retriever.top_k_stage_2])
+            if winner is not None:
+                n_stage_3_skipped += 1
+                stage_3, t3, m3 = candidates[:retriever.top_k_stage_2], 0.0, 0
+            elif candidates:
+                packed = retriever._pack_candidates(candidates)
+                stage_3_candidates.append(len(packed))
+                stage_3, t3, m3 = _timed(retriever._stage_3, q["question"], packed)
+            else:
+                stage_3, t3, m3 = [], 0.0, 0
+
+            for name, t, m in (("stage_1", t1, m1), ("stage_2", t2, m2), ("stage_3", t3, m3)):
+                timings[name].append(t)
+                peaks[name] = max(peaks[name], m)
+            timings["total"].append(t1 + t2 + t3)
+            ranked_lists["stage_1"].append(sorted(stage_1, key=stage_1.get, reverse=True))
+            ranked_lists["stage_2"].append(sorted(stage_2, key=stage_2.get))
+            ranked_lists["stage_3"].append(stage_3)
+    finally:
+        tracemalloc.stop()
+
+    labelled = [i for i, q in enumerate(questions) if q["table_ids"]]
+    report = {
+        "n_questions": len(questions),
+        "n_labelled": len(labelled),
+        "stage_3_skipped": n_stage_3_skipped,
+        "stage_3_mean_candidates": round(float(np.mean(stage_3_candidates)), 2) if stage_3_candidates else None,
+        "stages": {},
+    }
+    for name in ("stage_1", "stage_2", "stage_3", "total"):
+        stats = {
+            "p50_ms": round(float(np.percentile(timings[name], 50)) * 1000, 3) if timings[name] else None,
+            "p95_ms": round(float(np.percentile(timings[name], 95)) * 1000, 3) if timings[name] else None,
+        }
+        if name in ranked_lists:
+            stats["peak_traced_mb"] = round(peaks[name] / 2**20, 2)
+            for k in ks:
+                stats[f"recall@{k}"] = round(float(np.mean([
+                    recall_at_k(ranked_lists[name][i], questions[i]["table_ids"], k) for i in labelled
+                ])), 4) if labelled else None
+            stats["mrr"] = round(float(np.mean([
+                reciprocal_rank(ranked_lists[name][i], questions[i]["table_ids"]) for i in labelled
+            ])), 4) if labelled else None
+        report["stages"][name] = stats
+    report["stage_2_top1_precision"] = round(float(np.mean([
+        bool(top_candidates[i]) and top_candidates[i][0] in questions[i]["table_ids"] for i in labelled
+    ])), 4) if labelled else None
+    report["clear_winner_sweep"] = clear_winner_sweep(gaps, top_candidates, questions, margins)
+    return report
+
+
+def clear_winner_sweep(
+    gaps: List[Optional[float]], top_candidates: List[List[str]], questions: List[Dict], margins: List[float]
+) -> List[Dict]:
+    """
+    For each candidate `CLEAR_WINNER_MARGIN`: the share of questions that would skip stage 3, and on the labelled
+    skipped questions, how often the winner (top-1) and the returned top `top_k_stage_2` hold an expected table.
+    A margin is safe when its skipped questions are clearly more precise than `stage_2_top1_precision` (the top-1 over
+    all the questions).
+    """
+    rows = []
+    for margin in margins:
+        skipped = [i for i, gap in enumerate(gaps) if gap is not None and gap >= margin]
+        labelled = [i for i in skipped if questions[i]["table_ids"]]
+        rows.append({
+            "margin": margin,
+            "skip_rate": round(len(skipped) / len(gaps), 4) if gaps else None,
+            "n_labelled_skipped": len(labelled),
+            "winner_precision": round(float(np.mean([
+                top_candidates[i][0] in questions[i]["table_ids"] for i in labelled
+            ])), 4) if labelled else None,
+            "top_k_recall": round(float(np.mean([
+                recall_at_k(top_candidates[i], questions[i]["table_ids"], len(top_candidates[i])) for i in labelled
+            ])), 4) if labelled else None,
+        })
+    return rows
+
+
+def compare_reports(current: Dict, baseline: Dict) -> List[str]:
+    """
+    Human-readable deltas of every numeric stage metric against a previous run.
+    """
+    lines = []
+    for stage, stats in current["stages"].items():
+        for metric, value in stats.items():
+            old = baseline.get("stages", {}).get(stage, {}).get(metric)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                lines.append(f"{stage:8} {metric:16} {old:>10} -> {value:>10} ({value - old:+.4f})")
+    return lines
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", nargs="*", default=[])
+    parser.add_argument("--n-docstore-questions", type=int, default=200)
+    parser.add_argument("--embeddings", choices=["cached", "gemini", "hashing"], default="cached")
+    parser.add_argument("--embeddings-cache", default="cache/retrieval_eval/benchmark_embeddings.npz")
+    parser.add_argument("--artifacts-dir", default="artifacts")
+    parser.add_argument("--synthetic-docs", type=int, default=0, help="benchmark on synthetic artifacts of this size")
+    parser.add_argument("--top-k-stage-1", type=int, default=200)
+    parser.add_argument("--top-k-stage-2", type=int, default=20)
+    parser.add_argument("--stage-2-variant", default=None)
+    parser.add_argument("--rerank-k", type=int, default=None, help="0 serves the variant without the exact re-rank")
+    parser.add_argument("--stage-3-token-budget", type=int, default=None)
+    parser.add_argument("--clear-winner-margin", type=float, default=None)
+    parser.add_argument("--sweep-margins", type=float, nargs="+", default=[0.05, 0.1, 0.15, 0.2, 0.3],
+                        help="CLEAR_WINNER_MARGIN values to report skip rate / precision for")
+    parser.add_argument("--no-mmap", action="store_true")
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 20, 200])
+    parser.add_argument("--out", default=None, help="write the JSON report here")
+    parser.add_argument("--baseline", default=None, help="previous JSON report to compare against")
+    args = parser.parse_args()
+
+    from src.retrieval.local_embeddings import CachedEmbeddings, HashingEmbeddings
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        artifacts_dir = args.artifacts_dir
+        if args.synthetic_docs:
+            from src.retrieval.memory_report import build_synthetic_artifacts
+            artifacts_dir = tmp_dir
+            build_synthetic_artifacts(artifacts_dir, args.synthetic_docs, dim=256)
+
+        if args.embeddings == "hashing":
+            embeddings = HashingEmbeddings()
+        elif args.embeddings == "gemini":
+            from src.utils.resources import get_embeddings
+            embeddings = CachedEmbeddings(args.embeddings_cache, inner=get_embeddings())
+        else:
+            embeddings = CachedEmbeddings(args.embeddings_cache)
+
+        retriever = HybridRetrieval(
+            top_k_stage_1=args.top_k_stage_1,
+            top_k_stage_2=args.top_k_stage_2,
+            embeddings=embeddings,
+            llm=StubTableSelector(),
+            artifacts_dir=artifacts_dir,
+            mmap=not args.no_mmap,
+            stage_2_variant=args.stage_2_variant,
+            rerank_k=args.rerank_k,
+            stage_3_token_budget=args.stage_3_token_budget,
+            clear_winner_margin=args.clear_winner_margin,
+        )
+        if isinstance(embeddings, HashingEmbeddings):
+            embeddings.dim = retriever.vector_store.index.d
+
+        questions = load_question_set(args.questions) + sample_questions_from_docstore(
+            retriever.vector_store.docstore, n=args.n_docstore_questions
+        )
+        report = run_benchmark(retriever, questions, args.k, args.sweep_margins)
+
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings.save()
+    report["config"] = {key: value for key, value in vars(args).items() if key not in ("out", "baseline")}
+    report["commit"] = _git_commit()
+    report["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    print(json.dumps({key: report[key] for key in ("stage_3_skipped", "stage_3_mean_candidates", "stages", "stage_2_top1_precision", "clear_winner_sweep")}, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            print("\n".join(compare_reports(report, json.load(f))))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""
+Build and evaluate reduced-size variants of the stage-2 FAISS index.
+
+Usage:
+    python -m src.retrieval.compressed_index build --variants mrl768 mrl1536 sq8 mrl1536-sq8 pq96
+    python -m src.retrieval.compressed_index evaluate --variants mrl768 sq8 pq96 [--questions labelled.jsonl] [--k 20]
+                                                      [--top-k-stage-1 200] [--rerank-k 60]
+
+Variant specs are `[mrl<dim>-]<codec>`:
+    - `mrl<dim>`: Matryoshka truncation of the `gemini-embedding-001` vectors to the first <dim> dims (re-normalised)
+    - codec: `flat` (float32), `sq8` / `sq4` (scalar quantization), `pq<m>` (product quantization, m sub-quantizers)
+
+Each variant is written to `<faiss_index>_<variant>/index.faiss` with a `variant.json`, keeping the vector positions
+of the exact index (so its `index.pkl` docstore mapping is reused). `HybridRetrieval(stage_2_variant=...)` scores the
+stage-1 candidates on the variant and re-ranks the best of them on the exact (memory-mapped) vectors; that path still
+maps the exact index, so it only cuts the vectors read per query. With `rerank_k=0` (STAGE_2_RERANK_K=0) the variant
+is the served stage-2 index and the exact `index.faiss` is never mapped, which is where the memory is saved.
+
+`evaluate` measures that path: the BM25 stage-1 candidates of each question ranked by the exact index, by each
+variant with the exact re-rank, and by each variant alone, with the size of the index files each path maps.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+EXACT_INDEX_DIR = "artifacts/cso_smry/faiss_index"
+
+
+def parse_variant(spec: str) -> Tuple[Optional[int], str]:
+    """
+    Parse a variant spec into (truncated dimension or None, codec).
+    """
+    parts = spec.lower().split("-")
+    dim = None
+    if parts[0].startswith("mrl"):
+        dim = int(parts[0][3:])
+        parts = parts[1:]
+    codec = parts[0] if parts else "flat"
+    if codec not in ("flat", "sq8", "sq4") and not (codec.startswith("pq") and codec[2:].isdigit()):
+        raise ValueError(f"Unknown codec in variant '{spec}': {codec}")
+    return dim, codec
+
+
+def prepare_vectors(vectors: np.ndarray, dim: Optional[int]) -> np.ndarray:
+    """
+    Apply the Matryoshka truncation (first `dim` dims, L2 re-normalised) of a variant, if any.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if dim is None or dim >= vectors.shape[-1]:
+        return vectors
+    truncated = np.ascontiguousarray(vectors[..., :dim])
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    return truncated / np.where(norms == 0, 1, norms)
+
+
+def variant_dir(spec: str, exact_dir: str = EXACT_INDEX_DIR) -> str:
+    return f"{exact_dir.rstrip('/')}_{spec.lower()}"
+
+
+def load_variant(spec: str, exact_dir: str = EXACT_INDEX_DIR, mmap: bool = True):
+    """
+    Load a built variant. Returns (faiss index, truncated dimension or None).
+    """
+    import faiss
+
+    folder = variant_dir(spec, exact_dir)
+    with open(os.path.join(folder, "variant.json")) as f:
+        meta = json.load(f)
+    flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    return faiss.read_index(os.path.join(folder, "index.faiss"), flags), meta["dim"]
+
+
+def build_variant(spec: str, exact_dir: str = EXACT_INDEX_DIR, train_size: int = 20000, chunk_size: int = 10000) -> Dict:
+    """
+    Build one variant from the exact index, reading the exact vectors in chunks (bounded memory).
+    """
+    import faiss
+
+    dim, codec = parse_variant(spec)
+    exact = faiss.read_index(os.path.join(exact_dir, "index.faiss"), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    n = exact.ntotal
+    out_dim = dim or exact.d
+    factory = {"flat": "Flat", "sq8": "SQ8", "sq4": "SQ4"}.get(codec) or f"PQ{codec[2:]}"
+    index = faiss.index_factory(out_dim, factory, faiss.METRIC_L2)
+
+    start = time.time()
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(n, size=min(train_size, n), replace=False))
+        index.train(prepare_vectors(exact.reconstruct_batch(sample.astype("int64")), dim))
+    for lo in range(0, n, chunk_size):
+        index.add(prepare_vectors(exact.reconstruct_n(lo, min(chunk_size, n - lo)), dim))
+
+    folder = variant_dir(spec, exact_dir)
+    os.makedirs(folder, exist_ok=True)
+    faiss.write_index(index, os.path.join(folder, "index.faiss"))
+    meta = {"variant": spec, "dim": dim, "codec": codec, "factory": factory, "ntotal": int(index.ntotal),
+            "source": exact_dir, "build_seconds": round(time.time() - start, 2)}
+    with open(os.path.join(folder, "variant.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    meta["size_mb"] = round(os.path.getsize(os.path.join(folder, "index.faiss")) / 2**20, 1)
+    return meta
+
+
+# ---------- EVALUATION ----------
+
+def load_labelled_questions(path: str) -> List[Dict]:
+    """
+    Load a labelled question set: JSONL lines of `{"question": str, "table_ids": [str, ...]}`.
+    """
+    questions = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                item = json.loads(line)
+                if item.get("question") and item.get("table_ids"):
+                    questions.append({"question": item["question"], "table_ids": list(item["table_ids"])})
+    return questions
+
+
+def sample_questions_from_docstore(docstore, n: int = 200, seed: int = 0) -> List[Dict]:
+    """
+    Build a labelled question set from the `sample_questions` stored in the docstore metadata (one per table).
+    """
+    rng = np.random.default_rng(seed)
+    docs = list(docstore._dict.values())
+    picked = rng.choice(len(docs), size=min(n, len(docs)), replace=False) if docs else []
+    questions = []
+    for i in picked:
+        doc = docs[int(i)]
+        samples = doc.metadata.get("sample_questions") or []
+        if samples:
+            questions.append({"question": samples[int(rng.integers(len(samples)))], "table_ids": [doc.metadata["id"]]})
+    return questions
+
+
+def embed_questions(questions: List[Dict], embeddings, cache_dir: Optional[str] = None) -> np.ndarray:
+    """
+    Embed the questions, caching the matrix on disk (keyed by the question texts) to save API quota across runs.
+    """
+    texts = [q["question"] for q in questions]
+    cache_fp = None
+    if cache_dir:
+        key = hashlib.sha1(json.dumps([type(embeddings).__name__] + texts).encode("utf-8")).hexdigest()[:16]
+        cache_fp = os.path.join(cache_dir, f"question_embeddings_{key}.npy")
+        if os.path.exists(cache_fp):
+            return np.load(cache_fp)
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype="float32")
+    if cache_fp:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_fp, vectors)
+    return vectors
+
+
+def _percentile_ms(samples: List[float], q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 3) if samples else None
+
+
+def stage_1_candidates(questions: List[Dict], bm25_dir: str, id_to_position: Dict[str, int], top_k: int = 200) -> List[np.ndarray]:
+    """
+    The stage-1 (BM25) candidates of each question, as positions in the exact index (what stage 2 scores).
+    """
+    import bm25s
+    import Stemmer
+
+    stemmer = Stemmer.Stemmer("english")
+    retriever = bm25s.BM25.load(bm25_dir, load_corpus=True, mmap=True, show_progress=False)
+    candidates = []
+    for q in questions:
+        tokens = bm25s.tokenize(q["question"], stemmer=stemmer, show_progress=False)
+        docs, _ = retriever.retrieve(tokens, k=top_k, show_progress=False)
+        ids = dict.fromkeys(doc["id"] for doc in docs[0])
+        candidates.append(np.asarray([id_to_position[t] for t in ids if t in id_to_position], dtype="int64"))
+    return candidates
+
+
+def _candidate_distances(index, dim: Optional[int], query_vector: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    return ((index.reconstruct_batch(positions) - prepare_vectors(query_vector, dim)) ** 2).sum(axis=1)
+
+
+def evaluate_variants(
+    specs: List[str],
+    questions: List[Dict],
+    query_vectors: np.ndarray,
+    candidates: List[np.ndarray],
+    index_to_docstore_id: Dict[int, str],
+    exact_dir: str = EXACT_INDEX_DIR,
+    k: int = 20,
+    rerank_k: int = 60,
+) -> List[Dict]:
+    """
+    Compare variants with the exact index on the stage-2 path of `HybridRetrieval`: ranking the stage-1 candidates.
+
+    Each variant is evaluated twice: re-ranked (the `rerank_k` best candidates on the variant are re-scored on the
+    exact vectors, `HybridRetrieval(rerank_k=...)`) and served (ranked on the variant only, `rerank_k=0`). Reports,
+    per row: recall@k against the exact stage-2 top-k, recall@k against the labelled table-IDs, per-query scoring
+    latency (p50/p95) and `mapped_mb`, the size of the index files the path maps. The re-ranked path maps the exact
+    index as well, so its memory benefit over the exact index is nil at serving time (the variant only saves memory
+    when it is served).
+    """
+    import faiss
+
+    exact_fp = os.path.join(exact_dir, "index.faiss")
+    exact = faiss.read_index(exact_fp, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    exact_mb = os.path.getsize(exact_fp) / 2**20
+    exact_top = [
+        positions[np.argsort(_candidate_distances(exact, None, query_vectors[i], positions), kind="stable")[:k]]
+        if len(positions) else positions
+        for i, positions in enumerate(candidates)
+    ]
+
+    runs = [("exact", None, None, exact_mb)]
+    for spec in specs:
+        index, dim = load_variant(spec, exact_dir)
+        variant_mb = os.path.getsize(os.path.join(variant_dir(spec, exact_dir), "index.faiss")) / 2**20
+        runs += [(f"{spec}+rerank{rerank_k}", (index, dim), rerank_k, variant_mb + exact_mb),
+                 (spec, (index, dim), 0, variant_mb)]
+
+    rows = []
+    for name, variant, n_rerank, mapped_mb in runs:
+        latencies, top = [], []
+        for i, positions in enumerate(candidates):
+            start = time.perf_counter()
+            if len(positions) and variant is not None:
+                ranked = positions[np.argsort(_candidate_distances(*variant, query_vectors[i], positions), kind="stable")]
+                if n_rerank:
+                    ranked = ranked[:n_rerank]
+                    ranked = ranked[np.argsort(_candidate_distances(exact, None, query_vectors[i], ranked), kind="stable")]
+                ranked = ranked[:k]
+            elif len(positions):
+                ranked = positions[np.argsort(_candidate_distances(exact, None, query_vectors[i], positions), kind="stable")[:k]]
+            else:
+                ranked = positions
+            latencies.append(time.perf_counter() - start)
+            top.append(ranked)
+
+        agreement = [len(set(t) & set(e)) / len(e) for t, e in zip(top, exact_top) if len(e)]
+        labelled_hits = [
+            any(index_to_docstore_id.get(int(pos)) in q["table_ids"] for pos in t) for t, q in zip(top, questions)
+        ]
+        rows.append({
+            "variant": name,
+            "mapped_mb": round(mapped_mb, 1),
+            f"recall@{k}_vs_exact": round(float(np.mean(agreement)), 4) if agreement else None,
+            f"labelled_recall@{k}": round(float(np.mean(labelled_hits)), 4) if labelled_hits else None,
+            "p50_ms": _percentile_ms(latencies, 50),
+            "p95_ms": _percentile_ms(latencies, 95),
+        })
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "evaluate"])
+    parser.add_argument("--variants", nargs="+", default=["mrl768", "mrl1536", "sq8", "pq96"])
+    parser.add_argument("--exact-dir", default=EXACT_INDEX_DIR)
+    parser.add_argument("--questions", default=None, help="labelled JSONL set (default: docstore sample questions)")
+    parser.add_argument("--n-questions", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20, help="top_k_stage_2")
+    parser.add_argument("--top-k-stage-1", type=int, default=200)
+    parser.add_argument("--rerank-k", type=int, default=60)
+    parser.add_argument("--bm25-dir", default=None, help="stage-1 index (default: <artifacts>/bm25 of --exact-dir)")
+    parser.add_argument("--local-embeddings", action="store_true", help="embed questions with HashingEmbeddings")
+    parser.add_argument("--cache-dir", default="cache/retrieval_eval")
+    parser.add_argument("--json", dest="json_path", default=None)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for spec in args.variants:
+            print(json.dumps(build_variant(spec, args.exact_dir)))
+        return 0
+
+    import pickle
+    with open(os.path.join(args.exact_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    questions = (
+        load_labelled_questions(args.questions) if args.questions
+        else sample_questions_from_docstore(docstore, n=args.n_questions)
+    )
+    if args.local_embeddings:
+        import faiss
+        from src.retrieval.local_embeddings import HashingEmbeddings
+        embeddings = HashingEmbeddings(dim=faiss.read_index(os.path.join(args.exact_dir, "index.faiss"),
+                                                            faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY).d)
+    else:
+        from src.utils.resources import get_embeddings
+        embeddings = get_embeddings()
+    query_vectors = embed_questions(questions, embeddings, cache_dir=args.cache_dir)
+    bm25_dir = args.bm25_dir or os.path.join(os.path.dirname(os.path.dirname(args.exact_dir.rstrip("/"))), "bm25")
+    id_to_position = {doc_id: pos for pos, doc_id in index_to_docstore_id.items()}
+    candidates = stage_1_candidates(questions, bm25_dir, id_to_position, top_k=args.top_k_stage_1)
+
+    rows = evaluate_variants(
+        args.variants, questions, query_vectors, candidates, index_to_docstore_id, args.exact_dir, args.k, args.rerank_k
+    )
+    for row in rows:
+        print(json.dumps(row))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"n_questions": len(questions), "k": args.k, "top_k_stage_1": args.top_k_stage_1,
+                       "rerank_k": args.rerank_k, "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Pre-rendered per-table context blocks, built once from the FAISS docstore.
+
+Usage:
+    python -m src.retrieval.context_store build [--faiss-dir artifacts/cso_smry/faiss_index] [--out ...sqlite]
+
+`HybridRetrieval` (stage-3 table selection) and `data_analyst_tool` (table metadata) read the blocks by table-ID
+instead of formatting them from the docstore on every request; they fall back to the docstore when the store is
+missing or does not contain a table.
+"""
+import os
+import sys
+import pickle
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from src.storage.json_stat_archive_db import _zstd_compress_bytes, _zstd_decompress_bytes
+from src.utils.message_compaction import estimate_tokens
+
+
+CONTEXT_STORE_PATH = "artifacts/cso_smry/table_contexts.sqlite"
+
+# Replaced by the actual CSV path when a "metadata" block is used by the data-analyst tool.
+CSV_PATH_PLACEHOLDER = "<CSV_FILE_PATH>"
+
+KINDS = ("retrieval", "metadata")
+
+
+def render_retrieval_context(table_id: str, metadata: Dict) -> str:
+    """
+    Context block of a table for the stage-3 (LLM) table selection.
+    """
+    sample_questions_str = "\n  - ".join(metadata["sample_questions"])
+    text_chunk_list = [
+        f"**Table ID**: {table_id}",
+        f"**Table Name (and Category)**: {metadata['table_name']} ({metadata['subject']}: {metadata['product']})",
+        f"**Table Summary**: {metadata['description']}",
+        f"**Fields**: {', '.join(metadata['columns'])}",
+        f"**Statistics**: {', '.join(metadata['statistics_units'])}",
+        f"**Sample Questions**:",
+        f"  - {sample_questions_str}"
+    ]
+    return "\n".join(text_chunk_list)
+
+
+def render_metadata_context(table_id: str, metadata: Dict) -> str:
+    """
+    Metadata block of a table for the data-analyst context (the CSV path is filled in at use time).
+    """
+    json_context_list = [
+        f"**Table ID**: {table_id}",
+        f"**Table Name (and Category)**: {metadata['table_name']} ({metadata['subject']}: {metadata['product']})",
+        f"**CSV File Path**: {CSV_PATH_PLACEHOLDER}",
+        f"**Statistics-Units**: {', '.join(metadata['statistics_units'])}",
+    ]
+    return "\n".join(json_context_list)
+
+
+RENDERERS = {"retrieval": render_retrieval_context, "metadata": render_metadata_context}
+
+
+class TableContextStore:
+    """
+    Pre-rendered per-table context blocks in a single SQLite file (Zstd-compressed), read lazily by table-ID.
+
+    Tables:
+      - contexts(table_id TEXT, kind TEXT, text_zst BLOB, n_tokens INTEGER, PRIMARY KEY(table_id, kind))
+    `kind` is "retrieval" (stage-3 table selection) or "metadata" (data-analyst context). `n_tokens` is an estimate
+    used to pack prompts to a token budget without decompressing the blocks.
+    """
+
+    def __init__(self, db_path: str = CONTEXT_STORE_PATH, cache_size: int = 4096):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self._conn = None
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[str, int]]" = OrderedDict()
+
+    # ---------- PUBLIC API ----------
+
+    @classmethod
+    def build(cls, db_path: str, docstore, compression_level: int = 12) -> int:
+        """
+        Render the context blocks of every document in a docstore and write them to `db_path` (atomically).
+
+        Args:
+            db_path: path of the store to (re)create
+            docstore: the vector-store docstore (documents with the table-summary metadata)
+            compression_level: Zstd level
+
+        Returns:
+            The number of tables written.
+        """
+        tmp_path = db_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        n_tables = 0
+        try:
+            conn.execute(
+                """CREATE TABLE contexts(
+                       table_id TEXT NOT NULL,
+                       kind TEXT NOT NULL,
+                       text_zst BLOB NOT NULL,
+                       n_tokens INTEGER NOT NULL,
+                       PRIMARY KEY(table_id, kind)
+                   )"""
+            )
+            with conn:
+                for doc_id, doc in docstore._dict.items():
+                    table_id = doc.id or doc_id
+                    for kind, render in RENDERERS.items():
+                        text = render(table_id, doc.metadata)
+                        conn.execute(
+                            "INSERT OR REPLACE INTO contexts(table_id, kind, text_zst, n_tokens) VALUES (?,?,?,?)",
+                            (table_id, kind, _zstd_compress_bytes(text.encode("utf-8"), compression_level),
+                             estimate_tokens(text)),
+                        )
+                    n_tables += 1
+        finally:
+            conn.close()
+        os.replace(tmp_path, db_path)
+        return n_tables
+
+    def exists(self) -> bool:
+        return os.path.exists(self.db_path)
+
+    def get(self, table_id: str, kind: str = "retrieval") -> Optional[Tuple[str, int]]:
+        """
+        Returns (context block, estimated tokens) of a table, or None if the table is not in the store.
+        """
+        return self.get_many([table_id], kind).get(table_id)
+
+    def get_many(self, table_ids: Iterable[str], kind: str = "retrieval") -> Dict[str, Tuple[str, int]]:
+        """
+        Returns {table_id: (context block, estimated tokens)} for the tables found in the store.
+        """
+        table_ids = list(dict.fromkeys(table_ids))
+        found, missing = {}, []
+        with self._lock:
+            for table_id in table_ids:
+                hit = self._cache.get((table_id, kind))
+                if hit is None:
+                    missing.append(table_id)
+                else:
+                    self._cache.move_to_end((table_id, kind))
+                    found[table_id] = hit
+
+            if missing:
+                placeholders = ",".join("?" for _ in missing)
+                rows = self._connection().execute(
+                    f"SELECT table_id, text_zst, n_tokens FROM contexts WHERE kind=? AND table_id IN ({placeholders})",
+                    [kind] + missing,
+                ).fetchall()
+                for table_id, text_zst, n_tokens in rows:
+                    found[table_id] = (_zstd_decompress_bytes(text_zst).decode("utf-8"), n_tokens)
+                    self._cache[(table_id, kind)] = found[table_id]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return {table_id: found[table_id] for table_id in table_ids if table_id in found}
+
+    def get_tokens(self, table_ids: Iterable[str], kind: str = "retrieval") -> Dict[str, int]:
+        """
+        Returns {table_id: estimated tokens} without decompressing the blocks.
+        """
+        table_ids = list(dict.fromkeys(table_ids))
+        if not table_ids:
+            return {}
+        placeholders = ",".join("?" for _ in table_ids)
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT table_id, n_tokens FROM contexts WHERE kind=? AND table_id IN ({placeholders})",
+                [kind] + table_ids,
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._cache.clear()
+
+    # ---------- INTERNALS ----------
+
+    def _connection(self) -> sqlite3.Connection:
+        # one read-only connection, shared between threads under `self._lock`
+        if self._conn is None:
+            self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        return self._conn
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build the pre-rendered table context store from the FAISS docstore.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--faiss-dir", default="artifacts/cso_smry/faiss_index")
+    parser.add_argument("--out", default=CONTEXT_STORE_PATH)
+    args = parser.parse_args()
+
+    with open(os.path.join(args.faiss_dir, "index.pkl"), "rb") as f:
+        docstore, _ = pickle.load(f)
+    n_tables = TableContextStore.build(args.out, docstore)
+    print(f"Wrote context blocks for {n_tables} tables to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
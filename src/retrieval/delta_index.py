@@ -0,0 +1,516 @@
+"""
+Incremental updates of the retrieval artifacts: a small delta index next to the main one, merged at query time.
+
+Usage:
+    python -m src.retrieval.delta_index update  --artifacts-dir artifacts/index/versions/<v> [--table-ids A B ...]
+                                                [--deleted-ids C ...] [--archive ...] [--summaries ...]
+    python -m src.retrieval.delta_index status  --artifacts-dir ...
+    python -m src.retrieval.delta_index compact --artifacts-dir ... [--out-root artifacts/index]
+
+`update` without `--table-ids` compares the archive timestamps with the ones recorded in the manifest (see
+`src.retrieval.index_builder`) to find the new, changed and deleted tables.
+
+Layout: `<artifacts_dir>/delta/versions/<generation>/` holds the BM25 index, FAISS store and context store of the new
+and changed tables, plus `delta.json` (table timestamps + tombstones); `<artifacts_dir>/delta/CURRENT` names the live
+generation and is replaced atomically. Tombstones hide the stale (updated or deleted) table-IDs of the main index.
+Every update rewrites the (small) delta from the previous generation + the changed tables, so it takes seconds.
+The delta is embedded with the embedder of the main index (recorded in its manifest). Older generations are removed
+once no serving process holds a lease on them (`.leases/`, see `src.retrieval.snapshot`).
+
+`compact` merges the main index and the delta into a new artifacts version (tombstoned entries dropped) and
+publishes it, after which the delta starts empty again.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import pickle
+import argparse
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from src.storage.json_stat_archive_db import JSONStatArchiveDB
+from src.retrieval.index_builder import (
+    ARCHIVE_PATH,
+    INDEX_ROOT,
+    MANIFEST_FILE,
+    PRODUCTION_EMBEDDER,
+    build_summary,
+    current_version,
+    document_text,
+    get_chunked_bag_of_words,
+    get_embedder,
+    get_table_metadata,
+    load_summaries,
+    publish_version,
+    read_manifest,
+    resolve_artifacts_dir,
+    _file_digests,
+    _git_commit,
+)
+
+
+DELTA_DIR = "delta"
+DELTA_MANIFEST_FILE = "delta.json"
+LEASES_DIR = ".leases"
+# leases of other hosts cannot be checked for a live process: they are trusted until this old (seconds)
+LEASE_MAX_AGE = float(os.environ.get("DELTA_LEASE_MAX_AGE", str(24 * 3600)))
+
+
+class DeltaIndex:
+    """
+    A loaded delta generation: BM25 + FAISS + context store of the new/changed tables, and the tombstoned IDs.
+    """
+
+    def __init__(self, folder: str, embeddings=None, mmap: bool = True):
+        from src.retrieval.hybrid_retrieval import load_faiss_store
+        from src.retrieval.context_store import TableContextStore
+        from src.retrieval.local_embeddings import HashingEmbeddings
+
+        self.folder = folder
+        with open(os.path.join(folder, DELTA_MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.generation = self.manifest["generation"]
+        self.table_timestamps: Dict[str, Optional[str]] = self.manifest["table_timestamps"]
+        self.table_ids: Set[str] = set(self.table_timestamps)
+        self.tombstones: Set[str] = set(self.manifest["tombstones"])
+        # main-index entries to ignore: stale versions of updated tables + deleted tables
+        self.hidden: Set[str] = self.tombstones | self.table_ids
+
+        self.retriever, self.vector_store, self.context_store = None, None, None
+        self._id_to_position = {}
+        if self.table_ids:
+            import bm25s
+            self.retriever = bm25s.BM25.load(os.path.join(folder, "bm25"), load_corpus=True, mmap=mmap,
+                                             show_progress=False)
+            # offline tooling only reads the stored vectors, a placeholder embedder is enough
+            self.vector_store = load_faiss_store(os.path.join(folder, "faiss_index"), embeddings or HashingEmbeddings(),
+                                                 mmap=mmap)
+            self._id_to_position = {doc_id: pos for pos, doc_id in self.vector_store.index_to_docstore_id.items()}
+            self.context_store = TableContextStore(os.path.join(folder, "table_contexts.sqlite"))
+
+    @classmethod
+    def load(cls, artifacts_dir: str, embeddings=None, mmap: bool = True) -> Optional["DeltaIndex"]:
+        """
+        The live delta generation of an artifacts directory, or None if there is none.
+        """
+        folder = resolve_artifacts_dir(os.path.join(artifacts_dir, DELTA_DIR))
+        return cls(folder, embeddings, mmap=mmap) if folder else None
+
+    def retrieve(self, query_tokens, k: int) -> Dict[str, float]:
+        """BM25 search over the delta chunks. Returns {table_id: bm25_score}."""
+        if self.retriever is None:
+            return {}
+        k = min(k, len(self.retriever.corpus))
+        docs, scores = self.retriever.retrieve(query_tokens, k=k, show_progress=False)
+        results = {}
+        for doc, score in zip(docs[0], scores[0]):
+            results[doc["id"]] = max(float(score), results.get(doc["id"], float("-inf")))
+        return results
+
+    def distances(self, query_vector: np.ndarray, table_ids: Iterable[str]) -> Dict[str, float]:
+        """Squared L2 distances of the query to the given delta tables."""
+        positions = np.asarray([self._id_to_position[t] for t in table_ids if t in self._id_to_position], dtype="int64")
+        if not len(positions):
+            return {}
+        vectors = self.vector_store.index.reconstruct_batch(positions)
+        distances = ((vectors - query_vector) ** 2).sum(axis=1)
+        return {self.vector_store.index_to_docstore_id[pos]: float(d) for pos, d in zip(positions, distances)}
+
+    def vectors(self) -> Tuple[List[str], np.ndarray]:
+        """All (table_id, vector) of the delta, in index order."""
+        if self.vector_store is None:
+            return [], np.zeros((0, 0), dtype="float32")
+        n = self.vector_store.index.ntotal
+        return [self.vector_store.index_to_docstore_id[i] for i in range(n)], self.vector_store.index.reconstruct_n(0, n)
+
+
+# ---------- UPDATE ----------
+
+def changed_tables(artifacts_dir: str, archive_path: str = ARCHIVE_PATH) -> Tuple[List[str], List[str]]:
+    """
+    Compare the archive with the indexed timestamps (main manifest, overridden by the delta).
+
+    Returns:
+        (new or changed table-IDs, deleted table-IDs)
+    """
+    if not os.path.exists(os.path.join(artifacts_dir, MANIFEST_FILE)):
+        raise ValueError(f"No {MANIFEST_FILE} in {artifacts_dir}: pass the table-IDs to update explicitly")
+    indexed = dict(read_manifest(artifacts_dir).get("table_timestamps", {}))
+    delta = DeltaIndex.load(artifacts_dir, mmap=False)
+    if delta is not None:
+        for table_id in delta.tombstones:
+            indexed.pop(table_id, None)
+        indexed.update(delta.table_timestamps)
+
+    archived = JSONStatArchiveDB().read_timestamps(archive_path)
+    changed = sorted(t for t, ts in archived.items() if t not in indexed or indexed[t] != ts)
+    deleted = sorted(set(indexed) - set(archived))
+    return changed, deleted
+
+
+def update_delta(
+    artifacts_dir: str,
+    table_ids: Iterable[str] = (),
+    deleted_ids: Iterable[str] = (),
+    archive_path: str = ARCHIVE_PATH,
+    summaries_path: Optional[str] = None,
+    embeddings=None,
+    embedder_name: Optional[str] = None,
+) -> str:
+    """
+    Write a new delta generation with the given tables (re-)indexed and the deleted ones tombstoned.
+
+    Args:
+        artifacts_dir: The artifacts directory of the main index.
+        table_ids: New or changed tables, read from the archive.
+        deleted_ids: Tables to remove from the results.
+        archive_path: The JSON-Stat archive.
+        summaries_path: Optional `summaries.jsonl` with the LLM descriptions / sample questions.
+        embeddings: The embeddings client; its dimension must match the main index.
+        embedder_name: The embedder of the main index ("gemini" or "hashing"). Default: the one recorded in its
+            manifest; a different name raises a ValueError (the delta vectors would not be comparable).
+
+    Returns:
+        The folder of the new generation.
+    """
+    import bm25s
+    import faiss
+    import Stemmer
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from src.retrieval.context_store import TableContextStore
+
+    embedder_name = _check_embedder(artifacts_dir, embedder_name)
+    table_ids, deleted_ids = list(dict.fromkeys(table_ids)), set(deleted_ids)
+    replaced = set(table_ids) | deleted_ids
+    previous = DeltaIndex.load(artifacts_dir, mmap=False)
+
+    # carry over the previous generation's tables that are not replaced
+    summaries_by_id: Dict[str, Dict] = {}
+    vectors_by_id: Dict[str, np.ndarray] = {}
+    chunks: List[Dict] = []
+    timestamps: Dict[str, Optional[str]] = {}
+    tombstones: Set[str] = set(previous.tombstones) if previous else set()
+    if previous is not None and previous.vector_store is not None:
+        ids, vectors = previous.vectors()
+        for table_id, vector in zip(ids, vectors):
+            if table_id not in replaced:
+                summaries_by_id[table_id] = previous.vector_store.docstore.search(table_id).metadata
+                vectors_by_id[table_id] = vector
+                timestamps[table_id] = previous.table_timestamps.get(table_id)
+        chunks = [{"id": doc["id"], "text": doc["text"]} for doc in previous.retriever.corpus if doc["id"] not in replaced]
+
+    # read, chunk and embed the changed tables
+    reader = JSONStatArchiveDB()
+    summaries = load_summaries(summaries_path)
+    new_summaries = []
+    for table_id in table_ids:
+        for _, cso_file, ts in reader.read(archive_path, table_id=table_id, with_labels=True):
+            chunks.extend(get_chunked_bag_of_words(cso_file))
+            summary = build_summary(get_table_metadata(cso_file), summaries.get(table_id))
+            summaries_by_id[table_id] = summary
+            timestamps[table_id] = ts
+            new_summaries.append(summary)
+    if new_summaries:
+        embeddings = embeddings or _embedder_for(artifacts_dir, embedder_name)
+        for summary, vector in zip(new_summaries, embeddings.embed_documents([document_text(s) for s in new_summaries])):
+            vectors_by_id[summary["id"]] = np.asarray(vector, dtype="float32")
+    tombstones |= replaced
+
+    # write the generation to a temp folder, then publish it
+    delta_root = os.path.join(artifacts_dir, DELTA_DIR)
+    generation = (previous.generation + 1) if previous else 1
+    versions_dir = os.path.join(delta_root, "versions")
+    final_dir = os.path.join(versions_dir, f"{generation:06d}")
+    tmp_dir = os.path.join(versions_dir, f".tmp-{generation:06d}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        if summaries_by_id:
+            stemmer = Stemmer.Stemmer("english")
+            retriever = bm25s.BM25(corpus=chunks)
+            retriever.index(bm25s.tokenize([c["text"] for c in chunks], stopwords="en", stemmer=stemmer,
+                                           show_progress=False), show_progress=False)
+            retriever.save(os.path.join(tmp_dir, "bm25"))
+
+            ids = list(summaries_by_id)
+            vector_store = FAISS(
+                embedding_function=embeddings or get_embedder("hashing"),
+                index=faiss.IndexFlatL2(len(vectors_by_id[ids[0]])),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+            )
+            vector_store.add_embeddings(
+                text_embeddings=[(document_text(summaries_by_id[t]), vectors_by_id[t].tolist()) for t in ids],
+                metadatas=[summaries_by_id[t] for t in ids],
+                ids=ids,
+            )
+            vector_store.save_local(os.path.join(tmp_dir, "faiss_index"))
+            TableContextStore.build(os.path.join(tmp_dir, "table_contexts.sqlite"), vector_store.docstore)
+
+        with open(os.path.join(tmp_dir, DELTA_MANIFEST_FILE), "w") as f:
+            json.dump({
+                "generation": generation,
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "embedder": embedder_name,
+                "table_timestamps": timestamps,
+                "tombstones": sorted(tombstones),
+            }, f, indent=2)
+        os.replace(tmp_dir, final_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    publish_version(delta_root, f"{generation:06d}")
+    _remove_old_generations(versions_dir, generation)
+    return final_dir
+
+
+def _embedder_for(artifacts_dir: str, embedder_name: str):
+    embeddings = get_embedder(embedder_name)
+    if embedder_name == "hashing":
+        import faiss
+        embeddings.dim = faiss.read_index(os.path.join(artifacts_dir, "cso_smry", "faiss_index", "index.faiss"),
+                                          faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY).d
+    return embeddings
+
+
+def _check_embedder(artifacts_dir: str, embedder_name: Optional[str]) -> str:
+    # artifacts without a manifest are the notebook builds, embedded with gemini
+    manifest_fp = os.path.join(artifacts_dir, MANIFEST_FILE)
+    base_embedder = read_manifest(artifacts_dir).get("embedder") if os.path.exists(manifest_fp) else None
+    base_embedder = base_embedder or PRODUCTION_EMBEDDER
+    if embedder_name is not None and embedder_name != base_embedder:
+        raise ValueError(
+            f"The main index of {artifacts_dir} is embedded with '{base_embedder}', not '{embedder_name}': "
+            f"delta vectors must come from the same embedder"
+        )
+    return base_embedder
+
+
+# ---------- GENERATION LEASES ----------
+
+def acquire_lease(folder: str) -> str:
+    """
+    Mark a delta generation as in use by this process (see `src.retrieval.snapshot`). Returns the lease file.
+    """
+    leases_dir = os.path.join(folder, LEASES_DIR)
+    try:
+        # not `makedirs`: a generation removed meanwhile must not be re-created (FileNotFoundError instead)
+        os.mkdir(leases_dir)
+    except FileExistsError:
+        pass
+    lease_fp = os.path.join(leases_dir, f"{socket.gethostname()}-{os.getpid()}-{time.monotonic_ns()}")
+    with open(lease_fp, "w"):
+        pass
+    return lease_fp
+
+
+def release_lease(lease_fp: str) -> None:
+    try:
+        os.remove(lease_fp)
+    except FileNotFoundError:
+        pass
+
+
+def _lease_is_live(lease_fp: str) -> bool:
+    host, pid, _ = os.path.basename(lease_fp).rsplit("-", 2)
+    if host != socket.gethostname():
+        try:
+            return time.time() - os.path.getmtime(lease_fp) < LEASE_MAX_AGE
+        except FileNotFoundError:
+            return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def live_leases(folder: str) -> List[str]:
+    """
+    The lease files of a generation held by running processes (leases of dead local processes are removed).
+    """
+    leases_dir = os.path.join(folder, LEASES_DIR)
+    if not os.path.isdir(leases_dir):
+        return []
+    live = []
+    for name in os.listdir(leases_dir):
+        lease_fp = os.path.join(leases_dir, name)
+        if _lease_is_live(lease_fp):
+            live.append(lease_fp)
+        else:
+            release_lease(lease_fp)
+    return live
+
+
+def _remove_old_generations(versions_dir: str, generation: int) -> None:
+    # a generation is only removed once no snapshot holds a lease on it: a retired snapshot still serving searches
+    # opens its context store lazily, so its folder must outlive it (see `src.retrieval.snapshot`)
+    for name in os.listdir(versions_dir):
+        folder = os.path.join(versions_dir, name)
+        if name.isdigit() and int(name) < generation and not live_leases(folder):
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+# ---------- COMPACTION ----------
+
+def compact(artifacts_dir: str, out_root: str = INDEX_ROOT, version: Optional[str] = None, publish: bool = True,
+            chunk_size: int = 10000) -> str:
+    """
+    Merge the main index and its delta into a new artifacts version under `out_root`.
+
+    Tombstoned main entries are dropped, the delta tables are appended; main vectors are copied in chunks from the
+    index (no re-embedding) and the BM25 corpus is re-tokenized.
+
+    Returns:
+        The directory of the new version.
+    """
+    import bm25s
+    import faiss
+    import Stemmer
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from src.retrieval.context_store import TableContextStore
+
+    start = time.time()
+    delta = DeltaIndex.load(artifacts_dir, mmap=True)
+    hidden = delta.hidden if delta else set()
+    version = version or time.strftime("v%Y%m%d-%H%M%S", time.gmtime())
+    versions_dir = os.path.join(out_root, "versions")
+    final_dir = os.path.join(versions_dir, version)
+    tmp_dir = os.path.join(versions_dir, f".tmp-{version}")
+    if os.path.exists(final_dir):
+        raise FileExistsError(f"Version already exists: {final_dir}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_dir, "cso_smry"))
+
+    try:
+        # BM25: main chunks minus the hidden tables + the delta chunks
+        with open(os.path.join(artifacts_dir, "bm25", "corpus.jsonl")) as f:
+            corpus = [doc for doc in (json.loads(line) for line in f if line.strip()) if doc["id"] not in hidden]
+        if delta is not None and delta.retriever is not None:
+            corpus.extend({"id": doc["id"], "text": doc["text"]} for doc in delta.retriever.corpus)
+        retriever = bm25s.BM25(corpus=corpus)
+        retriever.index(bm25s.tokenize([doc["text"] for doc in corpus], stopwords="en",
+                                       stemmer=Stemmer.Stemmer("english"), show_progress=False), show_progress=False)
+        retriever.save(os.path.join(tmp_dir, "bm25"))
+        n_chunks = len(corpus)
+        del corpus
+
+        # FAISS: main vectors minus the hidden tables + the delta vectors
+        main_index = faiss.read_index(os.path.join(artifacts_dir, "cso_smry", "faiss_index", "index.faiss"),
+                                      faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        with open(os.path.join(artifacts_dir, "cso_smry", "faiss_index", "index.pkl"), "rb") as f:
+            main_docstore, main_index_to_docstore_id = pickle.load(f)
+
+        index = faiss.IndexFlatL2(main_index.d)
+        docs, index_to_docstore_id = {}, {}
+        for lo in range(0, main_index.ntotal, chunk_size):
+            positions = [pos for pos in range(lo, min(lo + chunk_size, main_index.ntotal))
+                         if main_index_to_docstore_id[pos] not in hidden]
+            if positions:
+                index.add(main_index.reconstruct_batch(np.asarray(positions, dtype="int64")))
+            for pos in positions:
+                doc_id = main_index_to_docstore_id[pos]
+                index_to_docstore_id[len(index_to_docstore_id)] = doc_id
+                docs[doc_id] = main_docstore.search(doc_id)
+        if delta is not None and delta.vector_store is not None:
+            ids, vectors = delta.vectors()
+            index.add(vectors)
+            for doc_id in ids:
+                index_to_docstore_id[len(index_to_docstore_id)] = doc_id
+                docs[doc_id] = delta.vector_store.docstore.search(doc_id)
+
+        vector_store = FAISS(embedding_function=get_embedder("hashing"), index=index, docstore=InMemoryDocstore(docs),
+                             index_to_docstore_id=index_to_docstore_id)
+        vector_store.save_local(os.path.join(tmp_dir, "cso_smry", "faiss_index"))
+        TableContextStore.build(os.path.join(tmp_dir, "cso_smry", "table_contexts.sqlite"), vector_store.docstore)
+
+        base_manifest = read_manifest(artifacts_dir) if os.path.exists(os.path.join(artifacts_dir, MANIFEST_FILE)) else {}
+        table_timestamps = {t: ts for t, ts in base_manifest.get("table_timestamps", {}).items() if t not in hidden}
+        if delta is not None:
+            table_timestamps.update(delta.table_timestamps)
+        manifest = {
+            **{k: v for k, v in base_manifest.items() if k not in ("files", "table_timestamps")},
+            "embedder": _check_embedder(artifacts_dir, delta.manifest.get("embedder") if delta else None),
+            "version": version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "commit": _git_commit(),
+            "compacted_from": {"version": base_manifest.get("version"),
+                               "delta_generation": delta.generation if delta else None},
+            "n_tables": index.ntotal,
+            "n_bm25_chunks": n_chunks,
+            "dim": int(index.d),
+            "table_timestamps": table_timestamps,
+            "build_seconds": round(time.time() - start, 2),
+            "files": _file_digests(tmp_dir),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_dir, final_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if publish:
+        publish_version(out_root, version)
+    return final_dir
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["update", "status", "compact"])
+    parser.add_argument("--artifacts-dir", default=None, help="default: the current version under --out-root")
+    parser.add_argument("--out-root", default=INDEX_ROOT)
+    parser.add_argument("--archive", default=ARCHIVE_PATH)
+    parser.add_argument("--summaries", default="artifacts/cso_smry/summaries.jsonl")
+    parser.add_argument("--table-ids", nargs="*", default=None)
+    parser.add_argument("--deleted-ids", nargs="*", default=[])
+    parser.add_argument("--embeddings", choices=["gemini", "hashing"], default=None,
+                        help="default: the embedder of the main index (from its manifest)")
+    args = parser.parse_args()
+
+    artifacts_dir = args.artifacts_dir or resolve_artifacts_dir(args.out_root)
+    if not artifacts_dir:
+        print(f"No artifacts version published under {args.out_root}")
+        return 1
+
+    if args.command == "status":
+        delta = DeltaIndex.load(artifacts_dir, mmap=False)
+        print(json.dumps({
+            "artifacts_dir": artifacts_dir,
+            "generation": delta.generation if delta else None,
+            "tables": len(delta.table_ids) if delta else 0,
+            "tombstones": len(delta.tombstones) if delta else 0,
+        }, indent=2))
+        return 0
+
+    if args.command == "compact":
+        version_dir = compact(artifacts_dir, args.out_root)
+        print(f"Compacted {artifacts_dir} -> {version_dir} (CURRENT: {current_version(args.out_root)})")
+        return 0
+
+    start = time.time()
+    table_ids, deleted_ids = args.table_ids, args.deleted_ids
+    if table_ids is None:
+        table_ids, deleted = changed_tables(artifacts_dir, args.archive)
+        deleted_ids = sorted(set(deleted_ids) | set(deleted))
+    if not table_ids and not deleted_ids:
+        print("Nothing to update")
+        return 0
+    folder = update_delta(artifacts_dir, table_ids, deleted_ids, args.archive, args.summaries,
+                          embedder_name=args.embeddings)
+    print(f"Delta {os.path.basename(folder)}: {len(table_ids)} updated, {len(deleted_ids)} deleted tables "
+          f"in {time.time() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,22 @@
 import gc
-import json
-import bm25s
-import Stemmer
+import os
+import pickle
+import numpy as np
 import pandas as pd
-from google.genai import types
 from pydantic import BaseModel, Field
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from src.graphs.llms.gemini import get_llm
+from src.utils.resources import get_embeddings, get_shared_llm
+from src.utils.tracing import span, set_attributes, record_token_usage
+from src.utils.message_compaction import estimate_tokens
+from src.retrieval.context_store import TableContextStore, RENDERERS
+
+
+# Stage-3 prompt packing: candidates are added (in stage-2 order) until the context blocks reach the token budget.
+STAGE_3_TOKEN_BUDGET = int(os.environ.get("STAGE_3_TOKEN_BUDGET", "6000"))
+STAGE_3_MIN_CANDIDATES = int(os.environ.get("STAGE_3_MIN_CANDIDATES", "5"))
+# Stage 3 is skipped when the best candidate leads stage 1 and beats the runner-up's stage-2 distance by this margin.
+# Off until tuned: pick it from the `clear_winner_sweep` of `src.retrieval.benchmark` on the real artifacts (the
+# smallest margin whose skipped queries are as precise as stage 3).
+CLEAR_WINNER_MARGIN = float(os.environ.get("CLEAR_WINNER_MARGIN", "inf"))
 
 
 class TableSelectionSubclass(BaseModel):
@@ -19,96 +28,292 @@ class TableSelection(BaseModel):
     relevant_tables: list[TableSelectionSubclass] = Field(description="List of relevant tables with explanations.")
 
 
+def load_faiss_store(folder_path: str, embeddings, mmap: bool = True):
+    """
+    Load a LangChain FAISS vector-store saved with `save_local`.
+
+    With `mmap=True` the FAISS index is opened read-only and memory-mapped (`IO_FLAG_MMAP_IFC`), so the vectors
+    live in the OS page cache and are shared by every worker process instead of being copied into each one.
+
+    Args:
+        folder_path (str): The folder containing `index.faiss` and `index.pkl`.
+        embeddings: The embeddings client of the store.
+        mmap (bool): Whether to memory-map the index.
+
+    Returns:
+        FAISS: The vector-store.
+    """
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    if not mmap:
+        return FAISS.load_local(folder_path=folder_path, embeddings=embeddings, allow_dangerous_deserialization=True)
+
+    index = faiss.read_index(
+        os.path.join(folder_path, "index.faiss"),
+        faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY,
+    )
+    with open(os.path.join(folder_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
 class HybridRetrieval:
-    def __init__(self, top_k_stage_1: int, top_k_stage_2: int):
+    def __init__(
+        self,
+        top_k_stage_1: int,
+        top_k_stage_2: int,
+        embeddings=None,
+        llm=None,
+        artifacts_dir: str = "artifacts",
+        mmap: bool = True,
+        stage_2_variant: str = None,
+        rerank_k: int = None,
+        stage_3_token_budget: int = None,
+        max_stage_3_candidates: int = None,
+        clear_winner_margin: float = None,
+    ):
+        """
+        Args:
+            top_k_stage_1 (int): Number of BM25 candidates.
+            top_k_stage_2 (int): Typical number of semantic candidates passed to the LLM stage; the actual number
+                depends on the token budget and is capped by `max_stage_3_candidates`.
+            embeddings: Embeddings client for stage 2 (defaults to the shared `gemini-embedding-001` client).
+            llm: Chat model for stage 3 (defaults to the shared `gemini-2.5-flash-lite` client).
+            artifacts_dir (str): The directory containing `bm25/`, `cso_smry/faiss_index/` and (optionally) the
+                pre-rendered context blocks `cso_smry/table_contexts.sqlite` (see `src.retrieval.context_store`).
+            mmap (bool): Memory-map the BM25 matrices, the BM25 corpus and the FAISS index (shared across workers).
+            stage_2_variant (str): A reduced-size index variant to score the stage-1 candidates with
+                (see `src.retrieval.compressed_index`), e.g. "mrl768" or "sq8". None uses the exact vectors only.
+            rerank_k (int): With a variant, the number of best candidates re-ranked on the exact vectors
+                (default `3 * top_k_stage_2`). With 0 the variant is the served stage-2 index: the exact
+                `index.faiss` is never opened and the candidates are ranked on the variant distances.
+            stage_3_token_budget (int): Token budget of the table contexts in the stage-3 prompt
+                (default `STAGE_3_TOKEN_BUDGET`). At least `STAGE_3_MIN_CANDIDATES` candidates are always included.
+            max_stage_3_candidates (int): Upper bound on the stage-3 candidates (default `2 * top_k_stage_2`).
+            clear_winner_margin (float): Minimum stage-2 distance gap between the best and the second candidate for
+                skipping stage 3 (the best candidate must also be the top BM25 hit); the top `top_k_stage_2` stage-2
+                candidates are then returned. Default `CLEAR_WINNER_MARGIN` (`inf`: disabled).
+        """
         self.top_k_stage_1 = top_k_stage_1
         self.top_k_stage_2 = top_k_stage_2
+        self.artifacts_dir = artifacts_dir
+        self.mmap = mmap
+        self.stage_2_variant = stage_2_variant
+        self.rerank_k = 3 * top_k_stage_2 if rerank_k is None else rerank_k
+        self.stage_3_token_budget = stage_3_token_budget or STAGE_3_TOKEN_BUDGET
+        self.max_stage_3_candidates = max_stage_3_candidates or 2 * top_k_stage_2
+        self.clear_winner_margin = CLEAR_WINNER_MARGIN if clear_winner_margin is None else clear_winner_margin
         self._instantiate_stage_1()
-        self._instantiate_stage_2()
-        self._instantiate_stage_3()
+        self._instantiate_stage_2(embeddings)
+        self._instantiate_stage_3(llm)
+        self._instantiate_delta()
 
     def _instantiate_stage_1(self):
+        # heavy libraries are imported on first instantiation, not at module import
+        import bm25s
+        import Stemmer
+
+        self._bm25s = bm25s
         self.stemmer = Stemmer.Stemmer("english")
-        self.retriever = bm25s.BM25.load("artifacts/bm25", load_corpus=True)
-        with open("artifacts/bm25/corpus.jsonl", "r") as f:
-            self.corpus = [json.loads(line) for line in f]
-
-    def _instantiate_stage_2(self):
-        embeddings = GoogleGenerativeAIEmbeddings(
-            model="gemini-embedding-001",
-            task_type="semantic_similarity",
-            config=types.EmbedContentConfig(
-                    output_dimensionality=3072,
-                    task_type="SEMANTIC_SIMILARITY",
-                )
-        )
-        self.vector_store = FAISS.load_local(
-            folder_path="artifacts/cso_smry/faiss_index",
-            embeddings=embeddings,
-            allow_dangerous_deserialization=True
+        # with mmap, the sparse matrices (.npy) and the corpus (.jsonl) are read lazily from the page cache
+        self.retriever = bm25s.BM25.load(
+            os.path.join(self.artifacts_dir, "bm25"),
+            load_corpus=True,
+            mmap=self.mmap,
+            show_progress=False,
         )
+        self.corpus = self.retriever.corpus
+
+    def _instantiate_stage_2(self, embeddings=None):
+        self.embeddings = embeddings or get_embeddings()
+        exact_dir = os.path.join(self.artifacts_dir, "cso_smry", "faiss_index")
+
+        self._variant_index, self._variant_dim = None, None
+        if self.stage_2_variant:
+            from src.retrieval.compressed_index import load_variant
+            self._variant_index, self._variant_dim = load_variant(self.stage_2_variant, exact_dir=exact_dir, mmap=self.mmap)
+
+        if self.served_variant:
+            # only the docstore mapping of the exact index is loaded, its vectors are never mapped
+            from langchain_community.vectorstores import FAISS
+            with open(os.path.join(exact_dir, "index.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            self.vector_store = FAISS(
+                embedding_function=self.embeddings,
+                index=self._variant_index,
+                docstore=docstore,
+                index_to_docstore_id=index_to_docstore_id,
+            )
+        else:
+            self.vector_store = load_faiss_store(folder_path=exact_dir, embeddings=self.embeddings, mmap=self.mmap)
+        self._id_to_position = {doc_id: pos for pos, doc_id in self.vector_store.index_to_docstore_id.items()}
+
+        context_store = TableContextStore(os.path.join(self.artifacts_dir, "cso_smry", "table_contexts.sqlite"))
+        self.context_store = context_store if context_store.exists() else None
+
+    @property
+    def served_variant(self) -> bool:
+        """Whether the stage-2 variant replaces the exact index (no exact re-rank)."""
+        return bool(self.stage_2_variant) and self.rerank_k == 0
     
-    def _instantiate_stage_3(self):
-        self.llm = get_llm(model="gemini-2.5-flash-lite")
+    def _instantiate_stage_3(self, llm=None):
+        self.llm = llm or get_shared_llm(model="gemini-2.5-flash-lite")
 
-    def _create_context(self, table_ids: list) -> str:
-        context = []
+    def _instantiate_delta(self):
+        # new / changed tables indexed since the main build (see `src.retrieval.delta_index`)
+        from src.retrieval.delta_index import DeltaIndex
+        self.delta = DeltaIndex.load(self.artifacts_dir, self.embeddings, mmap=self.mmap)
+
+    def get_context_blocks(self, table_ids: list, kind: str = "retrieval") -> dict:
+        """
+        Pre-rendered context blocks of the tables, read from the context store (falls back to the docstore).
+
+        Args:
+            table_ids (list): The table-IDs.
+            kind (str): "retrieval" (stage-3 table selection) or "metadata" (data-analyst context).
+
+        Returns:
+            dict: {table_id: (context block, estimated tokens)}, in the order of `table_ids`.
+        """
+        blocks = {}
+        if self.delta is not None and self.delta.context_store is not None:
+            blocks.update(self.delta.context_store.get_many([t for t in table_ids if t in self.delta.table_ids], kind))
+        if self.context_store:
+            blocks.update(self.context_store.get_many([t for t in table_ids if t not in blocks], kind))
         for table_id in table_ids:
-            doc = self.vector_store.docstore.search(table_id)
-            sample_questions_str = "\n  - ".join(doc.metadata["sample_questions"])
-            text_chunk_list = [
-                f"**Table ID**: {doc.id}",
-                f"**Table Name (and Category)**: {doc.metadata['table_name']} ({doc.metadata['subject']}: {doc.metadata['product']})",
-                f"**Table Summary**: {doc.metadata['description']}",
-                f"**Fields**: {', '.join(doc.metadata['columns'])}",
-                f"**Statistics**: {', '.join(doc.metadata['statistics_units'])}",
-                f"**Sample Questions**:",
-                f"  - {sample_questions_str}"
-            ]
-            text_chunk = "\n".join(text_chunk_list)
-            context.append(text_chunk)
-        return "\n\n".join(context)
+            if table_id not in blocks:
+                in_delta = self.delta is not None and table_id in self.delta.table_ids
+                doc = (self.delta.vector_store if in_delta else self.vector_store).docstore.search(table_id)
+                text = RENDERERS[kind](doc.id or table_id, doc.metadata)
+                blocks[table_id] = (text, estimate_tokens(text))
+        return {table_id: blocks[table_id] for table_id in table_ids}
 
-    def search(self, query: str):
-        # Stage 1: Lexical Search
-        query_tokens = bm25s.tokenize(query, stemmer=self.stemmer)
-        docs, scores = self.retriever.retrieve(query_tokens, k=self.top_k_stage_1, corpus=self.corpus)
-        stage_1_results = {
-            doc["id"] : float(score) for doc, score in zip(docs[0], scores[0])
-        }
+    def _create_context(self, table_ids: list) -> str:
+        return "\n\n".join(text for text, _ in self.get_context_blocks(table_ids).values())
 
-        # Stage 2: Semantic Search
-        very_high_integer = 10000000 # total number of docs is ~80K, 10M limit set.
-        docs_with_scores = self.vector_store.similarity_search_with_score(
-            query,
-            fetch_k=very_high_integer,
-            k=very_high_integer,
-            # k=self.top_k_stage_2,
-            filter=lambda x: x["id"] in stage_1_results
-        )
-        stage_2_results = {
-            doc.metadata["id"]: float(score) for doc, score in docs_with_scores
-        }
+    def _stage_1(self, query: str) -> dict:
+        """Lexical (BM25) search. Returns {table_id: bm25_score} for the top `top_k_stage_1` chunks."""
+        with span("retrieval.bm25", k=self.top_k_stage_1):
+            query_tokens = self._bm25s.tokenize(query, stemmer=self.stemmer, show_progress=False)
+            docs, scores = self.retriever.retrieve(query_tokens, k=self.top_k_stage_1, show_progress=False)
+            results = {
+                doc["id"] : float(score) for doc, score in zip(docs[0], scores[0])
+            }
+            if self.delta is None:
+                return results
 
-        # Convert to pandas dataframe
+            # drop the stale / deleted tables of the main index, add the delta hits (best chunk per table)
+            results = {table_id: score for table_id, score in results.items() if table_id not in self.delta.hidden}
+            for table_id, score in self.delta.retrieve(query_tokens, k=self.top_k_stage_1).items():
+                results[table_id] = max(score, results.get(table_id, float("-inf")))
+            return dict(sorted(results.items(), key=lambda item: item[1], reverse=True)[:self.top_k_stage_1])
+
+    def _stage_2(self, query: str, candidate_ids: list) -> dict:
+        """
+        Semantic scoring of the stage-1 candidates. Returns {table_id: squared L2 distance} (lower is better).
+
+        Only the candidates' vectors are read from the (memory-mapped) index, instead of searching all ~80K vectors.
+        With a `stage_2_variant`, only the `rerank_k` best main-index candidates on the variant are returned (exact
+        distances), or, for a served variant (`rerank_k=0`), all the candidates with their variant distances.
+        Delta-index candidates are always scored on their exact vectors.
+        """
+        delta_ids = [t for t in candidate_ids if self.delta is not None and t in self.delta.table_ids]
+        positions = [
+            self._id_to_position[table_id] for table_id in candidate_ids
+            if table_id in self._id_to_position and table_id not in delta_ids
+        ]
+        if not positions and not delta_ids:
+            return {}
+        with span("retrieval.embed", input_tokens_est=estimate_tokens(query)):
+            query_vector = np.asarray(self.embeddings.embed_query(query), dtype="float32")
+        positions = np.asarray(positions, dtype="int64")
+
+        results = {}
+        with span("retrieval.faiss_search", candidates=len(positions) + len(delta_ids), variant=self.stage_2_variant or "exact"):
+            if len(positions):
+                if self._variant_index is not None:
+                    # score on the reduced-size variant, then re-rank the best candidates on the exact vectors
+                    from src.retrieval.compressed_index import prepare_vectors
+                    approx_vectors = self._variant_index.reconstruct_batch(positions)
+                    distances = ((approx_vectors - prepare_vectors(query_vector, self._variant_dim)) ** 2).sum(axis=1)
+                    if not self.served_variant:
+                        positions = positions[np.argsort(distances, kind="stable")[:self.rerank_k]]
+
+                if not self.served_variant:
+                    vectors = self.vector_store.index.reconstruct_batch(positions)
+                    distances = ((vectors - query_vector) ** 2).sum(axis=1)
+                results = {
+                    self.vector_store.index_to_docstore_id[pos]: float(dist) for pos, dist in zip(positions, distances)
+                }
+            if delta_ids:
+                results.update(self.delta.distances(query_vector, delta_ids))
+        return results
+
+    def _select_candidates(self, stage_1_results: dict, stage_2_results: dict) -> list:
+        """
+        Rank the stage-1 candidates by their stage-2 distance.
+
+        Returns the best `max_stage_3_candidates` table-IDs (candidates without a stage-2 distance are ranked last).
+        """
         ids = list(stage_1_results.keys())
 
+        # Convert to pandas dataframe
         records = {
             "id": ids,
             "stage_1_score": [stage_1_results[id] for id in ids],
-            "stage_2_score": [stage_2_results.get(id, 0) for id in ids],
+            "stage_2_score": [stage_2_results.get(id, float("inf")) for id in ids],
         }
         df = pd.DataFrame(records)
-        top_20_relevant_ids = df.sort_values(by="stage_2_score", ascending=True)[:20]["id"].tolist()
-        
+        relevant_ids = df.sort_values(by="stage_2_score", ascending=True, kind="stable")[:self.max_stage_3_candidates]["id"].tolist()
+
         del df
         gc.collect()
+        return relevant_ids
 
-        if not top_20_relevant_ids:
-            return []
+    def _clear_winner_gap(self, stage_1_results: dict, stage_2_results: dict, candidate_ids: list):
+        """
+        The stage-2 distance gap between the best and the second candidate when the best is also the top BM25 hit,
+        else None.
+        """
+        if len(candidate_ids) < 2 or not stage_1_results:
+            return None
+        best, runner_up = candidate_ids[0], candidate_ids[1]
+        if best != max(stage_1_results, key=stage_1_results.get):
+            return None
+        return stage_2_results.get(runner_up, float("inf")) - stage_2_results.get(best, float("inf"))
+
+    def _clear_winner(self, stage_1_results: dict, stage_2_results: dict, candidate_ids: list):
+        """
+        Returns the best candidate when stages 1 and 2 agree on it by a clear margin (stage 3 is then skipped), else None.
+        """
+        gap = self._clear_winner_gap(stage_1_results, stage_2_results, candidate_ids)
+        if gap is not None and gap >= self.clear_winner_margin:
+            return candidate_ids[0]
+        return None
+
+    def _pack_candidates(self, candidate_ids: list) -> list:
+        """
+        Keep the candidates (in rank order) whose context blocks fit the stage-3 token budget.
+        """
+        blocks = self.get_context_blocks(candidate_ids)
+        packed, used_tokens = [], 0
+        for table_id in candidate_ids:
+            n_tokens = blocks[table_id][1]
+            if len(packed) >= STAGE_3_MIN_CANDIDATES and used_tokens + n_tokens > self.stage_3_token_budget:
+                break
+            packed.append(table_id)
+            used_tokens += n_tokens
+        return packed
 
-        # Stage 3: LLM based relevant-table selection
-        context = self._create_context(top_20_relevant_ids)
+    def _stage_3(self, query: str, candidate_ids: list) -> list:
+        """LLM based relevant-table selection. Returns the selected table-IDs."""
+        context = self._create_context(candidate_ids)
         prompt_list = [
             "#GOAL: Given the following tables context, select up to 5 of the possible relevant tables based on the question asked.",
             "",
@@ -118,10 +323,41 @@ class HybridRetrieval:
             "# QUESTION: " + query,
         ]
         prompt = "\n".join(prompt_list)
-        response = self.llm.with_structured_output(TableSelection).invoke(prompt)
+        with span("retrieval.stage_3_llm", candidates=len(candidate_ids)):
+            record_token_usage(estimated_input_tokens=estimate_tokens(prompt))
+            response = self.llm.with_structured_output(TableSelection).invoke(prompt)
         response_dict = response.model_dump()
-        relevant_tables_ids = [
+        return [
             item["table_id"] for item in response_dict["relevant_tables"]
         ]
 
-        return relevant_tables_ids
\ No newline at end of file
+    def close(self):
+        """Release the open artifact handles (used when a hot-reloaded snapshot is retired)."""
+        for context_store in (self.context_store, self.delta.context_store if self.delta else None):
+            if context_store is not None:
+                context_store.close()
+
+    def search(self, query: str):
+        with span("retrieval.search"):
+            return self._search(query)
+
+    def _search(self, query: str):
+        # Stage 1: Lexical Search
+        stage_1_results = self._stage_1(query)
+
+        # Stage 2: Semantic Search (over the stage-1 candidates only)
+        stage_2_results = self._stage_2(query, list(stage_1_results.keys()))
+        candidate_ids = self._select_candidates(stage_1_results, stage_2_results)
+
+        if not candidate_ids:
+            return []
+
+        # Easy query: stages 1 and 2 agree on a clear winner, no need for the LLM. The winner comes first, followed by
+        # the next stage-2 candidates, so questions spanning several tables keep them.
+        winner = self._clear_winner(stage_1_results, stage_2_results, candidate_ids)
+        if winner is not None:
+            set_attributes(stage_3_skipped=True)
+            return candidate_ids[:self.top_k_stage_2]
+
+        # Stage 3: LLM based relevant-table selection, over the candidates fitting the token budget
+        return self._stage_3(query, self._pack_candidates(candidate_ids))
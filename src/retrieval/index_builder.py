@@ -0,0 +1,548 @@
+"""
+Offline build of the retrieval artifacts (BM25 index, FAISS index, context store) from the JSON-Stat archive.
+
+Usage:
+    python -m src.retrieval.index_builder build [--archive artifacts/cso_bkp/cso_archive/jsonstat_archive.sqlite]
+                                                [--summaries artifacts/cso_smry/summaries.jsonl]
+                                                [--out-root artifacts/index] [--embeddings gemini|hashing]
+                                                [--workers 4] [--batch-size 256] [--version v20250101]
+    python -m src.retrieval.index_builder current [--out-root artifacts/index]
+
+Replaces the manual steps of `notebooks/helpers/2_create_bm25_index.ipynb` and `3_create_table_summaries.ipynb`:
+    1. table-IDs are streamed from the archive; worker processes read + decompress each table themselves and return
+       its chunked bag-of-words (as in notebook 2), the stemmed BM25 tokens and the table metadata (as in notebook 3)
+    2. the tables are processed in batches of `--batch-size`: their BM25 token ids, summaries and embedded vectors are
+       appended to files in the build directory, so memory does not grow with the number of tables
+    3. the BM25 index is built from the memory-mapped token ids and the flat FAISS index is written from the vectors
+       file (streamed, never added to an in-memory index)
+    4. everything is written to `<out-root>/versions/.tmp-<version>/`, then renamed to `<out-root>/versions/<version>/`
+       and the `<out-root>/CURRENT` pointer is replaced atomically
+
+A version directory has the `artifacts/` layout (`bm25/`, `cso_smry/faiss_index/`, `cso_smry/table_contexts.sqlite`)
+plus a `manifest.json`, so it can be passed as `HybridRetrieval(artifacts_dir=...)`.
+
+The LLM-written parts of the summaries (`description`, `sample_questions`) are read from `--summaries` when given;
+tables without a summary get a description made of their name, category and columns.
+
+The manifest records the embedder and its dimension; the served retriever embeds queries with `gemini-embedding-001`
+(`PRODUCTION_EMBEDDER`), so a version built with another embedder is refused under the serving root
+(RETRIEVAL_ARTIFACTS_ROOT, default `artifacts/index`). `--embeddings hashing` builds offline, e.g. for tests or
+benchmarks, into another `--out-root` (or with `--no-publish`).
+
+Memory: the BM25 corpus, token ids, summaries and vectors are on disk while the tables are prepared; only the
+vocabulary and one batch are held. At the end, the BM25 score matrix is built in memory (the size of the saved index,
+memory-mapped when served), and so is the docstore of `index.pkl` (the summaries' text, the same as what the server
+loads), but not the vectors (n_tables x dim x 4 bytes, ~1 GB for 80K tables at 3072 dims).
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import struct
+import hashlib
+import argparse
+import subprocess
+import multiprocessing as mp
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from src.storage.json_stat_archive_db import JSONStatArchiveDB
+
+
+ARCHIVE_PATH = "artifacts/cso_bkp/cso_archive/jsonstat_archive.sqlite"
+INDEX_ROOT = "artifacts/index"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+PRODUCTION_EMBEDDER = "gemini"
+PRODUCTION_EMBEDDING_DIM = 3072
+SERVING_ROOT = os.environ.get("RETRIEVAL_ARTIFACTS_ROOT", INDEX_ROOT)
+
+
+# ---------- PER-TABLE PREPARATION (worker processes) ----------
+
+_archive_reader = None
+_stemmer = None
+
+
+def _init_worker() -> None:
+    global _archive_reader, _stemmer
+    import Stemmer
+    _archive_reader = JSONStatArchiveDB()
+    _stemmer = Stemmer.Stemmer("english")
+
+
+def get_chunked_bag_of_words(cso_file: Dict, chunk_size: int = 1000, chunk_overlap: int = 20) -> List[Dict]:
+    """
+    BM25 corpus chunks of a table: a header (ID, label, category, column names) + a chunk of the category labels.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    col_dist_vals_dic = {}
+    label = cso_file["label"]
+    subject = cso_file["extension"]["subject"]["value"]
+    product = cso_file["extension"]["product"]["value"]
+    table_id = cso_file["extension"]["matrix"]
+
+    for col_id in cso_file["id"]:
+        if col_id.startswith("TLIST"):
+            continue
+        col_name = cso_file["dimension"][col_id]["label"]
+        col_dist_vals_dic[col_name] = list(cso_file["dimension"][col_id]["category"]["label"].values())
+
+    header_str = f"""{table_id} - {label} - {subject} - {product} - {" ".join(col_dist_vals_dic.keys())}"""
+    values_dump = " ".join(val for vals_list in col_dist_vals_dic.values() for val in vals_list)
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+    )
+    texts = [header_str + x.page_content for x in text_splitter.create_documents([values_dump])] or [header_str]
+    return [{"id": table_id, "text": text} for text in texts]
+
+
+def get_table_metadata(cso_file: Dict) -> Dict:
+    """
+    The non-LLM fields of a table summary: name, category, columns and statistic units.
+    """
+    dimension = cso_file["dimension"]
+    # skip the first id as it is usually the STATISTIC field
+    columns = [dimension[col_id]["label"] for col_id in cso_file["id"][1:]]
+
+    statistics_units = []
+    statistic = dimension.get("STATISTIC", {}).get("category", {})
+    for statistic_index in _ordered_index(statistic):
+        statistic_name = statistic.get("label", {}).get(statistic_index, statistic_index)
+        statistic_unit = statistic.get("unit", {}).get(statistic_index, {}).get("label", "")
+        statistics_units.append(f'"{statistic_name}": ({statistic_unit})')
+
+    return {
+        "id": cso_file["extension"]["matrix"],
+        "subject": cso_file["extension"]["subject"]["value"],
+        "product": cso_file["extension"]["product"]["value"],
+        "table_name": cso_file["label"],
+        "columns": columns,
+        "statistics_units": statistics_units,
+    }
+
+
+def _ordered_index(category: Dict) -> List[str]:
+    index = category.get("index", [])
+    if isinstance(index, dict):
+        return sorted(index, key=index.get)
+    return list(index)
+
+
+def _prepare_table(args) -> Optional[Dict]:
+    import bm25s
+
+    archive_path, table_id = args
+    datasets = [(ds, ts) for _, ds, ts in _archive_reader.read(archive_path, table_id=table_id, with_labels=True)]
+    if not datasets:
+        return None
+    cso_file, timestamp = datasets[-1]
+    chunks = get_chunked_bag_of_words(cso_file)
+    tokens = bm25s.tokenize(
+        [chunk["text"] for chunk in chunks], stopwords="en", stemmer=_stemmer, return_ids=False, show_progress=False
+    )
+    return {
+        "table_id": table_id,
+        "timestamp": timestamp,
+        "chunks": chunks,
+        "tokens": tokens,
+        "metadata": get_table_metadata(cso_file),
+    }
+
+
+# ---------- SUMMARIES / DOCUMENTS ----------
+
+def load_summaries(path: Optional[str]) -> Dict[str, Dict]:
+    """
+    The table summaries of notebook 3 (`summaries.jsonl`), keyed by table-ID. Missing file -> {}.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {item["id"]: item for item in (json.loads(line) for line in f if line.strip())}
+
+
+def build_summary(metadata: Dict, summary: Optional[Dict]) -> Dict:
+    """
+    Docstore metadata of a table: the archive metadata + the LLM description and sample questions (if available).
+    """
+    summary = summary or {}
+    description = summary.get("description") or (
+        f"{metadata['table_name']} ({metadata['subject']}: {metadata['product']}). "
+        f"Columns: {', '.join(metadata['columns'])}."
+    )
+    return {**metadata, "description": description, "sample_questions": list(summary.get("sample_questions") or [])}
+
+
+def document_text(summary: Dict) -> str:
+    # same page content as the documents embedded in notebook 3
+    return summary["description"] + "\n\n" + "\n".join(summary["sample_questions"])
+
+
+def get_embedder(name: str):
+    if name == "gemini":
+        from src.utils.resources import get_embeddings
+        return get_embeddings()
+    from src.retrieval.local_embeddings import HashingEmbeddings
+    return HashingEmbeddings()
+
+
+# ---------- ON-DISK BUILD FILES ----------
+
+class TokenSpill:
+    """
+    The BM25 token lists, appended as int32 token ids to a flat file (with the start offset of each chunk), so they
+    are not held in memory. Iterating yields the token ids of each chunk, read from the memory-mapped file: with the
+    vocabulary, it is the `bm25s.tokenization.Tokenized(ids, vocab)` input of `bm25s.BM25.index`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vocab: Dict[str, int] = {}
+        self.offsets = array("q", [0])
+        self._file = open(path, "wb")
+
+    def append(self, token_lists: List[List[str]]) -> None:
+        ids = []
+        for tokens in token_lists:
+            ids.extend(self.vocab.setdefault(token, len(self.vocab)) for token in tokens)
+            self.offsets.append(self.offsets[-1] + len(tokens))
+        np.asarray(ids, dtype=np.int32).tofile(self._file)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self) -> Iterator[List[int]]:
+        # read once the spill is closed
+        if self.offsets[-1] == 0:
+            yield from ([] for _ in range(len(self)))
+            return
+        ids = np.memmap(self.path, dtype=np.int32, mode="r", shape=(self.offsets[-1],))
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield ids[start:end].tolist()
+
+
+class VectorSpill:
+    """
+    The embedded vectors, appended as float32 rows to a flat file (see `write_flat_index`).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.n = 0
+        self.dim: Optional[int] = None
+        self._file = open(path, "wb")
+
+    def append(self, vectors: List[List[float]]) -> None:
+        rows = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = rows.shape[1]
+        elif rows.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension changed during the build: {rows.shape[1]} != {self.dim}")
+        rows.tofile(self._file)
+        self.n += len(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def write_flat_index(vectors_fp: str, n: int, dim: int, index_fp: str) -> None:
+    """
+    Write the `IndexFlatL2` of the vectors of a flat float32 file, as `faiss.write_index` would, by streaming the
+    file instead of adding the vectors to an in-memory index.
+    """
+    import faiss
+
+    # layout: fourcc "IxF2", d (int32), ntotal (int64), 2 x int64, is_trained (byte), metric (int32), then the vectors
+    # as a vector<float>: its length (uint64) and the data. The header is taken from an empty index.
+    empty = faiss.serialize_index(faiss.IndexFlatL2(dim)).tobytes()
+    if empty[:4] != b"IxF2" or len(empty) != 45 or struct.unpack("<Q", empty[-8:])[0] != 0:
+        raise RuntimeError(f"Unexpected FAISS flat index layout (faiss {faiss.__version__})")
+    with open(index_fp, "wb") as out, open(vectors_fp, "rb") as src:
+        out.write(empty[:8] + struct.pack("<q", n) + empty[16:-8] + struct.pack("<Q", n * dim))
+        shutil.copyfileobj(src, out, 1 << 24)
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build_docstore(summaries_fp: str):
+    """
+    The LangChain FAISS docstore of the summaries (in the vectors' order): `(InMemoryDocstore, index_to_docstore_id)`
+    as saved in `index.pkl`.
+    """
+    from langchain_core.documents import Document
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    documents, index_to_docstore_id = {}, {}
+    for i, summary in enumerate(read_jsonl(summaries_fp)):
+        documents[summary["id"]] = Document(id=summary["id"], page_content=document_text(summary), metadata=summary)
+        index_to_docstore_id[i] = summary["id"]
+    return InMemoryDocstore(documents), index_to_docstore_id
+
+
+# ---------- VERSIONED OUTPUT ----------
+
+def current_version(out_root: str = INDEX_ROOT) -> Optional[str]:
+    """
+    The version named by `<out_root>/CURRENT`, or None if nothing was published yet.
+    """
+    try:
+        with open(os.path.join(out_root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_artifacts_dir(out_root: str = INDEX_ROOT) -> Optional[str]:
+    """
+    The directory of the current artifacts version, or None if nothing was published yet.
+    """
+    version = current_version(out_root)
+    return os.path.join(out_root, "versions", version) if version else None
+
+
+def read_manifest(artifacts_dir: str) -> Dict:
+    with open(os.path.join(artifacts_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def check_publishable(out_root: str, embedder_name: str) -> None:
+    """
+    Refuse to publish artifacts built with a non-production embedder to the serving root: their vectors would be
+    searched with `gemini-embedding-001` query vectors.
+    """
+    if embedder_name != PRODUCTION_EMBEDDER and os.path.abspath(out_root) == os.path.abspath(SERVING_ROOT):
+        raise ValueError(
+            f"Refusing to publish an index embedded with '{embedder_name}' to the serving root {out_root} "
+            f"(queries are embedded with '{PRODUCTION_EMBEDDER}'); use another --out-root or --no-publish"
+        )
+
+
+def publish_version(out_root: str, version: str) -> None:
+    """
+    Point `<out_root>/CURRENT` to a built version (atomic replace, readers never see a partial file).
+    """
+    version_dir = os.path.join(out_root, "versions", version)
+    if os.path.exists(os.path.join(version_dir, MANIFEST_FILE)):
+        check_publishable(out_root, read_manifest(version_dir).get("embedder"))
+    tmp_fp = os.path.join(out_root, f".{CURRENT_FILE}.tmp")
+    with open(tmp_fp, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_fp, os.path.join(out_root, CURRENT_FILE))
+
+
+def _file_digests(folder: str) -> Dict[str, Dict]:
+    files = {}
+    for root, _, names in os.walk(folder):
+        for name in sorted(names):
+            fp = os.path.join(root, name)
+            sha = hashlib.sha256()
+            with open(fp, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+            files[os.path.relpath(fp, folder)] = {"bytes": os.path.getsize(fp), "sha256": sha.hexdigest()}
+    return files
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# ---------- BUILD ----------
+
+def build_index(
+    archive_path: str = ARCHIVE_PATH,
+    out_root: str = INDEX_ROOT,
+    summaries_path: Optional[str] = None,
+    embeddings=None,
+    embedder_name: str = PRODUCTION_EMBEDDER,
+    workers: int = None,
+    batch_size: int = 256,
+    version: Optional[str] = None,
+    table_ids: Optional[Iterable[str]] = None,
+    publish: bool = True,
+) -> str:
+    """
+    Build a new artifacts version from the archive.
+
+    Args:
+        archive_path: The JSON-Stat archive (`JSONStatArchiveDB`).
+        out_root: The root of the versioned artifacts.
+        summaries_path: Optional `summaries.jsonl` with the LLM descriptions / sample questions.
+        embeddings: The embeddings client (default: `get_embedder(embedder_name)`).
+        embedder_name: Recorded in the manifest ("gemini" or "hashing"); only "gemini" can be published to the
+            serving root (see `check_publishable`).
+        workers: Number of worker processes for reading + tokenizing the tables (default: CPU count).
+        batch_size: Number of documents embedded and written to the build files at a time.
+        version: The version name (default: a UTC timestamp).
+        table_ids: Only build these tables (default: every table of the archive).
+        publish: Point `CURRENT` to the new version.
+
+    Returns:
+        The directory of the new version.
+    """
+    import bm25s
+    from bm25s.tokenization import Tokenized
+    from src.retrieval.context_store import TableContextStore
+
+    start = time.time()
+    if publish:
+        check_publishable(out_root, embedder_name)
+    embeddings = embeddings or get_embedder(embedder_name)
+    version = version or time.strftime("v%Y%m%d-%H%M%S", time.gmtime())
+    versions_dir = os.path.join(out_root, "versions")
+    final_dir = os.path.join(versions_dir, version)
+    tmp_dir = os.path.join(versions_dir, f".tmp-{version}")
+    if os.path.exists(final_dir):
+        raise FileExistsError(f"Version already exists: {final_dir}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_dir, "cso_smry"))
+    build_dir = os.path.join(tmp_dir, ".build")
+    os.makedirs(build_dir)
+
+    reader = JSONStatArchiveDB()
+    timestamps = reader.read_timestamps(archive_path, table_ids)
+    summaries = load_summaries(summaries_path)
+
+    table_ids_built = []
+    n_chunks = 0
+    pending: List[Dict] = []
+    summaries_fp = os.path.join(tmp_dir, "cso_smry", "summaries.jsonl")
+    corpus_fp = os.path.join(build_dir, "corpus.jsonl")
+    tokens = TokenSpill(os.path.join(build_dir, "tokens.i32"))
+    vectors = VectorSpill(os.path.join(build_dir, "vectors.f32"))
+
+    def flush(batch: List[Dict]) -> None:
+        vectors.append(embeddings.embed_documents([document_text(s) for s in batch]))
+
+    summaries_file = open(summaries_fp, "w")
+    corpus_file = open(corpus_fp, "w")
+    try:
+        # spawn, not fork: bm25s may import multithreaded libraries (e.g. JAX) in this process
+        ctx = mp.get_context("spawn")
+        with ctx.Pool(processes=workers or os.cpu_count(), initializer=_init_worker) as pool:
+            jobs = ((archive_path, table_id) for table_id in sorted(timestamps))
+            for i, prepared in enumerate(pool.imap(_prepare_table, jobs, chunksize=8), start=1):
+                if prepared is None:
+                    continue
+                for chunk in prepared["chunks"]:
+                    corpus_file.write(json.dumps(chunk) + "\n")
+                tokens.append(prepared["tokens"])
+                n_chunks += len(prepared["chunks"])
+                summary = build_summary(prepared["metadata"], summaries.get(prepared["table_id"]))
+                summaries_file.write(json.dumps(summary) + "\n")
+                table_ids_built.append(summary["id"])
+                pending.append(summary)
+                if len(pending) >= batch_size:
+                    flush(pending)
+                    pending = []
+                if i % 1000 == 0:
+                    print(f"Prepared {i}/{len(timestamps)} tables ({n_chunks} BM25 chunks)")
+        if pending:
+            flush(pending)
+        for spill in (summaries_file, corpus_file, tokens, vectors):
+            spill.close()
+        if not table_ids_built:
+            raise ValueError(f"No tables found in the archive: {archive_path}")
+
+        retriever = bm25s.BM25()
+        retriever.index(Tokenized(ids=tokens, vocab=tokens.vocab), show_progress=False)
+        retriever.save(os.path.join(tmp_dir, "bm25"), corpus=read_jsonl(corpus_fp), show_progress=False)
+        del retriever
+
+        faiss_dir = os.path.join(tmp_dir, "cso_smry", "faiss_index")
+        os.makedirs(faiss_dir)
+        write_flat_index(vectors.path, vectors.n, vectors.dim, os.path.join(faiss_dir, "index.faiss"))
+        docstore, index_to_docstore_id = build_docstore(summaries_fp)
+        with open(os.path.join(faiss_dir, "index.pkl"), "wb") as f:
+            pickle.dump((docstore, index_to_docstore_id), f)
+        TableContextStore.build(os.path.join(tmp_dir, "cso_smry", "table_contexts.sqlite"), docstore)
+        del docstore, index_to_docstore_id
+        shutil.rmtree(build_dir)
+
+        manifest = {
+            "version": version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "commit": _git_commit(),
+            "archive": os.path.abspath(archive_path),
+            "n_tables": len(table_ids_built),
+            "n_bm25_chunks": n_chunks,
+            "embedder": embedder_name,
+            "dim": vectors.dim,
+            "table_timestamps": {table_id: timestamps.get(table_id) for table_id in table_ids_built},
+            "build_seconds": round(time.time() - start, 2),
+            "files": _file_digests(tmp_dir),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_dir, final_dir)
+    except BaseException:
+        for spill in (summaries_file, corpus_file, tokens, vectors):
+            spill.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if publish:
+        publish_version(out_root, version)
+    return final_dir
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "current"])
+    parser.add_argument("--archive", default=ARCHIVE_PATH)
+    parser.add_argument("--summaries", default="artifacts/cso_smry/summaries.jsonl")
+    parser.add_argument("--out-root", default=INDEX_ROOT)
+    parser.add_argument("--embeddings", choices=["gemini", "hashing"], default=PRODUCTION_EMBEDDER)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--version", default=None)
+    parser.add_argument("--no-publish", action="store_true", help="build the version without updating CURRENT")
+    args = parser.parse_args()
+
+    if args.command == "current":
+        artifacts_dir = resolve_artifacts_dir(args.out_root)
+        print(json.dumps({k: v for k, v in read_manifest(artifacts_dir).items() if k not in ("files", "table_timestamps")},
+                         indent=2) if artifacts_dir else "No version published yet")
+        return 0
+
+    version_dir = build_index(
+        archive_path=args.archive,
+        out_root=args.out_root,
+        summaries_path=args.summaries,
+        embedder_name=args.embeddings,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        version=args.version,
+        publish=not args.no_publish,
+    )
+    manifest = read_manifest(version_dir)
+    print(f"Built {manifest['version']}: {manifest['n_tables']} tables, {manifest['n_bm25_chunks']} BM25 chunks, "
+          f"{manifest['build_seconds']}s -> {version_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
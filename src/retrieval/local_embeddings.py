@@ -0,0 +1,75 @@
+import os
+import re
+import zlib
+import hashlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic, offline stand-in for `gemini-embedding-001`.
+
+    Texts are embedded as L2-normalised hashed bags of lower-cased word unigrams and bigrams. Similar wording gives
+    similar vectors, which is enough for building / benchmarking indexes without network access or API quota.
+    """
+
+    def __init__(self, dim: int = 3072):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype="float32")
+        words = re.findall(r"\w+", text.lower())
+        for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            h = zlib.crc32(token.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Disk-backed embedding cache (an `.npz` of text-hash -> vector), e.g. to replay benchmark questions offline.
+
+    Misses are embedded with `inner` and added to the cache; with `inner=None` a miss raises `KeyError`.
+    Call `save()` to persist new entries.
+    """
+
+    def __init__(self, cache_path: str, inner: Embeddings = None):
+        self.cache_path = cache_path
+        self.inner = inner
+        self._cache = {}
+        self._dirty = False
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as data:
+                self._cache = {key: data[key] for key in data.files}
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        if key not in self._cache:
+            if self.inner is None:
+                raise KeyError(f"No cached embedding for: {text[:80]}")
+            self._cache[key] = np.asarray(self.inner.embed_query(text), dtype="float32")
+            self._dirty = True
+        return self._cache[key].tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def save(self) -> None:
+        if self._dirty:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            np.savez(self.cache_path, **self._cache)
+            self._dirty = False
@@ -0,0 +1,171 @@
+"""
+RSS / PSS report of the retrieval artifacts versus the number of worker processes.
+
+Usage:
+    python -m src.retrieval.memory_report [--workers 1 2 4] [--artifacts-dir artifacts] [--no-mmap]
+    python -m src.retrieval.memory_report --synthetic-docs 20000 --dim 3072   # without the real artifacts
+
+Each worker loads `HybridRetrieval` (stub embeddings, no LLM calls), touches every page of the indexes and reports
+its RSS and PSS (`/proc/self/smaps_rollup`, Linux only). PSS splits shared pages between the processes mapping
+them, so with memory-mapped artifacts the total PSS stays roughly flat as workers are added, while RSS counts the
+shared pages in every worker.
+"""
+import os
+import json
+import random
+import argparse
+import tempfile
+import multiprocessing as mp
+from typing import Dict
+
+
+def _memory_kb() -> Dict[str, int]:
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    usage[key.lower()] = int(value.split()[0])
+    except FileNotFoundError:
+        import resource
+        usage["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
+
+
+def _worker(artifacts_dir: str, mmap: bool, barrier, queue) -> None:
+    import numpy as np
+    from src.retrieval.hybrid_retrieval import HybridRetrieval
+    from src.retrieval.local_embeddings import HashingEmbeddings
+
+    baseline = _memory_kb()
+    retriever = HybridRetrieval(
+        top_k_stage_1=200,
+        top_k_stage_2=20,
+        embeddings=HashingEmbeddings(),
+        llm=object(),  # stage 3 (LLM) is not exercised
+        artifacts_dir=artifacts_dir,
+        mmap=mmap,
+    )
+    index = retriever.vector_store.index
+    retriever.embeddings.dim = index.d
+
+    # touch every page: a full scan of the vectors + a BM25 query
+    index.search(np.zeros((1, index.d), dtype="float32"), 1)
+    candidates = retriever._stage_1("population of dublin by age group")
+    retriever._stage_2("population of dublin by age group", list(candidates))
+
+    barrier.wait()  # measure while every worker is alive, so that shared pages are split between them
+    usage = _memory_kb()
+    queue.put({key: usage[key] - baseline.get(key, 0) for key in usage})
+    barrier.wait()
+
+
+def _synthetic_metadata(doc: dict) -> dict:
+    # same fields as the table summaries created in `notebooks/helpers/3_create_table_summaries.ipynb`
+    words = doc["text"].split(" - ", 1)[1].split()
+    return {
+        "id": doc["id"],
+        "table_name": " ".join(words[:6]).title(),
+        "subject": words[6].title(),
+        "product": words[7].title(),
+        "description": doc["text"],
+        "columns": ["Year", "County", "Sex"],
+        "statistics_units": [f'"{words[8].title()}": (Number)'],
+        "sample_questions": [" ".join(words[i:i + 5]) + "?" for i in range(0, 15, 5)],
+    }
+
+
+def build_synthetic_artifacts(artifacts_dir: str, n_docs: int, dim: int) -> None:
+    """
+    Write BM25 + FAISS artifacts for `n_docs` random tables into `artifacts_dir` (same layout as `artifacts/`).
+    """
+    import bm25s
+    import faiss
+    import Stemmer
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from src.retrieval.local_embeddings import HashingEmbeddings
+
+    rng = random.Random(0)
+    vocab = ["population", "dublin", "cork", "unemployment", "rate", "energy", "renewable", "inflation", "price",
+             "index", "county", "age", "sex", "year", "quarter", "month", "sales", "production", "housing", "rent"]
+    corpus = [
+        {"id": f"SYN{i:05d}", "text": f"SYN{i:05d} - " + " ".join(rng.choices(vocab, k=40))}
+        for i in range(n_docs)
+    ]
+
+    stemmer = Stemmer.Stemmer("english")
+    retriever = bm25s.BM25(corpus=corpus)
+    retriever.index(bm25s.tokenize([d["text"] for d in corpus], stopwords="en", stemmer=stemmer, show_progress=False),
+                    show_progress=False)
+    retriever.save(os.path.join(artifacts_dir, "bm25"))
+
+    embeddings = HashingEmbeddings(dim=dim)
+    vector_store = FAISS(
+        embedding_function=embeddings,
+        index=faiss.IndexFlatL2(dim),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    for start in range(0, n_docs, 1000):
+        chunk = corpus[start:start + 1000]
+        vectors = embeddings.embed_documents([d["text"] for d in chunk])
+        vector_store.add_embeddings(
+            text_embeddings=[(d["text"], v) for d, v in zip(chunk, vectors)],
+            metadatas=[_synthetic_metadata(d) for d in chunk],
+            ids=[d["id"] for d in chunk],
+        )
+    vector_store.save_local(os.path.join(artifacts_dir, "cso_smry", "faiss_index"))
+
+
+def run_report(artifacts_dir: str, worker_counts: list, mmap: bool) -> list:
+    ctx = mp.get_context("spawn")
+    rows = []
+    for n_workers in worker_counts:
+        barrier = ctx.Barrier(n_workers)
+        queue = ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(artifacts_dir, mmap, barrier, queue)) for _ in range(n_workers)]
+        for proc in procs:
+            proc.start()
+        results = [queue.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        rows.append({
+            "workers": n_workers,
+            "mmap": mmap,
+            "total_rss_mb": round(sum(r.get("rss", 0) for r in results) / 1024, 1),
+            "total_pss_mb": round(sum(r.get("pss", 0) for r in results) / 1024, 1),
+            "per_worker_rss_mb": round(sum(r.get("rss", 0) for r in results) / 1024 / n_workers, 1),
+        })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--artifacts-dir", default="artifacts")
+    parser.add_argument("--no-mmap", action="store_true", help="load the artifacts into each process' heap")
+    parser.add_argument("--synthetic-docs", type=int, default=0, help="build synthetic artifacts of this size")
+    parser.add_argument("--dim", type=int, default=3072, help="vector dimension of the synthetic artifacts")
+    parser.add_argument("--json", dest="json_path", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        artifacts_dir = args.artifacts_dir
+        if args.synthetic_docs:
+            artifacts_dir = tmp_dir
+            build_synthetic_artifacts(artifacts_dir, args.synthetic_docs, args.dim)
+        rows = run_report(artifacts_dir, args.workers, mmap=not args.no_mmap)
+
+    print(f"{'workers':>8} {'mmap':>5} {'total RSS (MB)':>15} {'total PSS (MB)':>15} {'RSS/worker (MB)':>16}")
+    for row in rows:
+        print(f"{row['workers']:>8} {str(row['mmap']):>5} {row['total_rss_mb']:>15} {row['total_pss_mb']:>15} "
+              f"{row['per_worker_rss_mb']:>16}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import gc
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from src.retrieval.index_builder import INDEX_ROOT, MANIFEST_FILE, current_version, read_manifest, resolve_artifacts_dir
+from src.retrieval.delta_index import DELTA_DIR, DELTA_MANIFEST_FILE, acquire_lease, release_lease
+from src.utils.single_flight import SingleFlight
+
+
+class _Snapshot:
+    def __init__(self, key: Tuple[str, Optional[str]], retriever, lease: Optional[str] = None):
+        self.key = key
+        self.retriever = retriever
+        self.lease = lease
+        self.refs = 0
+        self.retired = False
+        self.loaded_at = time.time()
+
+
+class RetrievalSnapshotManager:
+    """
+    Serves searches from the active `HybridRetrieval` snapshot and hot-swaps it when new artifacts are published.
+
+    The active artifacts are `<artifacts_root>/CURRENT` (see `src.retrieval.index_builder`) with the live delta
+    generation of that version (see `src.retrieval.delta_index`); `fallback_dir` is used while nothing is published.
+    A background watcher polls both pointers, loads a changed version next to the active one and swaps it in
+    atomically. Searches hold a reference to the snapshot they started on, so in-flight searches finish on the old
+    snapshot; a retired snapshot is released once its last reference is dropped. A snapshot holds a lease on its
+    delta generation until then, so `src.retrieval.delta_index` does not remove the generation's folder under it.
+
+    Before a new version is loaded, the embedder and dimension of its manifest are checked against the query
+    embedder; a mismatching version is not swapped in (the active snapshot keeps serving, the error is in `info()`).
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], object],
+        artifacts_root: str = INDEX_ROOT,
+        fallback_dir: str = "artifacts",
+        poll_interval: float = 30.0,
+        embedder: Optional[str] = None,
+        dim: Optional[int] = None,
+    ):
+        """
+        Args:
+            factory (Callable[[str], HybridRetrieval]): Builds a retriever for an artifacts directory.
+            artifacts_root (str): The root of the versioned artifacts.
+            fallback_dir (str): The artifacts directory used when no version is published.
+            poll_interval (float): Seconds between two checks of the published version (0 disables the watcher).
+            embedder (str): The embedder of the queries (e.g. "gemini"); versions built with another are refused.
+            dim (int): The dimension of the query vectors; versions of another dimension are refused.
+        """
+        self.factory = factory
+        self.artifacts_root = artifacts_root
+        self.fallback_dir = fallback_dir
+        self.poll_interval = poll_interval
+        self.embedder = embedder
+        self.dim = dim
+        self._active: Optional[_Snapshot] = None
+        self._lock = threading.Lock()           # guards `_active` and the reference counts
+        self._reload_lock = threading.Lock()    # one snapshot load at a time
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+        self._search_flight = SingleFlight()     # concurrent identical queries share one search
+
+    # ---------- SNAPSHOTS ----------
+
+    def artifacts_key(self) -> Tuple[str, Optional[str]]:
+        """
+        The (artifacts directory, delta generation) that should currently be served.
+        """
+        artifacts_dir = resolve_artifacts_dir(self.artifacts_root) or self.fallback_dir
+        return artifacts_dir, current_version(os.path.join(artifacts_dir, DELTA_DIR))
+
+    def acquire(self) -> _Snapshot:
+        """
+        Take a reference on the active snapshot (loading the first one if needed). Pair with `release`.
+        """
+        while True:
+            with self._lock:
+                if self._active is not None:
+                    self._active.refs += 1
+                    return self._active
+            self.reload()
+
+    def release(self, snapshot: _Snapshot) -> None:
+        with self._lock:
+            snapshot.refs -= 1
+            dispose = snapshot.retired and snapshot.refs == 0
+        if dispose:
+            self._dispose(snapshot)
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Yields the retriever of the active snapshot, kept alive until the block exits.
+        """
+        snapshot = self.acquire()
+        try:
+            yield snapshot.retriever
+        finally:
+            self.release(snapshot)
+
+    def reload(self) -> bool:
+        """
+        Load and swap in the published artifacts if they changed. Returns True if a new snapshot was swapped in.
+        """
+        with self._reload_lock:
+            key = self.artifacts_key()
+            if self._active is not None and self._active.key == key:
+                return False
+
+            # loaded outside `_lock`: searches keep running on the active snapshot meanwhile
+            self._validate(key)
+            new_snapshot = self._load(key)
+            key = new_snapshot.key
+            with self._lock:
+                old_snapshot, self._active = self._active, new_snapshot
+                dispose = False
+                if old_snapshot is not None:
+                    old_snapshot.retired = True
+                    dispose = old_snapshot.refs == 0
+            self.reloads += 1
+
+        if old_snapshot is not None:
+            print(f"Retrieval artifacts swapped: {old_snapshot.key} -> {key}")
+            if dispose:
+                self._dispose(old_snapshot)
+        return True
+
+    def _validate(self, key: Tuple[str, Optional[str]]) -> None:
+        """
+        Raise a ValueError if the manifests of the artifacts (and of their delta) do not match the query embedder.
+        Artifacts without a manifest (the notebook builds) are not checked.
+        """
+        manifests = []
+        if os.path.exists(os.path.join(key[0], MANIFEST_FILE)):
+            manifests.append((key[0], read_manifest(key[0])))
+        delta_manifest_fp = os.path.join(self._generation_dir(key), DELTA_MANIFEST_FILE) if key[1] else None
+        if delta_manifest_fp and os.path.exists(delta_manifest_fp):
+            with open(delta_manifest_fp) as f:
+                manifests.append((os.path.dirname(delta_manifest_fp), json.load(f)))
+        for folder, manifest in manifests:
+            embedder, dim = manifest.get("embedder"), manifest.get("dim")
+            if self.embedder and embedder and embedder != self.embedder:
+                raise ValueError(f"{folder} is embedded with '{embedder}', queries with '{self.embedder}': not loaded")
+            if self.dim and dim and int(dim) != self.dim:
+                raise ValueError(f"{folder} has {dim}-dim vectors, queries have {self.dim}: not loaded")
+
+    def _generation_dir(self, key: Tuple[str, Optional[str]]) -> Optional[str]:
+        return os.path.join(key[0], DELTA_DIR, "versions", key[1]) if key[1] else None
+
+    def _load(self, key: Tuple[str, Optional[str]]) -> _Snapshot:
+        # the lease is taken before loading, so the generation cannot be removed while it loads
+        lease = acquire_lease(self._generation_dir(key)) if key[1] else None
+        try:
+            retriever = self.factory(key[0])
+        except BaseException:
+            if lease:
+                release_lease(lease)
+            raise
+        # the retriever resolves the delta pointer itself: lease the generation it actually loaded
+        delta = getattr(retriever, "delta", None)
+        generation = os.path.basename(delta.folder) if delta is not None else None
+        if generation != key[1]:
+            key = (key[0], generation)
+            if lease:
+                release_lease(lease)
+            try:
+                lease = acquire_lease(self._generation_dir(key)) if generation else None
+            except FileNotFoundError:
+                retriever.close()
+                raise
+        return _Snapshot(key, retriever, lease)
+
+    def _dispose(self, snapshot: _Snapshot) -> None:
+        retriever, snapshot.retriever = snapshot.retriever, None
+        close = getattr(retriever, "close", None)
+        if close:
+            close()
+        del retriever
+        gc.collect()
+        if snapshot.lease:
+            release_lease(snapshot.lease)
+
+    # ---------- WATCHER ----------
+
+    def start(self) -> None:
+        """
+        Start the background watcher (no-op if already running or `poll_interval` is 0).
+        """
+        if self.poll_interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="retrieval-snapshot-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.reload()
+                self.last_error = None
+            except Exception as e:
+                # a broken / partial / mismatching version must not take the worker down: keep serving the active
+                # snapshot (the warning is printed once per error, the version is re-checked on every poll)
+                error = f"{e.__class__.__name__}: {e}"
+                if error != self.last_error:
+                    print(f"Warning: failed to load the retrieval artifacts {self.artifacts_key()}: {error}")
+                self.last_error = error
+            self._refresh_lease()
+
+    def _refresh_lease(self) -> None:
+        # leases are checked by age from other hosts (see `src.retrieval.delta_index.LEASE_MAX_AGE`)
+        with self._lock:
+            lease = self._active.lease if self._active is not None else None
+        if lease:
+            try:
+                os.utime(lease)
+            except FileNotFoundError:
+                pass
+
+    # ---------- RETRIEVER API ----------
+
+    def search(self, query: str):
+        def _search():
+            with self.snapshot() as retriever:
+                return retriever.search(query)
+
+        return self._search_flight.do(" ".join(query.split()), _search)
+
+    def get_context_blocks(self, table_ids: list, kind: str = "retrieval") -> dict:
+        with self.snapshot() as retriever:
+            return retriever.get_context_blocks(table_ids, kind)
+
+    def info(self) -> Dict:
+        with self._lock:
+            active = self._active
+            return {
+                "artifacts_dir": active.key[0] if active else None,
+                "delta_generation": active.key[1] if active else None,
+                "loaded_at": active.loaded_at if active else None,
+                "in_flight": active.refs if active else 0,
+                "reloads": self.reloads,
+                "embedder": self.embedder,
+                "dim": self.dim,
+                "last_error": self.last_error,
+                "searches": self._search_flight.calls,
+                "shared_searches": self._search_flight.shared,
+            }
@@ -0,0 +1,414 @@
+"""
+Content-addressed blob store keeping the large graph-state fields (analysis reports, table contexts) out of the
+checkpoints: the state holds `blob:sha256:<digest>` references, resolved lazily (e.g. by `provenance_tool`).
+
+Blobs are zstd-compressed JSON, stored in Redis (the checkpointer's instance, so every worker resolves the references
+of every thread) or in a local SQLite file. Identical values share a blob.
+
+Each blob records the owners referencing it (threads, or the answer cache whose entries are reused by other threads,
+see `add_owner`): `release(owner)` (on chat reset) drops the owner's references and deletes the blobs no other owner
+references. In Redis, blobs and their reference sets also expire BLOB_STORE_TTL_DAYS after they were last used
+(default 30, 0 disables), for threads that are never reset: the expiry is refreshed when a blob is stored, read or
+owned, and for all the blobs of a thread on each of its turns (`touch`).
+
+Usage (checkpoint size / serialization time of a long thread, inline values vs references):
+    python -m src.storage.blob_store bench [--turns 30] [--tables 3] [--steps 5]
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from src.storage.json_stat_archive_db import (
+    _from_json_bytes,
+    _to_json_bytes,
+    _zstd_compress_bytes,
+    _zstd_decompress_bytes,
+)
+
+
+BLOB_REF_PREFIX = "blob:sha256:"
+BLOB_STORE_PATH = "cache/blob_store.sqlite"
+BLOB_REDIS_PREFIX = "cso:blob"
+BLOB_STORE_TTL_DAYS = float(os.environ.get("BLOB_STORE_TTL_DAYS", "30"))
+
+
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX)
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """
+    Base class: `put` / `get` JSON values by content address. Backends implement `_write` / `_read`.
+    """
+
+    def __init__(self, compression_level: int = 6):
+        self.level = compression_level
+
+    def put(self, value: Any, owner: Optional[str] = None) -> str:
+        """
+        Store a JSON-serializable value and return its reference.
+
+        Args:
+            value: The value.
+            owner: The thread referencing the value (see `release`); None keeps the blob until it expires.
+        """
+        return self.put_many([value], owner)[0]
+
+    def put_many(self, values: Iterable[Any], owner: Optional[str] = None) -> List[str]:
+        refs, blobs = [], {}
+        for value in values:
+            data = _to_json_bytes(value)
+            digest = _digest(data)
+            refs.append(BLOB_REF_PREFIX + digest)
+            if digest not in blobs:
+                blobs[digest] = _zstd_compress_bytes(data, level=self.level)
+        if blobs:
+            self._write(blobs, owner)
+        return refs
+
+    def get(self, ref: str, default: Any = None) -> Any:
+        """
+        The value of a reference (`default` if the blob is missing).
+        """
+        return self.get_many([ref]).get(ref, default)
+
+    def get_many(self, refs: Iterable[str]) -> Dict[str, Any]:
+        """
+        {reference: value} of the references found in the store.
+        """
+        digests = list(dict.fromkeys(ref[len(BLOB_REF_PREFIX):] for ref in refs if is_blob_ref(ref)))
+        if not digests:
+            return {}
+        found = self._read(digests)
+        return {BLOB_REF_PREFIX + d: _from_json_bytes(_zstd_decompress_bytes(blob)) for d, blob in found.items()}
+
+    def resolve(self, value: Any, default: Any = None) -> Any:
+        """
+        The value behind a reference, or the value itself if it is not a reference (inline values of older states).
+        """
+        return self.get(value, default) if is_blob_ref(value) else value
+
+    def add_owner(self, refs: Iterable[str], owner: str) -> List[str]:
+        """
+        Make `owner` reference existing blobs too (e.g. the reports of a cached answer reused by another thread), so
+        that they outlive the release of their other owners.
+
+        Returns:
+            The references whose blob is missing (expired or released).
+        """
+        digests = list(dict.fromkeys(ref[len(BLOB_REF_PREFIX):] for ref in refs if is_blob_ref(ref)))
+        if not digests:
+            return []
+        return [BLOB_REF_PREFIX + d for d in self._own(digests, owner)]
+
+    def touch(self, owner: str) -> None:
+        """
+        Refresh the expiry of the blobs of an active owner (no-op for backends without expiry).
+        """
+
+    def release(self, owner: str) -> int:
+        """
+        Drop the references of an owner and delete the blobs no other owner references. Returns the number of
+        deleted blobs.
+        """
+        raise NotImplementedError
+
+    def _own(self, digests: List[str], owner: str) -> List[str]:
+        raise NotImplementedError
+
+    def _write(self, blobs: Dict[str, bytes], owner: Optional[str]) -> None:
+        raise NotImplementedError
+
+    def _read(self, digests: List[str]) -> Dict[str, bytes]:
+        raise NotImplementedError
+
+
+class SQLiteBlobStore(BlobStore):
+    """
+    Blobs in a local SQLite file (one connection per thread, WAL mode).
+    """
+
+    def __init__(self, db_path: str = BLOB_STORE_PATH, compression_level: int = 6):
+        super().__init__(compression_level)
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS refs (owner TEXT NOT NULL, digest TEXT NOT NULL, PRIMARY KEY (owner, digest))")
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def _write(self, blobs: Dict[str, bytes], owner: Optional[str]) -> None:
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO blobs (digest, data, created_at) VALUES (?, ?, ?)",
+                [(digest, blob, now) for digest, blob in blobs.items()],
+            )
+            if owner is not None:
+                conn.executemany("INSERT OR IGNORE INTO refs (owner, digest) VALUES (?, ?)", [(owner, d) for d in blobs])
+
+    def _own(self, digests: List[str], owner: str) -> List[str]:
+        with self._conn() as conn:
+            found = set()
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                found.update(row[0] for row in conn.execute(
+                    f"SELECT digest FROM blobs WHERE digest IN ({','.join('?' * len(chunk))})", chunk
+                ))
+            conn.executemany("INSERT OR IGNORE INTO refs (owner, digest) VALUES (?, ?)", [(owner, d) for d in found])
+        return [d for d in digests if d not in found]
+
+    def release(self, owner: str) -> int:
+        with self._conn() as conn:
+            digests = [row[0] for row in conn.execute("SELECT digest FROM refs WHERE owner = ?", (owner,))]
+            conn.execute("DELETE FROM refs WHERE owner = ?", (owner,))
+            deleted = 0
+            for digest in digests:
+                deleted += conn.execute(
+                    "DELETE FROM blobs WHERE digest = ? AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.digest = ?)",
+                    (digest, digest),
+                ).rowcount
+        return deleted
+
+    def _read(self, digests: List[str]) -> Dict[str, bytes]:
+        found = {}
+        conn = self._conn()
+        for i in range(0, len(digests), 500):
+            chunk = digests[i:i + 500]
+            rows = conn.execute(
+                f"SELECT digest, data FROM blobs WHERE digest IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update(rows)
+        return found
+
+
+class RedisBlobStore(BlobStore):
+    """
+    Blobs in Redis (shared by all workers / hosts using the same Redis as the checkpointer).
+
+    Keys: `<prefix>:<digest>` (the blob), `<prefix>:<digest>:owners` (the threads referencing it) and
+    `<prefix>:refs:<owner>` (the digests of an owner), all expiring `ttl_days` after they were last used.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        prefix: str = BLOB_REDIS_PREFIX,
+        ttl_days: float = BLOB_STORE_TTL_DAYS,
+        compression_level: int = 6,
+        client=None,
+    ):
+        """
+        Args:
+            redis_url (str): The Redis instance (ignored when `client` is given).
+            prefix (str): The key prefix.
+            ttl_days (float): Expiry of the blobs and reference sets after their last use (0: never).
+            compression_level (int): The zstd level.
+            client: A `redis.Redis` client to use instead of connecting to `redis_url`.
+        """
+        super().__init__(compression_level)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(redis_url)
+        self.prefix = prefix
+        self.ttl = int(ttl_days * 24 * 3600) or None
+        self._redis = client
+
+    def _blob_key(self, digest: str) -> str:
+        return f"{self.prefix}:{digest}"
+
+    def _owners_key(self, digest: str) -> str:
+        return f"{self.prefix}:{digest}:owners"
+
+    def _refs_key(self, owner: str) -> str:
+        return f"{self.prefix}:refs:{owner}"
+
+    def _write(self, blobs: Dict[str, bytes], owner: Optional[str]) -> None:
+        # the owner is added before the blob is written: a concurrent `release` either sees it (and keeps the blob)
+        # or has deleted the blob already (and it is written again)
+        pipe = self._redis.pipeline(transaction=False)
+        for digest, blob in blobs.items():
+            if owner is not None:
+                pipe.sadd(self._owners_key(digest), owner)
+                pipe.sadd(self._refs_key(owner), digest)
+            # SET NX: an existing blob has the same content, only its expiry is refreshed
+            pipe.set(self._blob_key(digest), blob, nx=True, ex=self.ttl)
+            if self.ttl:
+                pipe.expire(self._blob_key(digest), self.ttl)
+                if owner is not None:
+                    pipe.expire(self._owners_key(digest), self.ttl)
+        if owner is not None and self.ttl:
+            pipe.expire(self._refs_key(owner), self.ttl)
+        pipe.execute()
+
+    def _refresh(self, pipe, digests: Iterable[str]) -> None:
+        if self.ttl:
+            for digest in digests:
+                pipe.expire(self._blob_key(digest), self.ttl)
+                pipe.expire(self._owners_key(digest), self.ttl)
+
+    def _read(self, digests: List[str]) -> Dict[str, bytes]:
+        values = self._redis.mget([self._blob_key(d) for d in digests])
+        found = {d: v for d, v in zip(digests, values) if v is not None}
+        if found and self.ttl:
+            pipe = self._redis.pipeline(transaction=False)
+            self._refresh(pipe, found)
+            pipe.execute()
+        return found
+
+    def _own(self, digests: List[str], owner: str) -> List[str]:
+        # as in `_write`, the owner is added before the blob is checked: a concurrent `release` then keeps the blob
+        pipe = self._redis.pipeline(transaction=False)
+        for digest in digests:
+            pipe.sadd(self._owners_key(digest), owner)
+            pipe.sadd(self._refs_key(owner), digest)
+            pipe.exists(self._blob_key(digest))
+        exists = pipe.execute()[2::3]
+        missing = [d for d, found in zip(digests, exists) if not found]
+
+        pipe = self._redis.pipeline(transaction=False)
+        for digest in missing:
+            pipe.srem(self._owners_key(digest), owner)
+            pipe.srem(self._refs_key(owner), digest)
+        self._refresh(pipe, [d for d in digests if d not in missing])
+        if self.ttl:
+            pipe.expire(self._refs_key(owner), self.ttl)
+        pipe.execute()
+        return missing
+
+    def touch(self, owner: str) -> None:
+        if not self.ttl:
+            return
+        refs_key = self._refs_key(owner)
+        digests = [d.decode() if isinstance(d, bytes) else d for d in self._redis.smembers(refs_key)]
+        pipe = self._redis.pipeline(transaction=False)
+        self._refresh(pipe, digests)
+        pipe.expire(refs_key, self.ttl)
+        pipe.execute()
+
+    def release(self, owner: str) -> int:
+        import redis
+
+        refs_key = self._refs_key(owner)
+        deleted = 0
+        for digest in self._redis.smembers(refs_key):
+            digest = digest.decode() if isinstance(digest, bytes) else digest
+            owners_key = self._owners_key(digest)
+            with self._redis.pipeline() as pipe:
+                while True:
+                    try:
+                        # the blob is deleted only if no other owner was added meanwhile (WATCH)
+                        pipe.watch(owners_key)
+                        others = {o.decode() if isinstance(o, bytes) else o for o in pipe.smembers(owners_key)} - {owner}
+                        pipe.multi()
+                        pipe.srem(owners_key, owner)
+                        if not others:
+                            pipe.delete(self._blob_key(digest), owners_key)
+                        pipe.execute()
+                        deleted += not others
+                        break
+                    except redis.WatchError:
+                        continue
+        self._redis.delete(refs_key)
+        return deleted
+
+
+# ---------- STATE HELPERS ----------
+
+def report_refs(reports: Dict[str, List[Any]]) -> List[str]:
+    """
+    The blob references of a `reports` state field ({table_id: entries}).
+    """
+    return [entry for entries in reports.values() for entry in entries if is_blob_ref(entry)]
+
+
+def resolve_report(entries: List[Any], store: Optional[BlobStore]) -> List[Dict[str, Any]]:
+    """
+    The report entries of a table, with references resolved (inline dict entries of older states are kept as-is).
+    """
+    refs = [e for e in entries if is_blob_ref(e)]
+    values = store.get_many(refs) if store is not None and refs else {}
+    missing = {"task": "(unavailable)", "code": "", "result": "The stored report of this step is no longer available."}
+    return [values.get(e, missing) if is_blob_ref(e) else e for e in entries]
+
+
+# ---------- BENCHMARK ----------
+
+def run_benchmark(n_turns: int, n_tables: int, n_steps: int, store: BlobStore) -> List[Dict[str, Any]]:
+    """
+    Serialize the `reports` / `relevant_tables_metadata` of a growing thread with the checkpointer's serializer,
+    inline vs as references, and report the checkpoint size and serialization time at the last turn.
+    """
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+    serde = JsonPlusSerializer()
+    code = "import pandas as pd\ndf = pd.read_csv('cache/TABLE.csv')\n" + "df = df[df['County'] == 'Dublin']\n" * 5
+    result = "\n".join(f"{2000 + i}    {1000 + 17 * i}" for i in range(40))
+    context = "**Table Info**:\n" + "\n".join(f"column_{i}    object    12    0" for i in range(200))
+
+    inline = {"reports": {}, "relevant_tables_metadata": {}}
+    refs = {"reports": {}, "relevant_tables_metadata": {}}
+    for turn in range(n_turns):
+        for t in range(n_tables):
+            table_id = f"TBL{t:02d}"
+            entries = [{"task": f"Turn {turn} step {s}", "code": code, "result": result} for s in range(n_steps)]
+            inline["reports"][table_id] = inline["reports"].get(table_id, []) + entries
+            refs["reports"][table_id] = refs["reports"].get(table_id, []) + store.put_many(entries)
+            inline["relevant_tables_metadata"][table_id] = {"context": context}
+            refs["relevant_tables_metadata"][table_id] = {"context": store.put(context)}
+
+    rows = []
+    for name, state in (("inline", inline), ("references", refs)):
+        start = time.perf_counter()
+        for _ in range(20):
+            _, payload = serde.dumps_typed(state)
+        rows.append({
+            "state": name,
+            "turns": n_turns,
+            "report_entries": n_turns * n_tables * n_steps,
+            "checkpoint_bytes": len(payload),
+            "serialize_ms": round((time.perf_counter() - start) / 20 * 1000, 3),
+        })
+    return rows
+
+
+def main() -> int:
+    import tempfile
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--tables", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        store = SQLiteBlobStore(os.path.join(folder, "blobs.sqlite"))
+        for row in run_benchmark(args.turns, args.tables, args.steps, store):
+            print(json.dumps(row))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,36 @@
+"""
+Single-file JSON-Stat archive (SQLite + Zstd), see `JSONStatArchiveDB`.
+
+Usage:
+    python -m src.storage.json_stat_archive_db verify <archive.sqlite>
+    python -m src.storage.json_stat_archive_db rewrite <archive.sqlite>
+    python -m src.storage.json_stat_archive_db bench [<archive.sqlite>] [--synthetic 200] [--categories 30] [--years 10]
+                                                     [--threads 8] [--limit 500] [--json out.json]
+
+`verify` checks that every dataset blob decompresses to JSON (with as many values as its size), that every
+`dim_map_json` fingerprint resolves to a registry entry, and that every registry entry decompresses and matches its
+fingerprint; it exits with 1 on any problem.
+
+`rewrite` re-compacts the datasets stored with their labels inline (no dim map, reported by `verify` as
+`datasets_without_dim_map`). Archives written before the JSON-Stat 2.0 top-level "id" was read have empty dim maps for
+all their datasets: until they are rewritten (or rebuilt), their dimensions have no registry fingerprint, and
+`align_tables` only matches them by dimension-ID and role.
+
+`bench` reads the tables (with labels, as the app does) single-threaded and with `--threads` reader threads, cold
+(the archive file dropped from the page cache, where the OS allows it) and warm, and reports tables/s and MB/s
+(compressed and decompressed JSON). Without an archive path, a synthetic archive of `--synthetic` tables is generated
+(see `src.storage.synthetic_archive`).
+"""
+import os
+import sys
 import json
+import time
 import sqlite3
 import hashlib
-from typing import Dict, Any, Iterable, Optional, Generator, Tuple
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, List, Optional, Generator, Tuple
 import zstandard as zstd
 
 
@@ -128,6 +157,60 @@ class JSONStatArchiveDB:
         finally:
             conn.close()
 
+    def read_timestamps(self, db_path: str, table_ids: Optional[Iterable[str]] = None) -> Dict[str, Optional[str]]:
+        """
+        Read the archive timestamps without decompressing any dataset.
+
+        Args:
+            db_path: path to sqlite archive
+            table_ids: if provided, only those tables; else all
+
+        Returns:
+            {table_id: timestamp}
+        """
+        conn = sqlite3.connect(db_path)
+        try:
+            if table_ids is None:
+                rows = conn.execute("SELECT table_id, timestamp FROM datasets")
+            else:
+                table_ids = list(table_ids)
+                if not table_ids:
+                    return {}
+                placeholders = ",".join("?" for _ in table_ids)
+                rows = conn.execute(
+                    f"SELECT table_id, timestamp FROM datasets WHERE table_id IN ({placeholders})",
+                    table_ids,
+                )
+            return {tid: ts for tid, ts in rows}
+        finally:
+            conn.close()
+
+    def read_dim_maps(self, db_path: str, table_ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """
+        Read the dimension -> registry-fingerprint maps without decompressing any dataset. Tables sharing a
+        fingerprint share the exact same coding (codes, order and labels) of that dimension.
+
+        Args:
+            db_path: path to sqlite archive
+            table_ids: the tables
+
+        Returns:
+            {table_id: {dimension: fingerprint}}
+        """
+        table_ids = list(table_ids)
+        if not table_ids:
+            return {}
+        conn = sqlite3.connect(db_path)
+        try:
+            placeholders = ",".join("?" for _ in table_ids)
+            rows = conn.execute(
+                f"SELECT table_id, dim_map_json FROM datasets WHERE table_id IN ({placeholders})",
+                table_ids,
+            )
+            return {tid: json.loads(dim_map_json) if dim_map_json else {} for tid, dim_map_json in rows}
+        finally:
+            conn.close()
+
     # ---------- INTERNALS ----------
 
     def _init_schema(self, conn: sqlite3.Connection) -> None:
@@ -172,7 +255,8 @@ class JSONStatArchiveDB:
             return ds, {}, {}
 
         dims = ds["dimension"]
-        dim_ids = dims.get("id", [])
+        # JSON-Stat 2.0 lists the dimensions in the top-level "id", 1.x inside "dimension"
+        dim_ids = ds.get("id") or dims.get("id", [])
         reg_updates: Dict[str, Dict[str, Any]] = {}
         dim_map: Dict[str, str] = {}
 
@@ -199,7 +283,10 @@ class JSONStatArchiveDB:
             # strip labels in the compact dataset
             c_d = c_dims.get(dim_name, {})
             c_cat = c_d.get("category", {}) or {}
-            c_cat["index"] = index_list
+            # the index keeps its original form (list or {code: position}); a category given by its labels only
+            # gets an explicit index, its codes would be lost with the labels otherwise
+            if "index" not in c_cat:
+                c_cat["index"] = index_list
             if "label" in c_cat:
                 del c_cat["label"]
             c_d["category"] = c_cat
@@ -213,7 +300,7 @@ class JSONStatArchiveDB:
     def _rehydrate(self, conn: sqlite3.Connection, ds: Dict[str, Any], dim_map: Dict[str, str]) -> Dict[str, Any]:
         out = json.loads(json.dumps(ds))
         dims = out["dimension"]
-        dim_ids = dims.get("id", [])
+        dim_ids = out.get("id") or dims.get("id", [])
 
         # prepare statement
         q = "SELECT entry_json_zst FROM registry WHERE fingerprint=?"
@@ -231,7 +318,7 @@ class JSONStatArchiveDB:
             cat = d.get("category", {}) or {}
 
             stored_index = reg.get("index") or []
-            if stored_index:
+            if stored_index and "index" not in cat:
                 cat["index"] = stored_index
 
             labels = reg.get("labels")
@@ -246,4 +333,209 @@ class JSONStatArchiveDB:
             dims[dim_name] = d
 
         out["dimension"] = dims
-        return out
\ No newline at end of file
+        return out
+
+
+# ---------- VERIFY ----------
+
+def verify_archive(db_path: str, max_problems: int = 20) -> Dict[str, Any]:
+    """
+    Scan the archive: every dataset blob decompresses to JSON (a dataset has as many values as its size), every
+    `dim_map_json` fingerprint resolves to a registry entry, and every registry entry decompresses and hashes to its
+    fingerprint.
+
+    Returns:
+        {"datasets": n, "registry_entries": n, "datasets_without_dim_map": n, "problems": n, "first_problems": [...]}
+    """
+    problems: List[str] = []
+    conn = sqlite3.connect(db_path)
+    try:
+        registry_ok = set()
+        n_registry = 0
+        for fp, entry_zst in conn.execute("SELECT fingerprint, entry_json_zst FROM registry"):
+            n_registry += 1
+            try:
+                entry = _from_json_bytes(_zstd_decompress_bytes(entry_zst))
+                expected = _fingerprint_dimension(entry["dimension"], entry.get("index") or [], entry.get("labels"))
+                if expected != fp:
+                    problems.append(f"registry {fp}: the entry hashes to {expected}")
+                    continue
+                registry_ok.add(fp)
+            except Exception as e:
+                problems.append(f"registry {fp}: {e.__class__.__name__}: {e}")
+
+        n_datasets = n_without_dim_map = 0
+        for tid, json_zst, dim_map_json in conn.execute("SELECT table_id, json_zst, dim_map_json FROM datasets"):
+            n_datasets += 1
+            try:
+                ds = _from_json_bytes(_zstd_decompress_bytes(json_zst))
+                dim_map = json.loads(dim_map_json) if dim_map_json else {}
+            except Exception as e:
+                problems.append(f"dataset {tid}: {e.__class__.__name__}: {e}")
+                continue
+            if not dim_map and ds.get("class") == "dataset":
+                n_without_dim_map += 1
+            for dim_name, fp in dim_map.items():
+                if fp not in registry_ok:
+                    problems.append(f"dataset {tid}: the fingerprint {fp} of dimension {dim_name!r} does not resolve")
+            if ds.get("class") == "dataset" and isinstance(ds.get("value"), list):
+                n_values = 1
+                for size in ds.get("size", []):
+                    n_values *= size
+                if len(ds["value"]) != n_values:
+                    problems.append(f"dataset {tid}: {len(ds['value'])} values for a size of {n_values}")
+    finally:
+        conn.close()
+
+    return {
+        "datasets": n_datasets,
+        "registry_entries": n_registry,
+        # datasets stored with their labels inline (not deduplicated in the registry)
+        "datasets_without_dim_map": n_without_dim_map,
+        "problems": len(problems),
+        "first_problems": problems[:max_problems],
+    }
+
+
+# ---------- REWRITE ----------
+
+def rewrite_archive(db_path: str, batch_size: int = 50) -> Dict[str, int]:
+    """
+    Re-compact the datasets stored without a dim map (labels inline), e.g. the JSON-Stat 2.0 datasets written before
+    their top-level "id" was read: their dimensions move to the registry, so they get registry fingerprints (used to
+    align tables, see `src.utils.table_align`). The datasets and timestamps are unchanged when read with labels,
+    except for categories given by their labels only, which get an explicit index.
+
+    Returns:
+        {"datasets": n, "rewritten": n}
+    """
+    archive = JSONStatArchiveDB()
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT table_id, dim_map_json FROM datasets ORDER BY table_id").fetchall()
+    finally:
+        conn.close()
+    table_ids = [tid for tid, dim_map_json in rows if not json.loads(dim_map_json or "{}")]
+
+    rewritten = 0
+    for i in range(0, len(table_ids), batch_size):
+        batch = {}
+        for tid in table_ids[i:i + batch_size]:
+            for _, ds, ts in archive.read(db_path, table_id=tid, with_labels=True):
+                if archive._looks_like_dataset(ds) and (ds.get("id") or ds["dimension"].get("id")):
+                    batch[tid] = {"data": ds, "timestamp": ts}
+        archive.write(db_path, batch)
+        rewritten += len(batch)
+    return {"datasets": len(rows), "rewritten": rewritten}
+
+
+# ---------- BENCHMARK ----------
+
+def _drop_page_cache(db_path: str) -> bool:
+    """
+    Ask the OS to drop the archive file from the page cache (Linux `posix_fadvise`). Returns False where unsupported.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(db_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return True
+    finally:
+        os.close(fd)
+
+
+def run_benchmark(db_path: str, threads: int = 8, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Read the tables one by one (`JSONStatArchiveDB.read(table_id=...)` with labels, the app's read path), cold and warm,
+    single-threaded and with `threads` reader threads.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT table_id, json_zst FROM datasets ORDER BY table_id" + (f" LIMIT {int(limit)}" if limit else "")
+        )
+        # compressed size, and the decompressed (compact JSON) size from the zstd frame header
+        sizes = [(tid, len(blob), zstd.frame_content_size(blob)) for tid, blob in rows]
+    finally:
+        conn.close()
+    table_ids = [tid for tid, _, _ in sizes]
+    compressed_mb = sum(size for _, size, _ in sizes) / 1e6
+    json_mb = sum(max(size, 0) for _, _, size in sizes) / 1e6
+    reader = JSONStatArchiveDB()
+
+    def _read(table_id: str) -> int:
+        return sum(1 for _ in reader.read(db_path, table_id=table_id, with_labels=True))
+
+    results = []
+    for n_threads in (1, threads):
+        for phase in ("cold", "warm"):
+            dropped = _drop_page_cache(db_path) if phase == "cold" else None
+            start = time.perf_counter()
+            if n_threads == 1:
+                n_read = sum(_read(tid) for tid in table_ids)
+            else:
+                with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                    n_read = sum(pool.map(_read, table_ids))
+            elapsed = time.perf_counter() - start
+            results.append({
+                "threads": n_threads,
+                "phase": phase,
+                "page_cache_dropped": dropped,
+                "tables": n_read,
+                "seconds": round(elapsed, 3),
+                "tables_per_s": round(n_read / elapsed, 1),
+                "compressed_mb_per_s": round(compressed_mb / elapsed, 2),
+                "json_mb_per_s": round(json_mb / elapsed, 2),
+            })
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["verify", "rewrite", "bench"])
+    parser.add_argument("db_path", nargs="?", default=None)
+    parser.add_argument("--synthetic", type=int, default=200, help="tables of the synthetic archive (bench without db_path)")
+    parser.add_argument("--categories", type=int, default=30)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=None, help="read only the first N tables")
+    parser.add_argument("--json", dest="json_path", default=None)
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        if not args.db_path:
+            parser.error("verify needs the archive path")
+        report = verify_archive(args.db_path)
+        print(json.dumps(report, indent=2))
+        return 1 if report["problems"] else 0
+
+    if args.command == "rewrite":
+        if not args.db_path:
+            parser.error("rewrite needs the archive path")
+        print(json.dumps(rewrite_archive(args.db_path), indent=2))
+        return 0
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = args.db_path
+        if not db_path:
+            from src.storage.synthetic_archive import write_synthetic_archive
+
+            db_path = os.path.join(folder, "synthetic_archive.sqlite")
+            start = time.perf_counter()
+            write_synthetic_archive(db_path, args.synthetic, args.categories, args.years)
+            print(f"Wrote a synthetic archive of {args.synthetic} tables ({os.path.getsize(db_path) / 1e6:.1f} MB) "
+                  f"in {time.perf_counter() - start:.1f}s")
+        results = run_benchmark(db_path, threads=args.threads, limit=args.limit)
+
+    for row in results:
+        print(json.dumps(row))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import time
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    In-process nearest-neighbour cache keyed by text embeddings.
+
+    Keys are L2-normalised embeddings held in a FAISS inner-product index (one index per namespace), so a lookup
+    is a cosine-similarity search. A lookup hits when the best match clears `threshold`. Entries may declare
+    dependencies (`{table_id: archive_timestamp}`): on lookup, the current timestamps are fetched through
+    `dependency_resolver` and the entry is dropped if any of them changed.
+
+    `embedder` is anything with an `embed_query(text) -> list[float]` method (e.g. a LangChain `Embeddings`).
+    """
+
+    def __init__(
+        self,
+        embedder,
+        threshold: float = 0.92,
+        max_entries: int = 5000,
+        dependency_resolver: Optional[Callable[[List[str]], Dict[str, Optional[str]]]] = None,
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.dependency_resolver = dependency_resolver
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, Any] = {}          # namespace -> faiss.IndexIDMap2
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._next_id = 0
+
+    # ---------- PUBLIC API ----------
+
+    def embed(self, text: str) -> np.ndarray:
+        vec = np.asarray(self.embedder.embed_query(text), dtype="float32").reshape(1, -1)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def lookup(
+        self, text: str, namespace: str = "", vector: Optional[np.ndarray] = None
+    ) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        Find the closest cached entry for the text.
+
+        Args:
+            text: the text to look up (ignored if `vector` is given)
+            namespace: the namespace to search in
+            vector: a pre-computed embedding from `embed`, to avoid embedding the same text twice
+
+        Returns:
+            (payload, similarity) of the best match if it clears the threshold and is still valid, else None.
+        """
+        vec = self.embed(text) if vector is None else vector
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None or index.ntotal == 0:
+                return None
+            scores, ids = index.search(vec, 1)
+            score, entry_id = float(scores[0][0]), int(ids[0][0])
+            if entry_id < 0 or score < self.threshold:
+                return None
+            entry = self._entries[entry_id]
+
+        if not self._is_valid(entry):
+            self._remove(entry_id)
+            return None
+        return entry["payload"], score
+
+    def store(
+        self,
+        text: str,
+        payload: Dict[str, Any],
+        namespace: str = "",
+        dependencies: Optional[Dict[str, Optional[str]]] = None,
+        vector: Optional[np.ndarray] = None,
+    ) -> int:
+        """
+        Add an entry to the cache, evicting the oldest entries above `max_entries`.
+
+        Args:
+            text: the text the payload answers (ignored if `vector` is given)
+            payload: the cached value
+            namespace: the namespace to store in
+            dependencies: {table_id: archive_timestamp} the payload was computed from
+            vector: a pre-computed embedding from `embed`
+
+        Returns:
+            The id of the new entry.
+        """
+        vec = self.embed(text) if vector is None else vector
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                import faiss
+
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(vec.shape[1]))
+                self._indexes[namespace] = index
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(vec, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = {
+                "namespace": namespace,
+                "payload": payload,
+                "dependencies": dict(dependencies or {}),
+                "created_at": time.time(),
+            }
+            # ids grow with insertion order: the smallest ones are the oldest entries
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                for old_id in sorted(self._entries)[:overflow]:
+                    self._remove_locked(old_id)
+        return entry_id
+
+    def invalidate(self, table_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        Drop entries depending on any of the given tables (or all entries).
+
+        Returns:
+            The number of entries dropped.
+        """
+        with self._lock:
+            if table_ids is None:
+                stale = list(self._entries)
+            else:
+                table_ids = set(table_ids)
+                stale = [i for i, e in self._entries.items() if table_ids & set(e["dependencies"])]
+        for entry_id in stale:
+            self._remove(entry_id)
+        return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ---------- INTERNALS ----------
+
+    def _is_valid(self, entry: Dict[str, Any]) -> bool:
+        dependencies = entry["dependencies"]
+        if not dependencies or self.dependency_resolver is None:
+            return True
+        current = self.dependency_resolver(list(dependencies))
+        return all(current.get(table_id) == ts for table_id, ts in dependencies.items())
+
+    def _remove(self, entry_id: int) -> None:
+        with self._lock:
+            self._remove_locked(entry_id)
+
+    def _remove_locked(self, entry_id: int) -> None:
+        # the caller holds `self._lock`
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self._indexes[entry["namespace"]].remove_ids(np.array([entry_id], dtype="int64"))
@@ -0,0 +1,119 @@
+"""
+Synthetic CSO-like JSON-Stat archive (see `JSONStatArchiveDB`) for benchmarks and load-tests without the real dump.
+
+Tables share the Year / County dimensions (deduplicated in the archive registry, as in the real archive) and have a
+table-specific statistic and category dimension. `--categories` and `--years` control the size of each table.
+
+Usage:
+    python -m src.storage.synthetic_archive out.sqlite [--tables 200] [--categories 30] [--years 10] [--seed 0]
+"""
+import sys
+import random
+import argparse
+from typing import Any, Dict, Iterator, Tuple
+
+from src.storage.json_stat_archive_db import JSONStatArchiveDB
+
+
+WORDS = [
+    "population", "dublin", "cork", "rent", "energy", "renewable", "inflation", "price", "county", "sales",
+    "housing", "exports", "employment", "births", "tourism", "transport", "agriculture", "earnings", "health",
+]
+COUNTIES = [
+    "Carlow", "Cavan", "Clare", "Cork", "Donegal", "Dublin", "Galway", "Kerry", "Kildare", "Kilkenny", "Laois",
+    "Leitrim", "Limerick", "Longford", "Louth", "Mayo", "Meath", "Monaghan", "Offaly", "Roscommon", "Sligo",
+    "Tipperary", "Waterford", "Westmeath", "Wexford", "Wicklow",
+]
+SYNTHETIC_TIMESTAMP = "01-01-2025 10:00:00 AM"
+
+
+def synthetic_dataset(table_id: str, rng: random.Random, n_categories: int = 30, n_years: int = 10) -> Dict[str, Any]:
+    """
+    One JSON-Stat 2.0 dataset: STATISTIC x Year x County x a table-specific category dimension.
+    """
+    years = [str(2025 - n_years + i) for i in range(n_years)]
+    topic = rng.choice(WORDS)
+    categories = [f"c{j:03d}" for j in range(n_categories)]
+    dimension = {
+        "STATISTIC": {
+            "label": "Statistic",
+            "category": {
+                "index": ["S1", "S2"],
+                "label": {"S1": f"{topic.title()} Total", "S2": f"{topic.title()} Annual Change"},
+                "unit": {"S1": {"label": "Number"}, "S2": {"label": "%"}},
+            },
+        },
+        "TLIST(A1)": {"label": "Year", "category": {"index": years, "label": {y: y for y in years}}},
+        "C02196V02652": {"label": "County", "category": {"index": COUNTIES, "label": {c: c for c in COUNTIES}}},
+        f"C{table_id}": {
+            "label": rng.choice(WORDS).title(),
+            "category": {"index": categories, "label": {c: " ".join(rng.choices(WORDS, k=3)) for c in categories}},
+        },
+    }
+    ids = list(dimension)
+    size = [len(d["category"]["index"]) for d in dimension.values()]
+    n_values = 1
+    for s in size:
+        n_values *= s
+    return {
+        "version": "2.0",
+        "class": "dataset",
+        "label": " ".join(rng.choices(WORDS, k=5)).title(),
+        "id": ids,
+        "size": size,
+        "dimension": dimension,
+        "role": {"time": ["TLIST(A1)"], "geo": ["C02196V02652"], "metric": ["STATISTIC"]},
+        "value": [round(rng.uniform(0, 100000), 1) for _ in range(n_values)],
+        "extension": {"matrix": table_id, "subject": {"value": topic.title()}, "product": {"value": rng.choice(WORDS).title()}},
+    }
+
+
+def synthetic_tables(n_tables: int, n_categories: int = 30, n_years: int = 10, seed: int = 0) -> Iterator[Tuple[str, Dict]]:
+    """
+    Yields (table_id, {"data": dataset, "timestamp": ...}) for `n_tables` synthetic tables (table-IDs "SYN00000", ...).
+    """
+    rng = random.Random(seed)
+    for i in range(n_tables):
+        table_id = f"SYN{i:05d}"
+        yield table_id, {"data": synthetic_dataset(table_id, rng, n_categories, n_years), "timestamp": SYNTHETIC_TIMESTAMP}
+
+
+def write_synthetic_archive(
+    db_path: str,
+    n_tables: int,
+    n_categories: int = 30,
+    n_years: int = 10,
+    seed: int = 0,
+    compression_level: int = 12,
+    batch_size: int = 50,
+) -> None:
+    """
+    Write a synthetic archive of `n_tables` tables (in batches, so large archives are not held in memory).
+    """
+    archive = JSONStatArchiveDB(compression_level=compression_level)
+    batch = {}
+    for table_id, payload in synthetic_tables(n_tables, n_categories, n_years, seed):
+        batch[table_id] = payload
+        if len(batch) >= batch_size:
+            archive.write(db_path, batch)
+            batch = {}
+    if batch:
+        archive.write(db_path, batch)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_path")
+    parser.add_argument("--tables", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=30)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_synthetic_archive(args.db_path, args.tables, args.categories, args.years, args.seed)
+    print(f"Wrote {args.tables} synthetic tables to {args.db_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
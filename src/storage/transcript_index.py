@@ -0,0 +1,87 @@
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+
+TRANSCRIPT_KEY_PREFIX = "cso:transcript"
+
+
+def transcript_entries(messages: List[BaseMessage]) -> List[Dict[str, Any]]:
+    """
+    The displayed messages of a thread: the user's messages and the non-empty AI answers (no tool-calls / outputs).
+    """
+    entries = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            entries.append({"role": "user", "content": message.content})
+        elif isinstance(message, AIMessage) and message.content:
+            entries.append({"role": "assistant", "content": message.content})
+    return entries
+
+
+class TranscriptIndex:
+    """
+    Lightweight per-thread transcript in a Redis list (one JSON entry per displayed message), so a conversation can
+    be restored page by page without deserializing the graph checkpoint.
+
+    Entries are only appended (or rebuilt with `backfill`), so their positions are stable and a page is addressed by
+    the position of its first entry (`before` of the next, older page).
+    """
+
+    def __init__(self, redis_client, prefix: str = TRANSCRIPT_KEY_PREFIX):
+        """
+        Args:
+            redis_client: An async Redis client (`redis.asyncio.Redis`, or e.g. `fakeredis.aioredis.FakeRedis`).
+            prefix (str): The key prefix of the transcripts.
+        """
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def _key(self, thread_id: str) -> str:
+        return f"{self.prefix}:{thread_id}"
+
+    async def append(self, thread_id: str, entries: List[Dict[str, Any]]) -> None:
+        """
+        Append entries ({"role": "user" | "assistant", "content": str}) to a thread's transcript.
+        """
+        if entries:
+            now = time.time()
+            await self.redis.rpush(self._key(thread_id), *[json.dumps({**e, "ts": now}) for e in entries])
+
+    async def length(self, thread_id: str) -> int:
+        return await self.redis.llen(self._key(thread_id))
+
+    async def page(self, thread_id: str, limit: int, before: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        A page of the transcript, oldest first: the `limit` entries before position `before` (default: the latest).
+
+        Returns:
+            (entries, start): the entries and the position of the first one (0 when there is nothing older).
+        """
+        end = await self.length(thread_id) if before is None else before
+        start = max(0, end - limit)
+        if end <= start:
+            return [], start
+        raw = await self.redis.lrange(self._key(thread_id), start, end - 1)
+        return [json.loads(item) for item in raw], start
+
+    async def backfill(self, thread_id: str, messages: List[BaseMessage]) -> int:
+        """
+        Rebuild a thread's transcript from its graph messages (threads started before the index existed).
+
+        Returns:
+            The number of entries written.
+        """
+        entries = transcript_entries(messages)
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(thread_id))
+            if entries:
+                pipe.rpush(self._key(thread_id), *[json.dumps({**e, "ts": now}) for e in entries])
+            await pipe.execute()
+        return len(entries)
+
+    async def delete(self, thread_id: str) -> None:
+        await self.redis.delete(self._key(thread_id))
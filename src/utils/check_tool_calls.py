@@ -1,4 +1,4 @@
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage
 
 
 def has_tool_calls(msg: AIMessage) -> bool:
@@ -14,3 +14,25 @@ def has_tool_calls(msg: AIMessage) -> bool:
     return getattr(msg, "tool_calls", []) != [] or \
            bool(getattr(msg, "additional_kwargs", {}).get("function_call") or \
                 getattr(msg, "additional_kwargs", {}).get("tool_calls"))
+
+
+def last_turn_tool_call_args(messages: list, tool_name: str) -> list:
+    """
+    Collect the arguments of every call to a tool since the last human message.
+
+    Args:
+        messages (list): The conversation messages.
+        tool_name (str): The name of the tool.
+
+    Returns:
+        list: The argument dicts of the matching tool calls, in order.
+    """
+    args_list = []
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage):
+            break
+        if isinstance(msg, AIMessage):
+            args_list.extend(
+                tool_call.get("args", {}) for tool_call in reversed(msg.tool_calls or []) if tool_call.get("name") == tool_name
+            )
+    return args_list[::-1]
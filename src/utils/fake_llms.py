@@ -0,0 +1,197 @@
+import re
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from pydantic import PrivateAttr
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, messages_from_dict, messages_to_dict
+
+
+# A scripted entry: a response, a callable building it from the prompt messages, or {"response": ..., "latency": s}
+ScriptEntry = Union[AIMessage, Dict[str, Any], Callable[[List[BaseMessage]], Any]]
+
+TABLE_ID_PATTERN = r"\*\*Table ID\*\*: (\S+)"
+
+
+def _prompt_text(messages) -> str:
+    if isinstance(messages, str):
+        return messages
+    if isinstance(messages, BaseMessage):
+        messages = [messages]
+    return "\n".join(m.content if isinstance(m.content, str) else str(m.content) for m in messages)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Offline chat model replaying scripted responses with a simulated latency (benchmarks, load-tests, replays).
+
+    Responses are picked per script key: the first match of `key_pattern` in the prompt (by default the table-ID of
+    the table context), falling back to the "" script. Each key's script is consumed in order and its last entry is
+    repeated once exhausted. `bind_tools` returns the model itself (the script decides on the tool-calls) and
+    `with_structured_output(schema)` returns a runnable building `schema` instances from the scripted dicts.
+
+    Every call is recorded in `calls` (key, kind, number of messages, start / end time).
+    """
+
+    script: Dict[str, List[Any]] = {}
+    structured_script: Dict[str, List[Any]] = {}
+    latency: float = 0.0
+    key_pattern: str = TABLE_ID_PATTERN
+    calls: List[Dict[str, Any]] = []
+
+    _cursors: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    # ---------- SCRIPT ----------
+
+    def _key(self, messages) -> str:
+        match = re.search(self.key_pattern, _prompt_text(messages)) if self.key_pattern else None
+        return match.group(1) if match else ""
+
+    def _next(self, messages, kind: str) -> Dict[str, Any]:
+        script = self.structured_script if kind == "structured" else self.script
+        key = self._key(messages)
+        if key not in script:
+            key = ""
+        entries = script.get(key)
+        if not entries:
+            raise KeyError(f"No scripted {kind} response for key '{key}'")
+        with self._lock:
+            cursor = self._cursors.get(f"{kind}:{key}", 0)
+            self._cursors[f"{kind}:{key}"] = cursor + 1
+        entry = entries[min(cursor, len(entries) - 1)]
+
+        latency = self.latency
+        if isinstance(entry, dict) and "response" in entry:
+            latency = entry.get("latency", latency)
+            entry = entry["response"]
+        response = entry(messages) if callable(entry) else entry
+        return {"key": key, "response": response, "latency": latency}
+
+    def _record(self, key: str, kind: str, messages, start: float) -> None:
+        n_messages = 1 if isinstance(messages, (str, BaseMessage)) else len(messages)
+        with self._lock:
+            self.calls.append({"key": key, "kind": kind, "messages": n_messages, "start": start, "end": time.time()})
+
+    # ---------- CHAT MODEL ----------
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        start = time.time()
+        step = self._next(messages, "chat")
+        time.sleep(step["latency"])
+        self._record(step["key"], "chat", messages, start)
+        return ChatResult(generations=[ChatGeneration(message=step["response"])])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        start = time.time()
+        step = self._next(messages, "chat")
+        await asyncio.sleep(step["latency"])
+        self._record(step["key"], "chat", messages, start)
+        return ChatResult(generations=[ChatGeneration(message=step["response"])])
+
+    def bind_tools(self, tools, **kwargs) -> "ScriptedChatModel":
+        return self
+
+    def with_structured_output(self, schema, **kwargs) -> Runnable:
+        def _build(step):
+            response = step["response"]
+            return response if isinstance(response, schema) else schema(**response)
+
+        def _invoke(messages):
+            start = time.time()
+            step = self._next(messages, "structured")
+            time.sleep(step["latency"])
+            self._record(step["key"], "structured", messages, start)
+            return _build(step)
+
+        async def _ainvoke(messages):
+            start = time.time()
+            step = self._next(messages, "structured")
+            await asyncio.sleep(step["latency"])
+            self._record(step["key"], "structured", messages, start)
+            return _build(step)
+
+        return RunnableLambda(_invoke, afunc=_ainvoke)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._cursors.clear()
+            self.calls.clear()
+
+
+class RecordingRunnable:
+    """
+    Wraps a live runnable (e.g. a Gemini client with bound tools) and records its responses per script key, so a
+    session can be replayed offline (see `scripted_from_recording`).
+    """
+
+    def __init__(self, inner, key_pattern: str = TABLE_ID_PATTERN, records: Optional[Dict[str, List[Dict]]] = None):
+        self.inner = inner
+        self.key_pattern = key_pattern
+        # shared with the runnables derived through `bind_tools` / `with_structured_output`
+        self.records: Dict[str, List[Dict[str, Any]]] = {} if records is None else records
+        self._lock = threading.Lock()
+
+    def _key(self, messages) -> str:
+        match = re.search(self.key_pattern, _prompt_text(messages))
+        return match.group(1) if match else ""
+
+    def _store(self, messages, response, latency: float) -> None:
+        if isinstance(response, BaseMessage):
+            payload = {"message": messages_to_dict([response])[0]}
+        else:
+            payload = {"structured": response.model_dump() if hasattr(response, "model_dump") else response}
+        with self._lock:
+            self.records.setdefault(self._key(messages), []).append({**payload, "latency": round(latency, 4)})
+
+    def bind_tools(self, *args, **kwargs) -> "RecordingRunnable":
+        return RecordingRunnable(self.inner.bind_tools(*args, **kwargs), self.key_pattern, self.records)
+
+    def with_structured_output(self, *args, **kwargs) -> "RecordingRunnable":
+        return RecordingRunnable(self.inner.with_structured_output(*args, **kwargs), self.key_pattern, self.records)
+
+    def invoke(self, messages, config=None, **kwargs):
+        start = time.perf_counter()
+        response = self.inner.invoke(messages, config=config, **kwargs)
+        self._store(messages, response, time.perf_counter() - start)
+        return response
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        start = time.perf_counter()
+        response = await self.inner.ainvoke(messages, config=config, **kwargs)
+        self._store(messages, response, time.perf_counter() - start)
+        return response
+
+    async def abatch(self, inputs, config=None, **kwargs):
+        max_concurrency = (config or {}).get("max_concurrency") or len(inputs) or 1
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _one(messages):
+            async with semaphore:
+                return await self.ainvoke(messages)
+
+        return await asyncio.gather(*(_one(messages) for messages in inputs))
+
+
+def scripted_from_recording(records: Dict[str, List[Dict[str, Any]]], latency: Optional[float] = None) -> Dict[str, List]:
+    """
+    Convert the records of a `RecordingRunnable` into a `ScriptedChatModel` script (recorded latencies, unless given).
+    """
+    script = {}
+    for key, entries in records.items():
+        script[key] = [
+            {
+                "response": messages_from_dict([entry["message"]])[0] if "message" in entry else entry["structured"],
+                "latency": entry["latency"] if latency is None else latency,
+            }
+            for entry in entries
+        ]
+    return script
@@ -0,0 +1,91 @@
+"""
+Cold-start import-time benchmark, based on `python -X importtime`.
+
+Usage:
+    python -m src.utils.import_time [modules ...] [--top 15] [--json out.json] [--max-ms 1500]
+
+Each module is imported in a fresh interpreter; the cumulative import time of the module and the slowest
+sub-imports are reported. With `--max-ms`, the exit code is 1 when any module exceeds the budget (for CI).
+"""
+import sys
+import json
+import argparse
+import subprocess
+from typing import Dict, List
+
+
+DEFAULT_MODULES = [
+    "src.graphs.reviewer_graph",
+    "src.graphs.tools.reviewer_tools",
+    "src.retrieval.hybrid_retrieval",
+]
+
+
+def measure_import_time(module: str) -> Dict:
+    """
+    Import a module in a fresh interpreter with `-X importtime` and parse the report.
+
+    Args:
+        module (str): The dotted module name.
+
+    Returns:
+        Dict: {"module", "total_ms", "imports": [{"module", "self_ms", "cumulative_ms"}, ...]} or an "error".
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    imports: List[Dict] = []
+    for line in proc.stderr.splitlines():
+        # format: "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            imports.append({
+                "module": name.strip(),
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            })
+        except ValueError:
+            continue
+
+    result = {"module": module, "imports": imports}
+    target = [entry for entry in imports if entry["module"] == module]
+    result["total_ms"] = target[-1]["cumulative_ms"] if target else None
+    if proc.returncode != 0:
+        result["error"] = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=15, help="number of slowest sub-imports to show")
+    parser.add_argument("--json", dest="json_path", default=None, help="write the full results to this file")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if any module import exceeds this")
+    args = parser.parse_args()
+
+    results = [measure_import_time(module) for module in args.modules]
+    failed = False
+    for result in results:
+        total = result["total_ms"]
+        print(f"\n{result['module']}: {'n/a' if total is None else f'{total:.1f} ms'}")
+        if "error" in result:
+            print(f"  ERROR: {result['error']}")
+            failed = True
+        for entry in sorted(result["imports"], key=lambda e: e["self_ms"], reverse=True)[:args.top]:
+            print(f"  {entry['self_ms']:9.1f} ms self {entry['cumulative_ms']:9.1f} ms cumulative  {entry['module']}")
+        if args.max_ms is not None and total is not None and total > args.max_ms:
+            print(f"  OVER BUDGET: {total:.1f} ms > {args.max_ms:.1f} ms")
+            failed = True
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
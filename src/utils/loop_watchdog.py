@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+# Event-loop watchdog: lag histogram and the stack of the code blocking the loop for longer than the threshold.
+LOOP_WATCHDOG_ENABLED = os.environ.get("LOOP_WATCHDOG_ENABLED", "false").lower() == "true"
+LOOP_WATCHDOG_INTERVAL_MS = float(os.environ.get("LOOP_WATCHDOG_INTERVAL_MS", "100"))
+LOOP_WATCHDOG_THRESHOLD_MS = float(os.environ.get("LOOP_WATCHDOG_THRESHOLD_MS", "250"))
+
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LoopWatchdog:
+    """
+    Measures the lag of an asyncio event loop and reports what blocks it.
+
+    A heartbeat scheduled on the loop every `interval_ms` records how late it runs (the loop lag) into a histogram.
+    A monitor thread checks the heartbeat: when it is overdue by more than `threshold_ms`, the stack of the loop thread
+    (`sys._current_frames`) is recorded and printed once per stall. A stall is "blocked" when the loop thread is
+    running a callback (the stack shows it), "starved" when it is idle in the selector but cannot get the GIL back
+    from other threads.
+    """
+
+    def __init__(
+        self,
+        interval_ms: float = LOOP_WATCHDOG_INTERVAL_MS,
+        threshold_ms: float = LOOP_WATCHDOG_THRESHOLD_MS,
+        max_stalls: int = 20,
+        print_stalls: bool = True,
+    ):
+        """
+        Args:
+            interval_ms (float): Milliseconds between two heartbeats.
+            threshold_ms (float): A heartbeat overdue by more than this is a stall (its stack is captured).
+            max_stalls (int): The number of recent stalls kept (with their stacks).
+            print_stalls (bool): Print a warning with the stack of each stall.
+        """
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.print_stalls = print_stalls
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._expected = 0.0          # when the next heartbeat should run (monotonic)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+        self._handle = None
+        self._current_stall: Optional[Dict[str, Any]] = None
+
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.lags_ms: deque = deque(maxlen=10000)
+        self.max_lag_ms = 0.0
+        self.stall_count = 0
+        self.stalls: deque = deque(maxlen=max_stalls)
+
+    # ---------- LIFECYCLE ----------
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """
+        Start watching the loop (the running loop by default); call from the loop's thread.
+        """
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._expected = time.monotonic() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        self._monitor = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._monitor.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+        if self._monitor is not None:
+            self._monitor.join()
+
+    # ---------- HEARTBEAT (loop thread) ----------
+
+    def _beat(self) -> None:
+        now = time.monotonic()
+        lag_ms = max(0.0, (now - self._expected) * 1000)
+        with self._lock:
+            self._record_lag(lag_ms)
+            stall, self._current_stall = self._current_stall, None
+            if stall is not None:
+                stall["duration_ms"] = round(lag_ms, 1)
+            self._expected = now + self.interval
+        if stall is not None and self.print_stalls:
+            if stall["kind"] == "blocked":
+                print(f"Warning: event loop blocked for {stall['duration_ms']} ms in:\n{''.join(stall['stack'])}")
+            else:
+                print(f"Warning: event loop starved for {stall['duration_ms']} ms (the GIL was held by other threads)")
+        if not self._stop.is_set():
+            self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _record_lag(self, lag_ms: float) -> None:
+        self.lags_ms.append(lag_ms)
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.histogram[i] += 1
+                return
+        self.histogram[-1] += 1
+
+    # ---------- MONITOR (watchdog thread) ----------
+
+    def _loop_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        return traceback.format_stack(frame) if frame is not None else []
+
+    def _watch(self) -> None:
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            with self._lock:
+                overdue = time.monotonic() - self._expected
+                stall = self._current_stall
+                if overdue <= self.threshold or (stall is not None and stall["kind"] == "blocked"):
+                    continue
+                stack = self._loop_stack()
+                # a loop thread waiting in the selector is not blocked by a callback: it is ready but other threads
+                # hold the GIL (CPU-bound work in `to_thread` / executor threads)
+                kind = "starved" if stack and "selectors.py" in stack[-1] else "blocked"
+                if stall is None:
+                    self._current_stall = {"at": time.time(), "duration_ms": None, "kind": kind, "stack": stack}
+                    self.stall_count += 1
+                    self.stalls.append(self._current_stall)
+                elif kind == "blocked":
+                    # resampled while the stall lasts: keep the stack of the blocking callback once it shows
+                    stall.update(kind=kind, stack=stack)
+
+    # ---------- INFO ----------
+
+    def info(self, stacks: bool = True) -> Dict[str, Any]:
+        """
+        Lag histogram (count per upper bound in ms), lag percentiles over the recent heartbeats and recent stalls.
+        """
+        with self._lock:
+            lags = list(self.lags_ms)
+            histogram = {f"le_{bound}": n for bound, n in zip(LAG_BUCKETS_MS, self.histogram)}
+            histogram["le_inf"] = self.histogram[-1]
+            stalls = [
+                {**s, "stack": s["stack"] if stacks else s["stack"][-1:]} for s in self.stalls
+            ]
+            return {
+                "interval_ms": self.interval * 1000,
+                "threshold_ms": self.threshold * 1000,
+                "heartbeats": sum(self.histogram),
+                "lag_histogram_ms": histogram,
+                "lag_p50_ms": round(float(np.percentile(lags, 50)), 3) if lags else None,
+                "lag_p99_ms": round(float(np.percentile(lags, 99)), 3) if lags else None,
+                "lag_max_ms": round(self.max_lag_ms, 3),
+                "stalls": self.stall_count,
+                "blocked_stalls": sum(1 for s in self.stalls if s["kind"] == "blocked"),
+                "recent_stalls": stalls,
+            }
+
+
+def stall_sites(stalls: List[Dict[str, Any]], depth: int = 2) -> Dict[str, int]:
+    """
+    Count stalls per site: the innermost `depth` frames of each blocked stall's stack (starved stalls are counted
+    together, their stack is the idle selector).
+    """
+    sites: Dict[str, int] = {}
+    for stall in stalls:
+        if stall.get("kind") == "starved":
+            site = "<starved: GIL held by other threads>"
+        else:
+            frames = [line.strip().split("\n")[0].replace("File ", "") for line in stall["stack"][-depth:]]
+            site = " <- ".join(reversed(frames)) or "?"
+        sites[site] = sites.get(site, 0) + 1
+    return dict(sorted(sites.items(), key=lambda kv: -kv[1]))
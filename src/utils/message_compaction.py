@@ -0,0 +1,229 @@
+from typing import List, Sequence
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+
+# Rough chars-per-token ratio for Gemini models on English / tabular text.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(content) -> int:
+    """
+    Cheap token estimate for a string, a message or a list of messages.
+
+    Args:
+        content: A string, a `BaseMessage`, or a list of either.
+
+    Returns:
+        int: The approximate number of tokens.
+    """
+    if isinstance(content, str):
+        return (len(content) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    if isinstance(content, BaseMessage):
+        tokens = estimate_tokens(content.content if isinstance(content.content, str) else str(content.content))
+        for tool_call in getattr(content, "tool_calls", None) or []:
+            tokens += estimate_tokens(str(tool_call.get("args", {})))
+        return tokens
+    if isinstance(content, (list, tuple)):
+        return sum(estimate_tokens(item) for item in content)
+    return estimate_tokens(str(content))
+
+
+def truncate_text(text: str, max_chars: int, marker: str = "... [{omitted} characters truncated] ...") -> str:
+    """
+    Keep the head and tail of a long text, dropping the middle.
+
+    Args:
+        text (str): The text to truncate.
+        max_chars (int): The maximum number of characters to keep (head + tail).
+        marker (str): The note inserted in place of the dropped characters.
+
+    Returns:
+        str: The text itself if short enough, otherwise `head + marker + tail`.
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n{marker.format(omitted=omitted)}\n{text[-tail:] if tail else ''}"
+
+
+def summarize_tool_output(text: str, description: str = "", max_chars: int = 200) -> str:
+    """
+    Collapse a tool output into a single bullet line.
+
+    Args:
+        text (str): The tool output.
+        description (str): The description of the task that produced the output.
+        max_chars (int): The maximum number of output characters to keep.
+
+    Returns:
+        str: A one-line bullet summary of the output.
+    """
+    flat = " | ".join(line.strip() for line in text.splitlines() if line.strip())
+    if len(flat) > max_chars:
+        flat = flat[:max_chars].rstrip() + " ..."
+    prefix = f"- [summarized] {description}: " if description else "- [summarized] "
+    return prefix + (flat or "(no output)")
+
+
+def _elide_code(code: str, keep_lines: int = 3) -> str:
+    lines = code.splitlines()
+    if len(lines) <= keep_lines:
+        return code
+    return "\n".join(lines[:keep_lines] + [f"# ... ({len(lines) - keep_lines} lines elided)"])
+
+
+def compact_tool_history(
+    messages: Sequence[BaseMessage],
+    keep_last: int = 2,
+    max_tool_chars: int = 4000,
+    summary_chars: int = 200,
+) -> List[BaseMessage]:
+    """
+    Compact the tool-calling history of an agent loop.
+
+    The last `keep_last` tool outputs are kept (truncated to `max_tool_chars`), older ones are collapsed into
+    one-line bullet summaries and the code of their tool-calls is elided. Tool-call / tool-response pairs are
+    preserved so that the history stays valid for the model provider. The input messages are not modified.
+
+    Args:
+        messages (Sequence[BaseMessage]): The message history (AI tool-calls and tool responses).
+        keep_last (int): The number of most recent tool outputs to keep verbatim.
+        max_tool_chars (int): The maximum size of a kept tool output.
+        summary_chars (int): The maximum size of a summarized tool output.
+
+    Returns:
+        List[BaseMessage]: The compacted message history.
+    """
+    tool_positions = [i for i, msg in enumerate(messages) if isinstance(msg, ToolMessage)]
+    recent = set(tool_positions[-keep_last:]) if keep_last > 0 else set()
+    first_recent = min(recent) if recent else len(messages)
+
+    descriptions = {}
+    for msg in messages:
+        for tool_call in getattr(msg, "tool_calls", None) or []:
+            descriptions[tool_call.get("id")] = tool_call.get("args", {}).get("description", "")
+
+    compacted = []
+    for i, msg in enumerate(messages):
+        if isinstance(msg, ToolMessage):
+            content = msg.content if isinstance(msg.content, str) else str(msg.content)
+            if i in recent:
+                new_content = truncate_text(content, max_tool_chars)
+            else:
+                new_content = summarize_tool_output(content, descriptions.get(msg.tool_call_id, ""), summary_chars)
+            compacted.append(msg.model_copy(update={"content": new_content}) if new_content != content else msg)
+        elif isinstance(msg, AIMessage) and msg.tool_calls and i < first_recent:
+            tool_calls = [
+                {**tool_call, "args": {**tool_call["args"], "code": _elide_code(tool_call["args"]["code"])}}
+                if isinstance(tool_call.get("args", {}).get("code"), str) else tool_call
+                for tool_call in msg.tool_calls
+            ]
+            compacted.append(msg.model_copy(update={"tool_calls": tool_calls}))
+        else:
+            compacted.append(msg)
+    return compacted
+
+
+def _split_turns(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    turns = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(msg)
+    return turns
+
+
+def _key_lines(text: str, max_lines: int = 3, max_chars: int = 160) -> List[str]:
+    # lines carrying numbers are the ones worth keeping from an analysis
+    lines = [line.strip(" -*#|") for line in text.splitlines() if any(ch.isdigit() for ch in line)]
+    lines = list(dict.fromkeys(line.strip() for line in lines if line.strip()))
+    return [line if len(line) <= max_chars else line[:max_chars].rstrip() + " ..." for line in lines[:max_lines]]
+
+
+def _condense_turn(turn: List[BaseMessage], answer_chars: int) -> tuple:
+    """Returns (condensed messages, table-ids referenced in the turn)."""
+    question = turn[0] if isinstance(turn[0], HumanMessage) else None
+    table_ids = []
+    key_figures = []
+    answer = ""
+
+    for msg in turn:
+        if isinstance(msg, AIMessage):
+            for tool_call in msg.tool_calls or []:
+                if tool_call.get("name") == "data_analyst_tool":
+                    table_ids.extend(t for t in tool_call.get("args", {}).get("table_ids", []) if t not in table_ids)
+            if not msg.tool_calls and msg.content:
+                answer = msg.content if isinstance(msg.content, str) else str(msg.content)
+        elif isinstance(msg, ToolMessage) and msg.name == "data_analyst_tool":
+            content = msg.content if isinstance(msg.content, str) else str(msg.content)
+            for section in content.split("### Analysis for Table ID:")[1:]:
+                table_id, _, body = section.partition("\n")
+                key_figures.extend(f"{table_id.strip()}: {line}" for line in _key_lines(body))
+
+    summary_list = ["[Earlier turn, condensed]"]
+    if table_ids:
+        summary_list.append(
+            f"Tables analysed: {', '.join(table_ids)} (full analysis reports available via `provenance_tool`)."
+        )
+    if key_figures:
+        summary_list.append("Key figures:\n" + "\n".join(f"- {line}" for line in key_figures))
+    if answer:
+        summary_list.append("Answer given:\n" + truncate_text(answer, answer_chars))
+
+    condensed = [question] if question is not None else []
+    condensed.append(AIMessage(content="\n".join(summary_list), name="reviewer_agent"))
+    return condensed, table_ids
+
+
+def condense_conversation(
+    messages: Sequence[BaseMessage],
+    keep_turns: int = 1,
+    max_condensed_turns: int = 4,
+    answer_chars: int = 800,
+) -> List[BaseMessage]:
+    """
+    Rolling-summary view of a multi-turn conversation, for sending to the reviewer LLM.
+
+    The last `keep_turns` turns (a turn starts at a `HumanMessage`) are kept verbatim. The `max_condensed_turns`
+    turns before them are condensed into a question + short answer pair, with their tool-calls / tool-outputs
+    replaced by the analysed table-IDs, a few key figures and a pointer to `provenance_tool`. Anything older is
+    folded into a single summary of the past questions and table-IDs, so the payload stays bounded.
+
+    Args:
+        messages (Sequence[BaseMessage]): The full conversation (without the system prompt).
+        keep_turns (int): The number of most recent turns to keep verbatim.
+        max_condensed_turns (int): The number of older turns to keep in condensed form.
+        answer_chars (int): The maximum size of a condensed answer.
+
+    Returns:
+        List[BaseMessage]: The compacted conversation.
+    """
+    turns = _split_turns(messages)
+    if len(turns) <= keep_turns:
+        return list(messages)
+
+    recent = turns[-keep_turns:] if keep_turns > 0 else []
+    older = turns[:len(turns) - len(recent)]
+    condensed_turns = older[-max_condensed_turns:] if max_condensed_turns > 0 else []
+    folded_turns = older[:len(older) - len(condensed_turns)]
+
+    compacted = []
+    if folded_turns:
+        questions, table_ids = [], []
+        for turn in folded_turns:
+            if isinstance(turn[0], HumanMessage):
+                questions.append(truncate_text(str(turn[0].content), 200))
+            table_ids.extend(t for t in _condense_turn(turn, answer_chars)[1] if t not in table_ids)
+        summary_list = [f"# SUMMARY OF {len(folded_turns)} EARLIER TURNS:"]
+        summary_list.extend(f"- Q: {question}" for question in questions[-10:])
+        if table_ids:
+            summary_list.append(f"- Tables analysed: {', '.join(table_ids[-30:])}")
+        compacted.append(SystemMessage(content="\n".join(summary_list), name="reviewer_agent"))
+
+    for turn in condensed_turns:
+        compacted.extend(_condense_turn(turn, answer_chars)[0])
+    for turn in recent:
+        compacted.extend(turn)
+    return compacted
@@ -1,25 +1,203 @@
 import io
+import os
 import sys
+import time
+import uuid
+import threading
+import contextvars
 import traceback
-from typing import Dict, Any
+from collections import deque
+from typing import Dict, Any, Optional
 
 
-def run_python_safely(code: str) -> Dict[str, Any]:
+# The output returned to the agent is capped: past EXEC_MAX_OUTPUT_CHARS only the head and the tail are kept (in
+# memory), and the full output is streamed to a spill file under EXEC_SPILL_DIR.
+EXEC_MAX_OUTPUT_CHARS = int(os.environ.get("EXEC_MAX_OUTPUT_CHARS", "20000"))
+EXEC_SPILL_DIR = os.environ.get("EXEC_SPILL_DIR", "cache/exec_output/")
+# Spill files are pruned when a new one is created: older than EXEC_SPILL_MAX_AGE seconds, then the oldest ones until
+# the directory is under EXEC_SPILL_MAX_MB.
+EXEC_SPILL_MAX_AGE = float(os.environ.get("EXEC_SPILL_MAX_AGE", str(24 * 3600)))
+EXEC_SPILL_MAX_MB = float(os.environ.get("EXEC_SPILL_MAX_MB", "500"))
+
+
+# The output of the code being run (in this thread / task), see `_CaptureProxy`.
+_capture: contextvars.ContextVar = contextvars.ContextVar("python_runner_capture", default=None)
+_install_lock = threading.Lock()
+
+
+class _CaptureProxy:
+    """
+    Stands in for sys.stdout / sys.stderr: writes go to the capture of the current thread (context) if any, else to
+    the original stream. Installed once, so concurrent executions (one per analysed table) each capture their own
+    output without redirecting the process-wide streams.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def _target(self):
+        capture = _capture.get()
+        return capture if capture is not None else self._stream
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def writelines(self, lines) -> None:
+        self._target().writelines(lines)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self._target(), name)
+
+
+def _install_capture_proxy() -> None:
+    with _install_lock:
+        if not isinstance(sys.stdout, _CaptureProxy):
+            sys.stdout = _CaptureProxy(sys.stdout)
+        if not isinstance(sys.stderr, _CaptureProxy):
+            sys.stderr = _CaptureProxy(sys.stderr)
+
+
+def prune_spill_dir(spill_dir: str = EXEC_SPILL_DIR, max_age: float = EXEC_SPILL_MAX_AGE, max_mb: float = EXEC_SPILL_MAX_MB) -> int:
+    """
+    Delete the spill files older than `max_age` seconds, then the oldest ones until the directory holds at most
+    `max_mb` MB.
+
+    Returns:
+        The number of files deleted.
+    """
+    files = []
+    try:
+        with os.scandir(spill_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".txt"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return 0
+    files.sort()
+    now = time.time()
+    total = sum(size for _, size, _ in files)
+    deleted = 0
+    for mtime, size, path in files:
+        if now - mtime <= max_age and total <= max_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass  # pruned concurrently
+        total -= size
+    return deleted
+
+
+class CappedOutput(io.TextIOBase):
+    """
+    A text stream keeping at most `max_chars` characters in memory: the first half as written, then a rolling tail.
+    Once the cap is exceeded, everything written (from the start) also goes to a spill file.
+    """
+
+    def __init__(self, max_chars: int = EXEC_MAX_OUTPUT_CHARS, spill_dir: str = EXEC_SPILL_DIR):
+        self.max_chars = max_chars
+        self.spill_dir = spill_dir
+        self.spill_path: Optional[str] = None
+        self.total_chars = 0
+        self._head = io.StringIO()
+        self._head_chars = 0
+        self._tail: deque = deque()
+        self._tail_chars = 0
+        self._spill = None
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        n = len(text)
+        self.total_chars += n
+        if self._spill is None and self.total_chars > self.max_chars:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            prune_spill_dir(self.spill_dir)
+            self.spill_path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.txt")
+            self._spill = open(self.spill_path, "w", encoding="utf-8")
+            self._spill.write(self._head.getvalue())
+            self._spill.writelines(self._tail)
+        if self._spill is not None:
+            self._spill.write(text)
+
+        room = self.max_chars // 2 - self._head_chars
+        if room > 0:
+            self._head.write(text[:room])
+            self._head_chars += min(room, n)
+            text = text[room:]
+        if text:
+            self._tail.append(text[-self.max_chars // 2:])
+            self._tail_chars += len(self._tail[-1])
+            while self._tail_chars - len(self._tail[0]) >= self.max_chars // 2:
+                self._tail_chars -= len(self._tail.popleft())
+        return n
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_chars > self.max_chars
+
+    def getvalue(self) -> str:
+        tail = "".join(self._tail)
+        if not self.truncated:
+            return self._head.getvalue() + tail
+        tail = tail[-(self.max_chars // 2):]
+        omitted = self.total_chars - self._head_chars - len(tail)
+        return (
+            f"{self._head.getvalue()}\n... [{omitted} characters omitted] ...\n{tail}\n"
+            f"Warning: the output was {self.total_chars} characters, only its head and tail are shown. Do not print "
+            f"whole tables: print aggregates, `df.head()` or filtered rows."
+        )
+
+    def close(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
+        super().close()
+
+
+def preloaded_globals() -> Dict[str, Any]:
+    """
+    Helpers available to the executed code without an import (e.g. `sql(...)`, see `src.utils.sql_engine`, and
+    `align_tables(...)`, see `src.utils.table_align`).
+    """
+    from src.utils.sql_engine import SQL_ENGINE_ENABLED, sql
+    from src.utils.table_align import ALIGN_TABLES_ENABLED, align_tables
+
+    helpers = {}
+    if SQL_ENGINE_ENABLED:
+        helpers["sql"] = sql
+    if ALIGN_TABLES_ENABLED:
+        helpers["align_tables"] = align_tables
+    return helpers
+
+
+def run_python_safely(code: str, extra_globals: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Minimal sandbox runner. In production: isolate with subprocess, container, time & mem limits.
+    `extra_globals` are made available to the code next to the preloaded helpers (e.g. the table as `df`).
+    The captured output is capped (see `CappedOutput`); when it was truncated, "output_path" is the spill file.
     Returns {"stdout": str, "error": {"type":, "message":, "trace":}} on failure.
     """
-    stdout_capture = io.StringIO()
-    old_stdout, old_stderr = sys.stdout, sys.stderr
-    sys.stdout = stdout_capture
-    sys.stderr = stdout_capture  # co-mingle
-    globals_dict = {"__name__": "__main__"}
+    _install_capture_proxy()
+    stdout_capture = CappedOutput()
+    token = _capture.set(stdout_capture)  # stdout and stderr co-mingle
+    globals_dict = {"__name__": "__main__", **preloaded_globals(), **(extra_globals or {})}
     try:
         exec(code, globals_dict, globals_dict)
-        out = stdout_capture.getvalue()
-        return {"stdout": out}
+        result = {"stdout": stdout_capture.getvalue()}
     except Exception as e:
         err = {"type": e.__class__.__name__, "message": str(e), "trace": traceback.format_exc()}
-        return {"stdout": stdout_capture.getvalue(), "error": err}
+        result = {"stdout": stdout_capture.getvalue(), "error": err}
     finally:
-        sys.stdout, sys.stderr = old_stdout, old_stderr
\ No newline at end of file
+        _capture.reset(token)
+        stdout_capture.close()
+    if stdout_capture.truncated:
+        # the spill file is a server path: it stays out of the output (shown to the agent and in the provenance)
+        result["output_path"] = stdout_capture.spill_path
+        print(f"Execution output truncated ({stdout_capture.total_chars} characters), full output in {stdout_capture.spill_path}")
+    return result
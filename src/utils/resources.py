@@ -0,0 +1,182 @@
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+_lock = threading.RLock()
+_resources: Dict[str, Any] = {}
+
+
+def get_resource(name: str, factory: Callable[[], Any]) -> Any:
+    """
+    Return the process-wide instance of a resource, creating it on first use.
+
+    Creation is thread-safe (double-checked locking): concurrent first callers wait for a single `factory()` call.
+
+    Args:
+        name (str): The resource name.
+        factory (Callable[[], Any]): Builds the resource.
+
+    Returns:
+        Any: The shared resource.
+    """
+    try:
+        return _resources[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _resources:
+            _resources[name] = factory()
+        return _resources[name]
+
+
+def set_resource(name: str, value: Any) -> None:
+    """
+    Install (or override) a resource, e.g. a fake LLM or a stub retriever in tests and load-tests.
+
+    Args:
+        name (str): The resource name.
+        value (Any): The resource instance.
+    """
+    with _lock:
+        _resources[name] = value
+
+
+def reset_resource(name: Optional[str] = None) -> None:
+    """
+    Drop a resource (or all resources) so that it is re-created on next use.
+
+    Args:
+        name (Optional[str]): The resource name, or None for all resources.
+    """
+    with _lock:
+        if name is None:
+            _resources.clear()
+        else:
+            _resources.pop(name, None)
+
+
+# ---------- PROVIDERS ----------
+
+def llm_resource_name(model: str = "gemini-2.5-flash", **kwargs) -> str:
+    """
+    The resource name of a shared chat-model client (e.g. to install a fake LLM with `set_resource`).
+    """
+    return f"llm:{model}:" + ",".join(f"{k}={v}" for k, v in sorted(kwargs.items()))
+
+
+def get_shared_llm(model: str = "gemini-2.5-flash", **kwargs) -> Any:
+    """
+    Shared chat-model client for the given model and settings (see `src.graphs.llms.gemini.get_llm`).
+    """
+    def _factory():
+        from src.graphs.llms.gemini import get_llm
+        return get_llm(model=model, **kwargs)
+
+    return get_resource(llm_resource_name(model, **kwargs), _factory)
+
+
+def get_embeddings() -> Any:
+    """
+    Shared `gemini-embedding-001` client (3072-dim, semantic-similarity task), as used to build the FAISS index.
+    """
+    def _factory():
+        from google.genai import types
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(
+            model="gemini-embedding-001",
+            task_type="semantic_similarity",
+            config=types.EmbedContentConfig(
+                output_dimensionality=3072,
+                task_type="SEMANTIC_SIMILARITY",
+            )
+        )
+
+    return get_resource("embeddings", _factory)
+
+
+def get_retriever() -> Any:
+    """
+    Shared retriever: a `RetrievalSnapshotManager` serving `HybridRetrieval` snapshots of the published artifacts
+    (loaded on first search, hot-reloaded when a new version / delta is published).
+
+    Configured with RETRIEVAL_ARTIFACTS_ROOT (versioned artifacts, default "artifacts/index"),
+    RETRIEVAL_FALLBACK_DIR (used while nothing is published, default "artifacts") and
+    RETRIEVAL_RELOAD_INTERVAL (seconds between checks, 0 disables hot-reload, default 30).
+    STAGE_2_VARIANT serves a reduced-size stage-2 index (see `src.retrieval.compressed_index`), re-ranked on the
+    exact vectors unless STAGE_2_RERANK_K is 0 (then the exact vectors are never mapped).
+    """
+    def _factory():
+        from src.retrieval.hybrid_retrieval import HybridRetrieval
+        from src.retrieval.snapshot import RetrievalSnapshotManager
+        from src.retrieval.index_builder import PRODUCTION_EMBEDDER, PRODUCTION_EMBEDDING_DIM
+
+        stage_2_variant = os.environ.get("STAGE_2_VARIANT") or None
+        rerank_k = int(os.environ["STAGE_2_RERANK_K"]) if os.environ.get("STAGE_2_RERANK_K") else None
+        manager = RetrievalSnapshotManager(
+            factory=lambda artifacts_dir: HybridRetrieval(
+                top_k_stage_1=200,
+                top_k_stage_2=20,
+                artifacts_dir=artifacts_dir,
+                stage_2_variant=stage_2_variant,
+                rerank_k=rerank_k,
+            ),
+            artifacts_root=os.environ.get("RETRIEVAL_ARTIFACTS_ROOT", "artifacts/index"),
+            fallback_dir=os.environ.get("RETRIEVAL_FALLBACK_DIR", "artifacts"),
+            poll_interval=float(os.environ.get("RETRIEVAL_RELOAD_INTERVAL", "30")),
+            # the queries are embedded with `get_embeddings()`
+            embedder=PRODUCTION_EMBEDDER,
+            dim=PRODUCTION_EMBEDDING_DIM,
+        )
+        manager.start()
+        return manager
+
+    return get_resource("retriever", _factory)
+
+
+def get_archive_reader() -> Any:
+    """
+    Shared `JSONStatArchiveDB` reader for the CSO archive.
+    """
+    def _factory():
+        from src.storage.json_stat_archive_db import JSONStatArchiveDB
+        return JSONStatArchiveDB(compression_level=12)
+
+    return get_resource("archive_reader", _factory)
+
+
+def get_shared_frames() -> Any:
+    """
+    Shared `FrameCache`: prepared tables handed to the (in-process) code executor without a CSV parse.
+    """
+    def _factory():
+        from src.utils.shared_frames import FrameCache
+        return FrameCache()
+
+    return get_resource("shared_frames", _factory)
+
+
+def get_blob_store() -> Any:
+    """
+    Shared content-addressed `BlobStore` for the large graph-state fields (reports, table contexts).
+
+    Configured with BLOB_STORE_BACKEND ("redis", default: the REDIS_URL instance of the checkpointer, so the references
+    in the checkpoints resolve on every host; or "sqlite": a local file for single-host / offline runs) and
+    BLOB_STORE_PATH (the SQLite file, default "cache/blob_store.sqlite").
+    """
+    def _factory():
+        from src.storage.blob_store import BLOB_STORE_PATH, RedisBlobStore, SQLiteBlobStore
+        if os.environ.get("BLOB_STORE_BACKEND", "redis").lower() == "sqlite":
+            return SQLiteBlobStore(os.environ.get("BLOB_STORE_PATH", BLOB_STORE_PATH))
+        return RedisBlobStore(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+
+    return get_resource("blob_store", _factory)
+
+
+def warm_up() -> None:
+    """
+    Eagerly create the heavy resources, e.g. from a background thread once the worker is serving.
+    """
+    get_archive_reader()
+    get_shared_llm(model="gemini-2.5-flash")
+    get_retriever().reload()
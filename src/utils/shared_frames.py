@@ -0,0 +1,98 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+
+
+# Prepared tables are kept in memory for the code executor, up to SHARED_FRAMES_MAX_MB in total.
+SHARED_FRAMES_ENABLED = os.environ.get("SHARED_FRAMES_ENABLED", "true").lower() == "true"
+SHARED_FRAMES_MAX_MB = int(os.environ.get("SHARED_FRAMES_MAX_MB", "1024"))
+
+
+class _CachedFrame:
+    def __init__(self, frame: pd.DataFrame, size: int, version: Any):
+        self.frame = frame
+        self.size = size
+        self.version = version
+
+
+class FrameCache:
+    """
+    Prepared tables kept as DataFrames in this process, handed to the code executor (which runs the analyst code
+    in-process) without parsing the CSV again per execution.
+
+    Frames are evicted least-recently-used once their total size exceeds `max_bytes`. A frame being used by an
+    execution when it is evicted stays alive (as a plain Python reference) until that execution ends.
+
+    Executions get shallow copies: with pandas' copy-on-write, changes made by the executed code stay local to that
+    execution and never reach the cached frame.
+    """
+
+    def __init__(self, max_bytes: int = SHARED_FRAMES_MAX_MB * 1024 * 1024):
+        """
+        Args:
+            max_bytes (int): The maximum total size of the cached frames (`DataFrame.memory_usage(deep=True)`).
+        """
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _CachedFrame]" = OrderedDict()     # LRU order, most recent last
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def publish(self, table_id: str, df: pd.DataFrame, version: Any = None) -> bool:
+        """
+        Cache (or replace) the frame of a table. Returns False if it is larger than `max_bytes` on its own.
+        """
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            self._entries.pop(table_id, None)
+            if size > self.max_bytes:
+                return False
+            self._entries[table_id] = _CachedFrame(df, size, version)
+            total = sum(e.size for e in self._entries.values())
+            while total > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                total -= evicted.size
+                self.evictions += 1
+        return True
+
+    @contextmanager
+    def attach(self, table_id: str, loader: Optional[Callable[[], Optional[pd.DataFrame]]] = None):
+        """
+        Yields the DataFrame of a table (None if not cached and no `loader` provided). A missing table is loaded
+        with `loader` and cached.
+        """
+        with self._lock:
+            entry = self._entries.get(table_id)
+            if entry is not None:
+                self._entries.move_to_end(table_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            df = loader() if loader else None
+            if df is not None:
+                self.publish(table_id, df)
+            yield df.copy(deep=False) if df is not None else None
+        else:
+            yield entry.frame.copy(deep=False)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tables": len(self._entries),
+                "bytes": sum(e.size for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,84 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls across threads: while a call for a key is in flight, callers with the same key wait
+    for its result (or exception) instead of running the work again. Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn()` for the key, or wait for the in-flight call with the same key.
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+
+class AsyncSingleFlight:
+    """
+    `SingleFlight` for coroutines on one event loop: callers with the same key await one shared task. The task is
+    shielded, so a cancelled caller does not cancel the work the other callers are waiting for.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await `fn()` for the key, or the in-flight call with the same key.
+        """
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+def atomic_write(path: str, write: Callable[[str], Any]) -> None:
+    """
+    Write a file atomically: `write(tmp_path)` writes a temporary file next to `path`, which is then renamed over
+    `path`, so readers see either the old or the complete new file, never a partial one.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
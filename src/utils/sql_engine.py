@@ -0,0 +1,289 @@
+"""
+DuckDB query path over the cached CSO tables, exposed to the analyst code as the preloaded `sql(...)` helper.
+
+The analyst code references tables by their table-ID, e.g.:
+
+    sql("SELECT Year, SUM(VALUE) AS total FROM HPM09 WHERE County = 'Dublin' GROUP BY Year ORDER BY Year")
+
+Every table-ID found in the query that has a cached `cache/<table_id>.csv` is materialized once to
+`cache/<table_id>.parquet` (re-materialized when the CSV is newer) and registered as a view over that file, so
+filters, aggregations and joins across tables run vectorized and multi-threaded in DuckDB and only the result is
+returned as a pandas DataFrame.
+
+Usage (benchmark against the pandas path):
+    python -m src.utils.sql_engine bench [--rows 2000000] [--repeat 3] [--json out.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import importlib.util
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.utils.single_flight import atomic_write
+
+
+TABLE_CACHE_DIR = "cache/"
+SQL_ENGINE_ENABLED = (
+    os.environ.get("SQL_ENGINE_ENABLED", "true").lower() == "true" and importlib.util.find_spec("duckdb") is not None
+)
+SQL_THREADS = int(os.environ.get("SQL_THREADS", "0"))           # 0: DuckDB default (all cores)
+SQL_MEMORY_LIMIT = os.environ.get("SQL_MEMORY_LIMIT", "")        # e.g. "2GB"; empty: DuckDB default
+SQL_MAX_RESULT_ROWS = int(os.environ.get("SQL_MAX_RESULT_ROWS", "100000"))
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _quote_identifier(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+class TableSQL:
+    """
+    An in-memory DuckDB database with one view per cached table, queried through short-lived cursors (thread-safe).
+    """
+
+    def __init__(self, cache_dir: str = TABLE_CACHE_DIR, threads: int = SQL_THREADS, memory_limit: str = SQL_MEMORY_LIMIT):
+        """
+        Args:
+            cache_dir (str): The folder holding the `<table_id>.csv` files (and their parquet copies).
+            threads (int): DuckDB worker threads (0 keeps DuckDB's default).
+            memory_limit (str): DuckDB memory limit, e.g. "2GB" (empty keeps DuckDB's default).
+        """
+        import duckdb
+
+        self.cache_dir = cache_dir
+        self._db = duckdb.connect(":memory:")
+        if threads > 0:
+            self._db.execute(f"SET threads = {int(threads)}")
+        if memory_limit:
+            self._db.execute(f"SET memory_limit = {_quote_literal(memory_limit)}")
+        self._views: Dict[str, float] = {}      # table_id -> mtime of the parquet file the view was checked against
+        self._lock = threading.Lock()            # guards the catalog (views) and the materialization
+
+    # ---------- MATERIALIZATION ----------
+
+    def csv_path(self, table_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{table_id}.csv")
+
+    def parquet_path(self, table_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{table_id}.parquet")
+
+    def materialize(self, table_id: str) -> str:
+        """
+        Write (or refresh) the parquet copy of a cached CSV table. Returns the parquet path.
+        """
+        csv_fp, parquet_fp = self.csv_path(table_id), self.parquet_path(table_id)
+        if os.path.exists(parquet_fp) and os.path.getmtime(parquet_fp) >= os.path.getmtime(csv_fp):
+            return parquet_fp
+
+        # written next to the target and renamed: readers never see a partial file
+        cursor = self._db.cursor()
+        try:
+            atomic_write(parquet_fp, lambda tmp_fp: cursor.execute(
+                f"COPY (SELECT * FROM read_csv_auto({_quote_literal(csv_fp)}, header = true)) "
+                f"TO {_quote_literal(tmp_fp)} (FORMAT parquet, COMPRESSION zstd)"
+            ))
+        finally:
+            cursor.close()
+        return parquet_fp
+
+    def referenced_tables(self, query: str) -> List[str]:
+        """
+        The identifiers of the query that are cached tables.
+        """
+        seen = []
+        for name in IDENTIFIER_PATTERN.findall(query):
+            if name not in seen and os.path.exists(self.csv_path(name)):
+                seen.append(name)
+        return seen
+
+    def register(self, table_id: str) -> None:
+        with self._lock:
+            parquet_fp = self.materialize(table_id)
+            mtime = os.path.getmtime(parquet_fp)
+            if self._views.get(table_id) == mtime:
+                return
+            self._db.execute(
+                f"CREATE OR REPLACE VIEW {_quote_identifier(table_id)} AS SELECT * FROM read_parquet({_quote_literal(parquet_fp)})"
+            )
+            self._views[table_id] = mtime
+
+    # ---------- QUERY ----------
+
+    def sql(self, query: str, max_rows: int = SQL_MAX_RESULT_ROWS) -> pd.DataFrame:
+        """
+        Run a DuckDB SQL query over the cached tables (referenced by table-ID) and return the result as a DataFrame.
+
+        Args:
+            query (str): The SQL query, e.g. "SELECT Year, SUM(VALUE) FROM HPM09 GROUP BY Year".
+            max_rows (int): The maximum number of result rows returned (a larger result is truncated with a warning).
+
+        Returns:
+            pd.DataFrame: The query result.
+        """
+        for table_id in self.referenced_tables(query):
+            self.register(table_id)
+
+        cursor = self._db.cursor()
+        try:
+            relation = cursor.sql(query)
+            if relation is None:
+                return pd.DataFrame()
+            result = relation.limit(max_rows + 1).df()
+        finally:
+            cursor.close()
+        if len(result) > max_rows:
+            print(f"Warning: the query returned more than {max_rows} rows, the result is truncated. Aggregate or filter in SQL.")
+            result = result.head(max_rows)
+        return result
+
+    def close(self) -> None:
+        self._db.close()
+
+
+_engine: Optional[TableSQL] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> TableSQL:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TableSQL()
+        return _engine
+
+
+def sql(query: str) -> pd.DataFrame:
+    """
+    Run a DuckDB SQL query over the cached CSO tables, referenced by their table-ID, and return a pandas DataFrame.
+    """
+    return get_engine().sql(query)
+
+
+# ---------- BENCHMARK ----------
+
+def _write_bench_tables(folder: str, n_rows: int, seed: int = 0) -> Dict[str, str]:
+    """
+    Two CSO-like long-format tables sharing the Year / County dimensions: BENCHA (n_rows) and BENCHB (small).
+    """
+    rng = np.random.default_rng(seed)
+    years = np.arange(1990, 2025)
+    counties = np.array([f"County {i:02d}" for i in range(30)])
+    items = np.array([f"Item {i:04d}" for i in range(max(1, n_rows // (len(years) * len(counties))))])
+
+    idx = rng.integers(0, [len(years), len(counties), len(items)], size=(n_rows, 3))
+    big = pd.DataFrame({
+        "Year": years[idx[:, 0]],
+        "County": counties[idx[:, 1]],
+        "Item": items[idx[:, 2]],
+        "UNIT": "Number",
+        "VALUE": rng.normal(1000, 250, n_rows).round(1),
+    })
+    small = pd.DataFrame(
+        [(int(y), c, int(rng.integers(10_000, 500_000))) for y in years for c in counties],
+        columns=["Year", "County", "Population"],
+    )
+    paths = {"BENCHA": os.path.join(folder, "BENCHA.csv"), "BENCHB": os.path.join(folder, "BENCHB.csv")}
+    big.to_csv(paths["BENCHA"], index=False)
+    small.to_csv(paths["BENCHB"], index=False)
+    return paths
+
+
+BENCH_QUERIES = {
+    "filter_aggregate": (
+        "SELECT Year, SUM(VALUE) AS total FROM BENCHA WHERE County = 'County 03' GROUP BY Year ORDER BY Year",
+        lambda a, b: a[a["County"] == "County 03"].groupby("Year", as_index=False)["VALUE"].sum().sort_values("Year"),
+    ),
+    "group_by": (
+        "SELECT County, Item, AVG(VALUE) AS mean FROM BENCHA GROUP BY County, Item",
+        lambda a, b: a.groupby(["County", "Item"], as_index=False)["VALUE"].mean(),
+    ),
+    "join": (
+        "SELECT a.Year, a.County, SUM(a.VALUE) / ANY_VALUE(b.Population) AS per_capita "
+        "FROM BENCHA a JOIN BENCHB b USING (Year, County) WHERE a.Year >= 2015 GROUP BY a.Year, a.County",
+        lambda a, b: (
+            a[a["Year"] >= 2015].groupby(["Year", "County"], as_index=False)["VALUE"].sum()
+            .merge(b, on=["Year", "County"]).assign(per_capita=lambda d: d["VALUE"] / d["Population"])
+        ),
+    ),
+}
+
+
+def run_benchmark(n_rows: int, repeat: int) -> List[Dict]:
+    """
+    Time each benchmark query on the pandas path (read the CSVs, then filter / aggregate / join in pandas, as the
+    analyst code does today) and on the `sql` path (cold: includes the parquet materialization; warm: cached).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        paths = _write_bench_tables(folder, n_rows)
+        csv_mb = sum(os.path.getsize(p) for p in paths.values()) / 1e6
+
+        for name, (query, pandas_fn) in BENCH_QUERIES.items():
+            pandas_times, warm_times = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                a, b = pd.read_csv(paths["BENCHA"]), pd.read_csv(paths["BENCHB"])
+                expected = pandas_fn(a, b)
+                pandas_times.append(time.perf_counter() - start)
+                del a, b
+
+            # a fresh engine and no parquet copies: the first query pays the materialization
+            for table_id in paths:
+                parquet_fp = os.path.join(folder, f"{table_id}.parquet")
+                if os.path.exists(parquet_fp):
+                    os.remove(parquet_fp)
+            engine = TableSQL(cache_dir=folder)
+            start = time.perf_counter()
+            got = engine.sql(query, max_rows=10**9)
+            cold = time.perf_counter() - start
+            for _ in range(repeat):
+                start = time.perf_counter()
+                engine.sql(query, max_rows=10**9)
+                warm_times.append(time.perf_counter() - start)
+            engine.close()
+
+            results.append({
+                "query": name,
+                "rows": n_rows,
+                "csv_mb": round(csv_mb, 1),
+                "pandas_s": round(float(np.median(pandas_times)), 4),
+                "sql_cold_s": round(cold, 4),
+                "sql_warm_s": round(float(np.median(warm_times)), 4),
+                "speedup_warm": round(float(np.median(pandas_times) / np.median(warm_times)), 1),
+                "same_result_rows": len(got) == len(expected),
+            })
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", dest="json_path", default=None)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.rows, args.repeat)
+    for row in results:
+        print(json.dumps(row))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
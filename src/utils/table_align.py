@@ -0,0 +1,277 @@
+"""
+Cross-table alignment for the analyst code, exposed as the preloaded `align_tables(...)` helper.
+
+    df = align_tables(["HPM09", "CPM01"], select={"HPM09": {"Statistic": "Mean Sale Price"}})
+
+The tables are decoded from the archive by dimension code (not from the label-based CSVs), and joined on the
+dimensions they have in common:
+  - the same registry fingerprint (identical coding, see `JSONStatArchiveDB.read_dim_maps`; an archive written before
+    the JSON-Stat 2.0 dimension-IDs were read has no fingerprints until it is rewritten, see
+    `src.storage.json_stat_archive_db`),
+  - else the same dimension-ID (e.g. the CSO county classification in both tables),
+  - else the same time / geography role (JSON-Stat `role`),
+as long as the codes overlap. Statistic (metric) dimensions are only joined on when their coding is identical;
+otherwise they stay per-table columns. The joins run on integer category codes, and the result is one tidy frame:
+a label column per joined dimension, the remaining dimensions of each table, and one value column per table-ID.
+"""
+import os
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+ALIGN_TABLES_ENABLED = os.environ.get("ALIGN_TABLES_ENABLED", "true").lower() == "true"
+ALIGN_MAX_ROWS = int(os.environ.get("ALIGN_MAX_ROWS", "2000000"))
+
+JOINABLE_ROLES = ("time", "geo")
+
+
+# ---------- CODED TABLES ----------
+
+def _dimension_roles(ds: Dict[str, Any]) -> Dict[str, str]:
+    roles = {}
+    for role, dim_ids in (ds.get("role") or {}).items():
+        for dim_id in dim_ids:
+            roles[dim_id] = role
+    for dim_id in ds.get("id", []):
+        if dim_id not in roles:
+            # CSO conventions, for datasets without a `role`
+            if dim_id == "STATISTIC":
+                roles[dim_id] = "metric"
+            elif dim_id.startswith("TLIST("):
+                roles[dim_id] = "time"
+    return roles
+
+
+def coded_table(table_id: str, ds: Dict[str, Any], dim_map: Dict[str, str]) -> Dict[str, Any]:
+    """
+    The dimensions of a JSON-Stat dataset (codes, labels, role, registry fingerprint) and its values, flat in
+    row-major order.
+    """
+    from src.storage.json_stat_archive_db import _ordered_index_list
+
+    roles = _dimension_roles(ds)
+    dims = []
+    for dim_id in ds["id"]:
+        d = ds["dimension"][dim_id]
+        cat = d.get("category", {}) or {}
+        codes = list(_ordered_index_list(cat))
+        labels = cat.get("label") or {}
+        dims.append({
+            "id": dim_id,
+            "label": d.get("label") or dim_id,
+            "role": roles.get(dim_id),
+            "codes": codes,
+            "labels": [labels.get(code, code) for code in codes],
+            "fingerprint": dim_map.get(dim_id),
+        })
+
+    n_values = int(np.prod(ds["size"])) if ds["size"] else 0
+    value = ds.get("value", [])
+    if isinstance(value, dict):
+        # sparse JSON-Stat: {"<flat index>": value}
+        values = np.full(n_values, np.nan)
+        if value:
+            positions = np.fromiter((int(k) for k in value), dtype=np.int64, count=len(value))
+            values[positions] = np.array([np.nan if v is None else v for v in value.values()], dtype=float)
+    else:
+        values = np.array([np.nan if v is None else v for v in value], dtype=float)
+    return {"table_id": table_id, "dims": dims, "size": list(ds["size"]), "values": values}
+
+
+def _find_dimension(table: Dict[str, Any], name: str) -> Dict[str, Any]:
+    for dim in table["dims"]:
+        if name in (dim["id"], dim["label"]):
+            return dim
+    raise KeyError(
+        f"Table {table['table_id']} has no dimension {name!r}; dimensions: {[dim['label'] for dim in table['dims']]}"
+    )
+
+
+def _selected_positions(dim: Dict[str, Any], wanted: Union[str, List[str]]) -> np.ndarray:
+    wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+    positions = [i for i, (code, label) in enumerate(zip(dim["codes"], dim["labels"])) if code in wanted or label in wanted]
+    if not positions:
+        raise ValueError(f"None of {wanted} is a code or label of the dimension {dim['label']!r}")
+    return np.array(positions, dtype=np.int64)
+
+
+def table_rows(table: Dict[str, Any], select: Optional[Dict[str, Any]] = None) -> Dict[str, np.ndarray]:
+    """
+    Expand a coded table into rows: the category position of each dimension per row and the value, optionally
+    restricted to the selected categories ({dimension-ID or label: code(s) or label(s)}), without materializing the
+    unselected rows.
+    """
+    positions = [np.arange(len(dim["codes"]), dtype=np.int64) for dim in table["dims"]]
+    for name, wanted in (select or {}).items():
+        dim = _find_dimension(table, name)
+        positions[table["dims"].index(dim)] = _selected_positions(dim, wanted)
+
+    grid = np.meshgrid(*positions, indexing="ij")
+    flat = np.ravel_multi_index(grid, table["size"]).ravel()
+    rows = {dim["id"]: g.ravel() for dim, g in zip(table["dims"], grid)}
+    rows["__value__"] = table["values"][flat]
+    return rows
+
+
+# ---------- ALIGNMENT ----------
+
+def _match_dimension(dim: Dict[str, Any], other: Dict[str, Any], used: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    The dimension of `other` to join `dim` on, if any (`used`: the dimensions of `other` already matched).
+    """
+    free = [d for d in other["dims"] if d["id"] not in used]
+    same = [d for d in free if dim["fingerprint"] and d["fingerprint"] == dim["fingerprint"]]
+    if not same and dim["role"] != "metric":
+        same = [d for d in free if d["id"] == dim["id"]]
+    if not same and dim["role"] in JOINABLE_ROLES:
+        same = [d for d in free if d["role"] == dim["role"]]
+    for candidate in same:
+        if (dim["fingerprint"] and candidate["fingerprint"] == dim["fingerprint"]) or set(candidate["codes"]) & set(dim["codes"]):
+            return candidate
+    return None
+
+
+def common_dimensions(tables: List[Dict[str, Any]], on: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    The dimensions shared by all the tables, as one list of matched dimensions (one per table) each.
+
+    Args:
+        tables (List[Dict]): The coded tables (see `coded_table`).
+        on (List[str], optional): Restrict to these dimensions of the first table (IDs or labels).
+    """
+    first, others = tables[0], tables[1:]
+    candidates = [_find_dimension(first, name) for name in on] if on else first["dims"]
+    matched = []
+    used: List[List[str]] = [[] for _ in others]
+    for dim in candidates:
+        group = [dim]
+        for t, other in enumerate(others):
+            match = _match_dimension(dim, other, used[t])
+            if match is None:
+                break
+            group.append(match)
+        else:
+            for t, match in enumerate(group[1:]):
+                used[t].append(match["id"])
+            matched.append(group)
+            continue
+        if on:
+            raise ValueError(f"The dimension {dim['label']!r} of {first['table_id']} has no match in all the tables")
+    return matched
+
+
+def _estimated_rows(frames: List[pd.DataFrame], keys: List[str], how: str) -> int:
+    # rows of the joined frame: per key, the product of the number of rows of each table
+    counts = None
+    for i, frame in enumerate(frames):
+        count = frame.groupby(keys, sort=False).size().rename(f"n{i}").reset_index() if keys else pd.DataFrame({f"n{i}": [len(frame)]})
+        counts = count if counts is None else (counts.merge(count, on=keys, how=how) if keys else counts.join(count))
+    per_key = counts[[f"n{i}" for i in range(len(frames))]].fillna(1).prod(axis=1)
+    return int(per_key.sum())
+
+
+def align(
+    tables: List[Dict[str, Any]],
+    on: Optional[List[str]] = None,
+    select: Optional[Dict[str, Dict[str, Any]]] = None,
+    how: str = "inner",
+    max_rows: int = ALIGN_MAX_ROWS,
+) -> pd.DataFrame:
+    """
+    Join coded tables on their common dimensions (see `align_tables`).
+    """
+    groups = common_dimensions(tables, on)
+
+    # per joined dimension: the union of the codes of all the tables, and each table's positions remapped onto it
+    unions = []
+    for group in groups:
+        codes, labels = [], {}
+        for dim in group:
+            for code, label in zip(dim["codes"], dim["labels"]):
+                if code not in labels:
+                    codes.append(code)
+                    labels[code] = label
+        unions.append((codes, [labels[code] for code in codes]))
+
+    key_names = [f"__key{j}__" for j in range(len(groups))]
+    joined_ids = [{group[t]["id"] for group in groups} for t in range(len(tables))]
+    taken = {group[0]["label"] for group in groups}
+
+    frames = []
+    for t, table in enumerate(tables):
+        rows = table_rows(table, (select or {}).get(table["table_id"]))
+        columns = {}
+        for j, group in enumerate(groups):
+            dim = group[t]
+            remap = pd.Index(unions[j][0]).get_indexer(dim["codes"]).astype(np.int32)
+            columns[key_names[j]] = remap[rows[dim["id"]]]
+        for dim in table["dims"]:
+            if dim["id"] in joined_ids[t]:
+                continue
+            name = dim["label"] if dim["label"] not in taken else f"{table['table_id']} {dim['label']}"
+            taken.add(name)
+            columns[name] = pd.Categorical.from_codes(rows[dim["id"]], categories=pd.Index(dim["labels"]).unique()) \
+                if len(set(dim["labels"])) == len(dim["labels"]) else np.array(dim["labels"], dtype=object)[rows[dim["id"]]]
+        columns[table["table_id"]] = rows["__value__"]
+        frames.append(pd.DataFrame(columns))
+
+    n_rows = _estimated_rows(frames, key_names, how)
+    if n_rows > max_rows:
+        raise ValueError(
+            f"The aligned frame would have {n_rows} rows (more than {max_rows}): the tables have dimensions that are not "
+            f"shared, restrict them with `select` (e.g. select={{'<TABLE_ID>': {{'<dimension>': '<category>'}}}})."
+        )
+
+    result = frames[0]
+    for frame in frames[1:]:
+        result = result.merge(frame, on=key_names, how=how) if key_names else result.merge(frame, how="cross")
+
+    # the integer keys become label columns (categorical, in the order of the codes)
+    for j, group in enumerate(groups):
+        codes, labels = unions[j]
+        keys = result.pop(key_names[j]).to_numpy()
+        if len(set(labels)) == len(labels):
+            column = pd.Categorical.from_codes(keys, categories=labels)
+        else:
+            column = np.array(labels, dtype=object)[keys]
+        result.insert(j, group[0]["label"], column)
+    return result.reset_index(drop=True)
+
+
+def align_tables(
+    table_ids: List[str],
+    on: Optional[List[str]] = None,
+    select: Optional[Dict[str, Dict[str, Any]]] = None,
+    how: str = "inner",
+) -> pd.DataFrame:
+    """
+    Align two or more tables on their common dimensions (time, geography, statistic, ...) by category code and return
+    one tidy DataFrame: a label column per common dimension, the other dimensions of each table, and one value column
+    per table-ID.
+
+    Args:
+        table_ids (List[str]): The table-IDs, e.g. ["HPM09", "CPM01"].
+        on (List[str], optional): Only join on these dimensions (labels or IDs of the first table's dimensions).
+        select (Dict[str, Dict], optional): Per table-ID, the categories to keep before joining:
+            {dimension label or ID: label(s) or code(s)}, e.g. {"HPM09": {"Statistic": "Mean Sale Price"}}.
+        how (str): "inner" (default) keeps the categories present in all the tables, "outer" keeps all.
+
+    Returns:
+        pd.DataFrame: The aligned tables.
+    """
+    from src.utils.resources import get_archive_reader
+    from src.graphs.tools.reviewer_tools import CSO_ARCHIVE_PATH
+
+    if len(table_ids) < 2:
+        raise ValueError("align_tables needs at least two table-IDs")
+    reader = get_archive_reader()
+    dim_maps = reader.read_dim_maps(CSO_ARCHIVE_PATH, table_ids)
+    tables = []
+    for table_id in table_ids:
+        if table_id not in dim_maps:
+            raise KeyError(f"Unknown table-ID: {table_id}")
+        datasets = [ds for _, ds, _ in reader.read(CSO_ARCHIVE_PATH, table_id=table_id, with_labels=True)]
+        tables.append(coded_table(table_id, datasets[-1], dim_maps[table_id]))
+    return align(tables, on=on, select=select, how=how)
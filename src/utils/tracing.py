@@ -0,0 +1,151 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+# Finished spans are kept in an in-memory ring buffer; OpenTelemetry export is optional.
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "5000"))
+OTEL_TRACING_ENABLED = os.environ.get("OTEL_TRACING_ENABLED", "false").lower() == "true"
+
+_spans: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+_spans_lock = threading.Lock()
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_tracer = None
+
+
+def _get_otel_tracer():
+    # The exporter itself is configured through the standard OTEL_* environment variables / SDK setup.
+    global _tracer
+    if _tracer is None and OTEL_TRACING_ENABLED:
+        try:
+            from opentelemetry import trace
+            _tracer = trace.get_tracer("data-cso-bot")
+        except ImportError:
+            print("Warning: OTEL_TRACING_ENABLED is set but opentelemetry is not installed")
+    return _tracer
+
+
+def _otel_value(value: Any) -> Any:
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a block of code as a named span (works in sync and async code, nested spans record their parent).
+
+    Args:
+        name (str): The span name, e.g. "retrieval.bm25".
+        **attributes: Attributes to attach to the span (e.g. table_id, sizes, token counts).
+
+    Yields:
+        dict: The span record; attributes can also be added with `set_attributes`.
+    """
+    parent = _current_span.get()
+    record = {
+        "name": name,
+        "parent": parent["name"] if parent else None,
+        "start": time.time(),
+        "duration_ms": None,
+        "attributes": dict(attributes),
+    }
+    token = _current_span.set(record)
+    tracer = _get_otel_tracer()
+    otel_cm = tracer.start_as_current_span(name) if tracer else None
+    otel_span = otel_cm.__enter__() if otel_cm else None
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        _current_span.reset(token)
+        with _spans_lock:
+            _spans.append(record)
+        if otel_span is not None:
+            for key, value in record["attributes"].items():
+                otel_span.set_attribute(key, _otel_value(value))
+            if "error" in record:
+                otel_span.set_attribute("error", record["error"])
+            otel_cm.__exit__(None, None, None)
+
+
+def set_attributes(**attributes) -> None:
+    """
+    Add attributes to the innermost active span (no-op outside of a span).
+    """
+    record = _current_span.get()
+    if record is not None:
+        record["attributes"].update(attributes)
+
+
+def record_token_usage(message: Any = None, estimated_input_tokens: Optional[int] = None) -> None:
+    """
+    Attach token counts to the innermost active span.
+
+    Uses the provider counts of an LLM response (`usage_metadata`) when available, else the given estimate.
+
+    Args:
+        message: The LLM response (e.g. an `AIMessage`).
+        estimated_input_tokens (Optional[int]): A prompt-size estimate, for calls without usage metadata.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage:
+        set_attributes(
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+        )
+    elif estimated_input_tokens is not None:
+        set_attributes(input_tokens_est=estimated_input_tokens)
+
+
+def recent_spans(limit: int = 100, name: Optional[str] = None) -> List[Dict]:
+    """
+    The most recent finished spans (newest last), optionally filtered by name.
+    """
+    with _spans_lock:
+        spans = [s for s in _spans if name is None or s["name"] == name]
+    return spans[-limit:]
+
+
+def metrics_snapshot() -> Dict[str, Dict]:
+    """
+    Per-span-name aggregates over the ring buffer: count, errors, p50/p95/max/total latency and token totals.
+    """
+    with _spans_lock:
+        spans = list(_spans)
+
+    grouped: Dict[str, List[Dict]] = {}
+    for s in spans:
+        grouped.setdefault(s["name"], []).append(s)
+
+    snapshot = {}
+    for name, items in sorted(grouped.items()):
+        durations = [s["duration_ms"] for s in items]
+        stats = {
+            "count": len(items),
+            "errors": sum(1 for s in items if "error" in s),
+            "p50_ms": round(float(np.percentile(durations, 50)), 3),
+            "p95_ms": round(float(np.percentile(durations, 95)), 3),
+            "max_ms": round(max(durations), 3),
+            "total_ms": round(sum(durations), 3),
+        }
+        for key in ("input_tokens", "output_tokens", "input_tokens_est"):
+            values = [s["attributes"][key] for s in items if isinstance(s["attributes"].get(key), (int, float))]
+            if values:
+                stats[key] = int(sum(values))
+        snapshot[name] = stats
+    return snapshot
+
+
+def reset() -> None:
+    with _spans_lock:
+        _spans.clear()
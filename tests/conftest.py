@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from src.retrieval.index_builder import build_index
+from src.storage.synthetic_archive import write_synthetic_archive
+
+
+N_SYNTHETIC_TABLES = 6
+
+
+@pytest.fixture
+def synthetic_artifacts(tmp_path):
+    """
+    A synthetic archive of `N_SYNTHETIC_TABLES` tables and its published artifacts version (hashing embedder):
+    {"archive": ..., "out_root": ..., "artifacts_dir": ...}.
+    """
+    archive_path = str(tmp_path / "archive.sqlite")
+    write_synthetic_archive(archive_path, N_SYNTHETIC_TABLES, n_categories=20, n_years=3)
+    out_root = str(tmp_path / "index")
+    artifacts_dir = build_index(archive_path, out_root=out_root, embedder_name="hashing", workers=1, version="v1")
+    return {"archive": archive_path, "out_root": out_root, "artifacts_dir": artifacts_dir}
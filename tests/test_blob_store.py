@@ -0,0 +1,77 @@
+import fakeredis
+import pytest
+
+from src.storage.blob_store import RedisBlobStore, SQLiteBlobStore, is_blob_ref
+
+
+REPORT = {"task": "Load the table", "code": "df = pd.read_csv('cache/HPM09.csv')", "result": "2000 rows"}
+CONTEXT = "**Table ID**: HPM09"
+
+
+@pytest.fixture(params=["redis", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "redis":
+        return RedisBlobStore(client=fakeredis.FakeRedis(), ttl_days=1)
+    return SQLiteBlobStore(str(tmp_path / "blobs.sqlite"))
+
+
+def test_put_and_get_share_identical_values(store):
+    refs = store.put_many([REPORT, REPORT, CONTEXT], owner="thread-a")
+    assert all(is_blob_ref(ref) for ref in refs)
+    assert refs[0] == refs[1]
+    assert store.get_many(refs) == {refs[0]: REPORT, refs[2]: CONTEXT}
+    assert store.resolve("inline value") == "inline value"
+
+
+def test_release_keeps_the_blobs_of_other_threads(store):
+    shared = store.put(REPORT, owner="thread-a")
+    assert store.put(REPORT, owner="thread-b") == shared
+    own = store.put(CONTEXT, owner="thread-a")
+
+    assert store.release("thread-a") == 1
+    assert store.get(own) is None
+    assert store.get(shared) == REPORT
+
+    assert store.release("thread-b") == 1
+    assert store.get(shared) is None
+    assert store.release("thread-b") == 0
+
+
+def test_added_owner_keeps_the_blobs_after_the_first_owner_is_released(store):
+    ref = store.put(REPORT, owner="thread-a")
+    assert store.add_owner([ref, "inline value"], "answer-cache") == []
+    assert store.add_owner([ref], "thread-b") == []
+
+    assert store.release("thread-a") == 0
+    assert store.release("answer-cache") == 0
+    assert store.get(ref) == REPORT
+    assert store.release("thread-b") == 1
+
+    # a released blob cannot be owned again
+    assert store.add_owner([ref], "thread-c") == [ref]
+    assert store.release("thread-c") == 0
+
+
+def test_redis_expiry_is_refreshed_on_use():
+    client = fakeredis.FakeRedis()
+    store = RedisBlobStore(client=client, ttl_days=1)
+    ref = store.put(REPORT, owner="thread-a")
+    digest = ref.rsplit(":", 1)[1]
+    keys = [f"{store.prefix}:{digest}", f"{store.prefix}:{digest}:owners", f"{store.prefix}:refs:thread-a"]
+    assert all(0 < client.ttl(key) <= 24 * 3600 for key in keys)
+
+    def _shorten():
+        for key in keys:
+            client.expire(key, 60)
+
+    _shorten()
+    store.touch("thread-a")
+    assert all(client.ttl(key) > 60 for key in keys)
+
+    _shorten()
+    assert store.get(ref) == REPORT
+    assert client.ttl(keys[0]) > 60 and client.ttl(keys[1]) > 60
+
+    _shorten()
+    store.add_owner([ref], "thread-b")
+    assert client.ttl(keys[0]) > 60 and client.ttl(f"{store.prefix}:refs:thread-b") > 60
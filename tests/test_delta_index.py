@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from src.retrieval.delta_index import DeltaIndex, changed_tables, compact, update_delta
+from src.retrieval.hybrid_retrieval import HybridRetrieval
+from src.retrieval.index_builder import current_version, read_manifest
+from src.retrieval.local_embeddings import HashingEmbeddings
+from src.storage.json_stat_archive_db import JSONStatArchiveDB
+from src.storage.synthetic_archive import synthetic_tables
+
+
+NEW_TIMESTAMP = "02-02-2026 10:00:00 AM"
+
+
+def _change_archive(archive_path: str) -> None:
+    # SYN00001 changes, SYN00002 is deleted, SYN00010 is new
+    tables = dict(synthetic_tables(11, n_categories=20, n_years=3))
+    changed = tables["SYN00001"]
+    changed["data"]["label"] = "Renewable Heat Pump Installations"
+    JSONStatArchiveDB().write(archive_path, {
+        "SYN00001": {"data": changed["data"], "timestamp": NEW_TIMESTAMP},
+        "SYN00010": tables["SYN00010"],
+    })
+    with sqlite3.connect(archive_path) as conn:
+        conn.execute("DELETE FROM datasets WHERE table_id = 'SYN00002'")
+
+
+def _bm25_ids(artifacts_dir: str) -> set:
+    with open(os.path.join(artifacts_dir, "bm25", "corpus.jsonl")) as f:
+        return {json.loads(line)["id"] for line in f}
+
+
+def _retrieval(artifacts_dir: str) -> HybridRetrieval:
+    manifest = read_manifest(artifacts_dir)
+    return HybridRetrieval(
+        top_k_stage_1=manifest["n_bm25_chunks"], top_k_stage_2=3, embeddings=HashingEmbeddings(dim=manifest["dim"]),
+        llm=object(), artifacts_dir=artifacts_dir, mmap=False,
+    )
+
+
+def test_tombstoned_tables_are_hidden_and_delta_tables_found(synthetic_artifacts):
+    artifacts_dir, archive = synthetic_artifacts["artifacts_dir"], synthetic_artifacts["archive"]
+    _change_archive(archive)
+
+    changed, deleted = changed_tables(artifacts_dir, archive)
+    assert (changed, deleted) == (["SYN00001", "SYN00010"], ["SYN00002"])
+    update_delta(artifacts_dir, changed, deleted, archive)
+
+    delta = DeltaIndex.load(artifacts_dir, mmap=False)
+    assert delta.generation == 1
+    assert delta.table_ids == {"SYN00001", "SYN00010"}
+    assert delta.tombstones == {"SYN00001", "SYN00002", "SYN00010"}
+    assert delta.manifest["embedder"] == "hashing"
+    assert changed_tables(artifacts_dir, archive) == ([], [])
+
+    retrieval = _retrieval(artifacts_dir)
+    try:
+        found = retrieval._stage_1("renewable heat pump installations county total")
+        assert "SYN00002" not in found
+        assert {"SYN00001", "SYN00010"} <= set(found)
+        assert "SYN00002" not in retrieval._stage_2("heat pump", list(found))
+        assert "SYN00010" in retrieval.get_context_blocks(["SYN00010"])
+    finally:
+        retrieval.close()
+
+
+def test_generations_carry_over_and_compaction_counts(synthetic_artifacts):
+    artifacts_dir, archive, out_root = (synthetic_artifacts[k] for k in ("artifacts_dir", "archive", "out_root"))
+    main_manifest = read_manifest(artifacts_dir)
+    _change_archive(archive)
+    first = update_delta(artifacts_dir, ["SYN00001", "SYN00010"], ["SYN00002"], archive)
+    second = update_delta(artifacts_dir, [], ["SYN00010"], archive)
+
+    delta = DeltaIndex.load(artifacts_dir, mmap=False)
+    assert delta.generation == 2
+    assert delta.table_ids == {"SYN00001"}
+    assert delta.table_timestamps == {"SYN00001": NEW_TIMESTAMP}
+    # the previous generation is removed once no snapshot holds a lease on it
+    assert not os.path.exists(first) and os.path.exists(second)
+
+    with pytest.raises(ValueError, match="same embedder"):
+        update_delta(artifacts_dir, ["SYN00003"], [], archive, embedder_name="gemini")
+
+    compacted = compact(artifacts_dir, out_root, version="v2")
+    assert current_version(out_root) == "v2"
+    manifest = read_manifest(compacted)
+    assert manifest["n_tables"] == main_manifest["n_tables"] - 1
+    assert set(manifest["table_timestamps"]) == {"SYN00000", "SYN00001", "SYN00003", "SYN00004", "SYN00005"}
+    assert manifest["table_timestamps"]["SYN00001"] == NEW_TIMESTAMP
+    assert manifest["compacted_from"] == {"version": "v1", "delta_generation": 2}
+    assert _bm25_ids(compacted) == set(manifest["table_timestamps"])
+    assert DeltaIndex.load(compacted) is None
+
+    retrieval = _retrieval(compacted)
+    try:
+        assert retrieval.vector_store.index.ntotal == manifest["n_tables"]
+        assert "SYN00001" in retrieval._stage_1("renewable heat pump installations")
+    finally:
+        retrieval.close()
@@ -0,0 +1,85 @@
+import json
+import os
+
+import bm25s
+import faiss
+import numpy as np
+import pytest
+import Stemmer
+
+from src.retrieval.hybrid_retrieval import load_faiss_store
+from src.retrieval.index_builder import build_index, document_text, read_jsonl, write_flat_index
+from src.retrieval.local_embeddings import HashingEmbeddings
+from src.storage.synthetic_archive import write_synthetic_archive
+
+
+N_TABLES = 7
+
+
+@pytest.fixture(scope="module")
+def builds(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("index")
+    archive_path = str(folder / "archive.sqlite")
+    write_synthetic_archive(archive_path, N_TABLES, n_categories=40, n_years=3)
+    # several batches (of 2 tables) and a single one
+    return {
+        batch_size: build_index(
+            archive_path, out_root=str(folder / f"out-{batch_size}"), embedder_name="hashing",
+            workers=1, batch_size=batch_size, version="v1", publish=False,
+        )
+        for batch_size in (2, 100)
+    }
+
+
+def _read(fp: str) -> bytes:
+    with open(fp, "rb") as f:
+        return f.read()
+
+
+def test_vectors_are_streamed_into_the_flat_index(builds):
+    version_dir = builds[2]
+    summaries = list(read_jsonl(os.path.join(version_dir, "cso_smry", "summaries.jsonl")))
+    assert len(summaries) == N_TABLES
+    assert not os.path.exists(os.path.join(version_dir, ".build"))
+
+    store = load_faiss_store(os.path.join(version_dir, "cso_smry", "faiss_index"), HashingEmbeddings())
+    expected = np.asarray(HashingEmbeddings().embed_documents([document_text(s) for s in summaries]), dtype="float32")
+    np.testing.assert_array_equal(store.index.reconstruct_n(0, N_TABLES), expected)
+    assert [store.index_to_docstore_id[i] for i in range(N_TABLES)] == [s["id"] for s in summaries]
+    assert store.docstore.search(summaries[0]["id"]).metadata == summaries[0]
+
+    manifest = json.load(open(os.path.join(version_dir, "manifest.json")))
+    assert manifest["n_tables"] == N_TABLES and manifest["dim"] == expected.shape[1]
+
+
+def test_bm25_index_matches_an_in_memory_build(builds):
+    bm25_dir = os.path.join(builds[2], "bm25")
+    built = bm25s.BM25.load(bm25_dir, load_corpus=True)
+    corpus = list(read_jsonl(os.path.join(bm25_dir, "corpus.jsonl")))
+    stemmer = Stemmer.Stemmer("english")
+    reference = bm25s.BM25()
+    reference.index(bm25s.tokenize([c["text"] for c in corpus], stopwords="en", stemmer=stemmer, return_ids=False,
+                                   show_progress=False), show_progress=False)
+
+    queries = ["county total annual change", corpus[-1]["text"][:60]]
+    for query in queries:
+        tokens = bm25s.tokenize([query], stopwords="en", stemmer=stemmer, return_ids=False, show_progress=False)
+        docs, scores = built.retrieve(tokens, k=5, show_progress=False)
+        expected_docs, expected_scores = reference.retrieve(tokens, k=5, show_progress=False)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+        assert [d["text"] for d in docs[0]] == [corpus[i]["text"] for i in expected_docs[0]]
+
+
+def test_the_batch_size_does_not_change_the_artifacts(builds):
+    for name in ("bm25/data.csc.index.npy", "bm25/indices.csc.index.npy", "bm25/vocab.index.json",
+                 "bm25/corpus.jsonl", "cso_smry/faiss_index/index.faiss", "cso_smry/summaries.jsonl"):
+        assert _read(os.path.join(builds[2], name)) == _read(os.path.join(builds[100], name))
+
+
+def test_flat_index_file_is_what_faiss_writes(tmp_path):
+    vectors = np.random.default_rng(0).random((10, 6), dtype=np.float32)
+    vectors.tofile(tmp_path / "vectors.f32")
+    write_flat_index(str(tmp_path / "vectors.f32"), 10, 6, str(tmp_path / "index.faiss"))
+    index = faiss.IndexFlatL2(6)
+    index.add(vectors)
+    assert _read(tmp_path / "index.faiss") == faiss.serialize_index(index).tobytes()
@@ -0,0 +1,90 @@
+import copy
+import sqlite3
+
+from src.storage.json_stat_archive_db import (
+    JSONStatArchiveDB, _to_json_bytes, _zstd_compress_bytes, rewrite_archive, verify_archive,
+)
+from src.storage.synthetic_archive import synthetic_tables
+
+
+def _write_legacy(db_path: str, tables: dict) -> None:
+    """
+    Write the tables as archives written before the JSON-Stat 2.0 top-level "id" was read: labels inline, no dim map.
+    """
+    archive = JSONStatArchiveDB()
+    archive.write(db_path, {})
+    conn = sqlite3.connect(db_path)
+    with conn:
+        for table_id, payload in tables.items():
+            conn.execute(
+                "INSERT INTO datasets(table_id, json_zst, timestamp, dim_map_json) VALUES(?,?,?,?)",
+                (table_id, _zstd_compress_bytes(_to_json_bytes(payload["data"])), payload["timestamp"], "{}"),
+            )
+    conn.close()
+
+
+def _with_dict_indexes(tables: dict) -> dict:
+    """
+    The tables with their category indexes given as {code: position}, as the CSO API serves them.
+    """
+    tables = copy.deepcopy(tables)
+    for payload in tables.values():
+        for dim in payload["data"]["dimension"].values():
+            dim["category"]["index"] = {code: i for i, code in enumerate(dim["category"]["index"])}
+    return tables
+
+
+def test_json_stat_2_datasets_get_dim_maps_and_round_trip(tmp_path):
+    db_path = str(tmp_path / "archive.sqlite")
+    tables = dict(synthetic_tables(3, n_categories=4, n_years=3))
+    archive = JSONStatArchiveDB()
+    archive.write(db_path, tables)
+
+    dim_maps = archive.read_dim_maps(db_path, tables)
+    assert all(set(dim_maps[tid]) == set(tables[tid]["data"]["id"]) for tid in tables)
+    # the county coding is shared by all the tables
+    assert len({dim_maps[tid]["C02196V02652"] for tid in tables}) == 1
+    for tid, ds, ts in archive.read(db_path):
+        assert ds == tables[tid]["data"]
+        assert ts == tables[tid]["timestamp"]
+
+
+def test_rewrite_gives_legacy_datasets_dim_maps(tmp_path):
+    db_path = str(tmp_path / "archive.sqlite")
+    tables = dict(synthetic_tables(3, n_categories=4, n_years=3))
+    _write_legacy(db_path, tables)
+    assert verify_archive(db_path)["datasets_without_dim_map"] == 3
+
+    assert rewrite_archive(db_path, batch_size=2) == {"datasets": 3, "rewritten": 3}
+    report = verify_archive(db_path)
+    assert report["datasets_without_dim_map"] == 0
+    assert report["problems"] == 0
+    archive = JSONStatArchiveDB()
+    assert all(archive.read_dim_maps(db_path, tables).values())
+    assert {tid: (ds, ts) for tid, ds, ts in archive.read(db_path)} == {
+        tid: (payload["data"], payload["timestamp"]) for tid, payload in tables.items()
+    }
+    # already compacted datasets are left alone
+    assert rewrite_archive(db_path)["rewritten"] == 0
+
+
+def test_dict_indexes_keep_their_form(tmp_path):
+    tables = dict(synthetic_tables(2, n_categories=4, n_years=3))
+    dict_tables = _with_dict_indexes(tables)
+    archive = JSONStatArchiveDB()
+    lists_path, dicts_path = str(tmp_path / "lists.sqlite"), str(tmp_path / "dicts.sqlite")
+    archive.write(lists_path, tables)
+    archive.write(dicts_path, dict_tables)
+
+    # the same coding gets the same fingerprint whatever the form of its index
+    assert archive.read_dim_maps(dicts_path, tables) == archive.read_dim_maps(lists_path, tables)
+    for tid, ds, ts in archive.read(dicts_path):
+        assert ds == dict_tables[tid]["data"]
+    for tid, ds, ts in archive.read(dicts_path, with_labels=False):
+        county = ds["dimension"]["C02196V02652"]["category"]
+        assert county == {"index": dict_tables[tid]["data"]["dimension"]["C02196V02652"]["category"]["index"]}
+
+    legacy_path = str(tmp_path / "legacy.sqlite")
+    _write_legacy(legacy_path, dict_tables)
+    assert rewrite_archive(legacy_path)["rewritten"] == 2
+    assert {tid: ds for tid, ds, _ in archive.read(legacy_path)} == {tid: p["data"] for tid, p in dict_tables.items()}
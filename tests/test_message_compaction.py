@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from src.utils.fake_llms import ScriptedChatModel
+from src.utils.resources import reset_resource, set_resource
+from src.utils.message_compaction import compact_tool_history, condense_conversation, estimate_tokens
+
+
+N_ITERATIONS = 8
+TOOL_OUTPUT = "\n".join(f"{2000 + i}    County {i % 26:02d}    {1000 + 17 * i}" for i in range(400))
+CODE = "\n".join(["import pandas as pd", "df = pd.read_csv('cache/HPM09.csv')"] + [f"x{i} = df['VALUE'].sum()" for i in range(20)])
+
+
+def _tool_call(i: int) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{
+        "name": "python_code_executor",
+        "args": {"code": CODE, "description": f"Step {i}"},
+        "id": f"call_{i}",
+        "type": "tool_call",
+    }])
+
+
+@pytest.fixture
+def fake_analyst():
+    model = ScriptedChatModel(script={"": [lambda messages: _tool_call(len(messages))]})
+    set_resource("analyst_llm_with_code_exec_tool", model)
+    yield model
+    reset_resource("analyst_llm_with_code_exec_tool")
+
+
+def _run_analyst_loop(n_iterations: int) -> dict:
+    """
+    Drive `analyst_node` for `n_iterations`, answering each tool-call with a large tool output.
+    """
+    from src.graphs.agents.analyst_agent import analyst_node
+
+    state = {
+        "messages": [],
+        "table_id": "HPM09",
+        "question": "How did prices change?",
+        "analysis_plan": "1. Load the table\n2. Aggregate by year",
+        "context": "**Table ID**: HPM09\n**CSV File Path**: cache/HPM09.csv",
+        "report": [],
+        "prompt_tokens": [],
+        "iters": 0,
+    }
+    for _ in range(n_iterations):
+        update = asyncio.run(analyst_node(state))
+        response = update["messages"][-1]
+        tool_call_id = response.tool_calls[0]["id"]
+        state = {
+            **state,
+            **update,
+            "messages": state["messages"] + [response, ToolMessage(content=TOOL_OUTPUT, tool_call_id=tool_call_id)],
+        }
+    return state
+
+
+def test_prompt_tokens_stay_bounded_over_iterations(fake_analyst):
+    state = _run_analyst_loop(N_ITERATIONS)
+    prompt_tokens = state["prompt_tokens"]
+    assert len(prompt_tokens) == N_ITERATIONS
+
+    # without compaction every iteration re-sends all the previous tool outputs
+    output_tokens = estimate_tokens(TOOL_OUTPUT)
+    uncompacted_last = prompt_tokens[0] + (N_ITERATIONS - 1) * (output_tokens + estimate_tokens(_tool_call(0)))
+    assert prompt_tokens[-1] < 0.5 * uncompacted_last
+
+    # past the kept outputs, each iteration only adds a bullet summary and an elided tool-call
+    growth = [b - a for a, b in zip(prompt_tokens[3:], prompt_tokens[4:])]
+    assert max(growth) < 0.1 * output_tokens
+
+
+def test_compaction_reduces_tokens_per_iteration():
+    history = []
+    for i in range(N_ITERATIONS):
+        history += [_tool_call(i), ToolMessage(content=TOOL_OUTPUT, tool_call_id=f"call_{i}")]
+        compacted = compact_tool_history(history, keep_last=2, max_tool_chars=4000)
+        if i >= 2:
+            assert estimate_tokens(compacted) < estimate_tokens(history)
+    reduction = 1 - estimate_tokens(compacted) / estimate_tokens(history)
+    assert reduction > 0.6
+
+
+def test_compaction_keeps_tool_call_pairs_and_recent_outputs():
+    history = []
+    for i in range(4):
+        history += [_tool_call(i), ToolMessage(content=TOOL_OUTPUT, tool_call_id=f"call_{i}")]
+    compacted = compact_tool_history(history, keep_last=2, max_tool_chars=len(TOOL_OUTPUT))
+
+    assert [type(m) for m in compacted] == [type(m) for m in history]
+    assert [m.tool_call_id for m in compacted if isinstance(m, ToolMessage)] == [f"call_{i}" for i in range(4)]
+    assert compacted[-1].content == TOOL_OUTPUT
+    assert compacted[1].content.startswith("- [summarized] Step 0:")
+    assert "lines elided" in compacted[0].tool_calls[0]["args"]["code"]
+    # the input history is left untouched
+    assert history[1].content == TOOL_OUTPUT
+
+
+def _reviewer_turn(i: int) -> list:
+    """
+    One reviewer turn: the question, a `data_analyst_tool` call on two tables, its report and the final answer.
+    """
+    table_ids = [f"HPM{i:02d}", f"CPM{i:02d}"]
+    report = "\n\n".join(
+        f"### Analysis for Table ID: {table_id}\nThe data was loaded.\n| {2020 + i} | Dublin | {1000 + i} |\n"
+        + TOOL_OUTPUT
+        for table_id in table_ids
+    )
+    return [
+        HumanMessage(content=f"Question {i}: how did prices change?"),
+        AIMessage(content="", tool_calls=[{
+            "name": "data_analyst_tool", "args": {"table_ids": table_ids}, "id": f"review_{i}", "type": "tool_call",
+        }]),
+        ToolMessage(content=report, name="data_analyst_tool", tool_call_id=f"review_{i}"),
+        AIMessage(content=f"Answer {i}: prices rose. " + "Details. " * 200),
+    ]
+
+
+def test_condensed_conversation_keeps_recent_turns_and_summarises_older_ones():
+    turns = [_reviewer_turn(i) for i in range(7)]
+    messages = [msg for turn in turns for msg in turn]
+    compacted = condense_conversation(messages, keep_turns=1, max_condensed_turns=2, answer_chars=100)
+
+    # turns 0-3 are folded into one summary of their questions and tables
+    summary = compacted[0]
+    assert isinstance(summary, SystemMessage)
+    assert summary.content.startswith("# SUMMARY OF 4 EARLIER TURNS:")
+    assert "- Q: Question 0: how did prices change?" in summary.content
+    assert "HPM03, CPM03" in summary.content
+
+    # turns 4-5 keep their question and a condensed answer, without the tool-call / tool-output pair
+    assert [type(m) for m in compacted[1:5]] == [HumanMessage, AIMessage] * 2
+    assert compacted[1].content == "Question 4: how did prices change?"
+    condensed = compacted[2].content
+    assert "Tables analysed: HPM04, CPM04" in condensed
+    assert "- HPM04: 2024 | Dublin | 1004" in condensed
+    assert "Answer given:\nAnswer 4: prices rose." in condensed
+    assert len(condensed) < 1000
+    assert not any(isinstance(m, ToolMessage) for m in compacted[:5])
+
+    # the last turn is kept verbatim
+    assert compacted[5:] == turns[-1]
+    assert estimate_tokens(compacted) < 0.3 * estimate_tokens(messages)
+
+
+def test_short_conversations_are_left_unchanged():
+    messages = _reviewer_turn(0)
+    assert condense_conversation(messages, keep_turns=1) == messages
+    assert condense_conversation(messages, keep_turns=0, max_condensed_turns=0)[0].content.startswith("# SUMMARY OF 1")
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.python_runner import EXEC_SPILL_MAX_AGE, CappedOutput, prune_spill_dir, run_python_safely
+
+
+CODE = "import time\nfor i in range(50):\n    print('{worker}', i)\n    time.sleep(0.001)\n"
+
+
+def test_concurrent_executions_capture_their_own_output():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda w: run_python_safely(CODE.format(worker=w)), range(8)))
+
+    for worker, result in enumerate(results):
+        words = result["stdout"].split()
+        assert len(words) == 100
+        assert set(words[::2]) == {str(worker)}
+
+
+def test_output_outside_an_execution_goes_to_the_original_stream(capsys):
+    run_python_safely("print('captured')")
+    print("not captured")
+    assert capsys.readouterr().out == "not captured\n"
+
+
+def test_errors_and_stderr_are_captured():
+    result = run_python_safely("import sys\nprint('to stderr', file=sys.stderr)\nraise ValueError('boom')")
+    assert result["stdout"] == "to stderr\n"
+    assert result["error"]["type"] == "ValueError"
+    assert result["error"]["message"] == "boom"
+
+
+def test_truncated_output_is_spilled_and_old_spill_files_are_pruned(tmp_path):
+    stale = tmp_path / "stale.txt"
+    stale.write_text("x")
+    os.utime(stale, (time.time() - 2 * EXEC_SPILL_MAX_AGE, time.time() - 2 * EXEC_SPILL_MAX_AGE))
+
+    output = CappedOutput(max_chars=100, spill_dir=str(tmp_path))
+    output.write("x" * 1000)
+    output.close()
+    assert "characters omitted" in output.getvalue()
+    assert str(tmp_path) not in output.getvalue()
+    with open(output.spill_path) as f:
+        assert f.read() == "x" * 1000
+    assert not stale.exists()
+
+    # above the size limit, the oldest files go first
+    os.utime(output.spill_path, (time.time() - 60, time.time() - 60))
+    (tmp_path / "newer.txt").write_text("y" * 2048)
+    assert prune_spill_dir(str(tmp_path), max_mb=2.5 / 1024) == 1
+    assert os.listdir(tmp_path) == ["newer.txt"]
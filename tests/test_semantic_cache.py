@@ -0,0 +1,120 @@
+import subprocess
+import sys
+import threading
+
+from src.retrieval.local_embeddings import HashingEmbeddings
+from src.storage.semantic_cache import SemanticCache
+
+
+QUESTION = "What is the average rent in Dublin in 2023?"
+PAYLOAD = {"answer": "The average rent was 2,000 euro."}
+
+
+def _cache(**kwargs) -> SemanticCache:
+    return SemanticCache(HashingEmbeddings(dim=256), **kwargs)
+
+
+def test_lookup_hits_the_stored_question():
+    cache = _cache(threshold=0.9)
+    cache.store(QUESTION, PAYLOAD)
+
+    payload, score = cache.lookup(QUESTION)
+    assert payload == PAYLOAD
+    assert score > 0.99
+
+
+def test_lookup_misses_an_empty_cache_and_other_namespaces():
+    cache = _cache()
+    assert cache.lookup(QUESTION) is None
+
+    cache.store(QUESTION, PAYLOAD, namespace="HPM09")
+    assert cache.lookup(QUESTION, namespace="CPM01") is None
+    assert cache.lookup(QUESTION, namespace="HPM09")[0] == PAYLOAD
+
+
+def test_threshold_separates_similar_and_unrelated_questions():
+    embedder = HashingEmbeddings(dim=256)
+    paraphrase = "What is the average rent in Dublin in 2023"
+    unrelated = "How many births were registered in Cork last year?"
+
+    # the threshold sits between the similarity of a paraphrase and of an unrelated question
+    probe = SemanticCache(embedder, threshold=-1.0)
+    probe.store(QUESTION, PAYLOAD)
+    similar_score = probe.lookup(paraphrase)[1]
+    unrelated_score = probe.lookup(unrelated)[1]
+    assert similar_score > unrelated_score
+
+    cache = SemanticCache(embedder, threshold=(similar_score + unrelated_score) / 2)
+    cache.store(QUESTION, PAYLOAD)
+    assert cache.lookup(paraphrase)[0] == PAYLOAD
+    assert cache.lookup(unrelated) is None
+
+
+def test_reused_vector_gives_the_same_result():
+    cache = _cache()
+    vector = cache.embed(QUESTION)
+    cache.store(QUESTION, PAYLOAD, vector=vector)
+    assert cache.lookup("ignored when a vector is given", vector=vector)[0] == PAYLOAD
+
+
+def test_changed_dependency_invalidates_the_entry():
+    timestamps = {"HPM09": "2024-01-01"}
+    cache = _cache(dependency_resolver=lambda table_ids: {t: timestamps.get(t) for t in table_ids})
+    cache.store(QUESTION, PAYLOAD, dependencies={"HPM09": "2024-01-01"})
+    assert cache.lookup(QUESTION)[0] == PAYLOAD
+
+    timestamps["HPM09"] = "2024-06-01"
+    assert cache.lookup(QUESTION) is None
+    assert len(cache) == 0
+
+
+def test_invalidate_by_table():
+    cache = _cache()
+    cache.store(QUESTION, PAYLOAD, dependencies={"HPM09": "t1"})
+    cache.store("Population of Cork", {"answer": "..."}, dependencies={"FY001": "t1"})
+
+    assert cache.invalidate(["HPM09"]) == 1
+    assert cache.lookup(QUESTION) is None
+    assert len(cache) == 1
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+
+
+def test_oldest_entries_are_evicted_above_max_entries():
+    cache = _cache(max_entries=3)
+    for i in range(5):
+        cache.store(f"question number {i} about county {i}", {"i": i})
+
+    assert len(cache) == 3
+    assert cache.lookup("question number 0 about county 0") is None
+    assert cache.lookup("question number 4 about county 4")[0] == {"i": 4}
+
+
+def test_concurrent_stores_respect_max_entries():
+    cache = _cache(max_entries=50)
+
+    def _store(worker: int):
+        for i in range(100):
+            cache.store(f"worker {worker} question {i}", {"worker": worker, "i": i})
+
+    threads = [threading.Thread(target=_store, args=(w,)) for w in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(cache) == 50
+    assert sum(index.ntotal for index in cache._indexes.values()) == 50
+
+
+def test_faiss_is_imported_on_the_first_store_only():
+    code = (
+        "import sys\n"
+        "from src.retrieval.local_embeddings import HashingEmbeddings\n"
+        "from src.storage.semantic_cache import SemanticCache\n"
+        "cache = SemanticCache(HashingEmbeddings(dim=8))\n"
+        "assert cache.lookup('q') is None and 'faiss' not in sys.modules\n"
+        "cache.store('q', {})\n"
+        "assert 'faiss' in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
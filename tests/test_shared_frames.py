@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.shared_frames import FrameCache
+
+
+def _frame(n: int = 1000) -> pd.DataFrame:
+    return pd.DataFrame({"year": np.arange(n), "value": np.random.default_rng(0).random(n)})
+
+
+def _size(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+
+def test_cached_frame_is_attached_without_a_load():
+    cache = FrameCache()
+    df = _frame()
+    assert cache.publish("HPM09", df)
+    with cache.attach("HPM09", loader=lambda: None) as attached:
+        pd.testing.assert_frame_equal(attached, df)
+    assert cache.info()["hits"] == 1
+
+
+def test_changes_made_by_an_execution_stay_local():
+    cache = FrameCache()
+    cache.publish("HPM09", _frame())
+    with cache.attach("HPM09") as df:
+        df.loc[0, "value"] = -1.0
+        df["extra"] = 1
+    with cache.attach("HPM09") as df:
+        assert df.loc[0, "value"] != -1.0
+        assert "extra" not in df
+
+
+def test_least_recently_used_frames_are_evicted():
+    cache = FrameCache(max_bytes=2 * _size(_frame()))
+    cache.publish("A", _frame())
+    cache.publish("B", _frame())
+    with cache.attach("A"):
+        pass
+    cache.publish("C", _frame())
+    assert list(cache._entries) == ["A", "C"]
+    assert cache.info()["evictions"] == 1
+
+    # a missing table is loaded and cached; one larger than the cache is only handed out
+    with cache.attach("D", loader=_frame) as df:
+        assert len(df) == 1000
+    assert "D" in cache._entries
+    assert not cache.publish("E", _frame(10000))
+    assert "E" not in cache._entries
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils.single_flight import AsyncSingleFlight, SingleFlight, atomic_write
+
+
+N_CALLERS = 8
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    runs = []
+    release = threading.Event()
+
+    def _work():
+        runs.append(1)
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=N_CALLERS) as executor:
+        futures = [executor.submit(flight.do, "key", _work) for _ in range(N_CALLERS)]
+        # every caller is waiting on the leader's call before it completes
+        while flight.calls < N_CALLERS:
+            time.sleep(0.001)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert results == ["result"] * N_CALLERS
+    assert len(runs) == 1
+    assert flight.shared == N_CALLERS - 1
+    # nothing is cached once the call completed
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_an_exception_reaches_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def _fail():
+        release.wait(5)
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=N_CALLERS) as executor:
+        futures = [executor.submit(flight.do, "key", _fail) for _ in range(N_CALLERS)]
+        while flight.calls < N_CALLERS:
+            time.sleep(0.001)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match="boom"):
+                future.result()
+    assert flight._in_flight == {}
+
+
+def test_async_callers_share_one_task_and_its_exception():
+    async def _run():
+        flight = AsyncSingleFlight()
+        runs = []
+
+        async def _work():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return len(runs)
+
+        results = await asyncio.gather(*[flight.do("key", _work) for _ in range(N_CALLERS)])
+        assert results == [1] * N_CALLERS
+        assert flight.shared == N_CALLERS - 1
+
+        async def _fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*[flight.do("other", _fail) for _ in range(N_CALLERS)], return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert flight._in_flight == {}
+
+    asyncio.run(_run())
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_task():
+    async def _run():
+        flight = AsyncSingleFlight()
+
+        async def _work():
+            await asyncio.sleep(0.02)
+            return "result"
+
+        first = asyncio.ensure_future(flight.do("key", _work))
+        second = asyncio.ensure_future(flight.do("key", _work))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "result"
+
+    asyncio.run(_run())
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_atomic_write_leaves_no_partial_file(tmp_path):
+    path = str(tmp_path / "table.csv")
+    atomic_write(path, lambda tmp: _write_text(tmp, "a,b\n"))
+
+    def _fail(tmp):
+        _write_text(tmp, "partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomic_write(path, _fail)
+    with open(path) as f:
+        assert f.read() == "a,b\n"
+    assert os.listdir(tmp_path) == ["table.csv"]
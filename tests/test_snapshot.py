@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from src.retrieval.delta_index import LEASES_DIR, update_delta
+from src.retrieval.hybrid_retrieval import HybridRetrieval
+from src.retrieval.index_builder import read_manifest
+from src.retrieval.local_embeddings import HashingEmbeddings
+from src.retrieval.snapshot import RetrievalSnapshotManager
+
+
+def _manager(out_root: str, **kwargs) -> RetrievalSnapshotManager:
+    def factory(artifacts_dir: str) -> HybridRetrieval:
+        manifest = read_manifest(artifacts_dir)
+        return HybridRetrieval(
+            top_k_stage_1=manifest["n_bm25_chunks"], top_k_stage_2=3, embeddings=HashingEmbeddings(dim=manifest["dim"]),
+            llm=object(), artifacts_dir=artifacts_dir, mmap=False,
+        )
+
+    return RetrievalSnapshotManager(factory, artifacts_root=out_root, poll_interval=0, **kwargs)
+
+
+def _leases(generation_dir: str) -> list:
+    leases_dir = os.path.join(generation_dir, LEASES_DIR)
+    return os.listdir(leases_dir) if os.path.isdir(leases_dir) else []
+
+
+def test_retired_snapshot_is_disposed_once_its_last_reference_is_released(synthetic_artifacts):
+    artifacts_dir, archive, out_root = (synthetic_artifacts[k] for k in ("artifacts_dir", "archive", "out_root"))
+    manager = _manager(out_root, embedder="hashing")
+
+    # an unreferenced snapshot is disposed as soon as it is swapped out
+    first = manager.acquire()
+    manager.release(first)
+    first_generation = update_delta(artifacts_dir, ["SYN00001"], [], archive)
+    assert manager.reload()
+    assert first.retired and first.retriever is None
+    assert manager.info()["delta_generation"] == os.path.basename(first_generation)
+
+    # a referenced one keeps its retriever and its generation lease until the reference is dropped
+    second = manager.acquire()
+    assert len(_leases(first_generation)) == 1
+    second_generation = update_delta(artifacts_dir, ["SYN00002"], [], archive)
+    assert os.path.exists(first_generation)
+    assert manager.reload()
+    assert not manager.reload()
+    assert second.retired and second.refs == 1
+    assert "SYN00002" in second.retriever.get_context_blocks(["SYN00002"])
+
+    manager.release(second)
+    assert second.retriever is None
+    assert _leases(first_generation) == []
+    assert len(_leases(second_generation)) == 1
+
+    # the released generation can now be removed by the next delta update
+    update_delta(artifacts_dir, ["SYN00003"], [], archive)
+    assert not os.path.exists(first_generation)
+    with manager.snapshot() as retriever:
+        assert "SYN00003" in retriever.get_context_blocks(["SYN00003"])
+    assert manager.info()["in_flight"] == 0
+
+
+def test_mismatching_embedder_is_not_loaded(synthetic_artifacts):
+    manager = _manager(synthetic_artifacts["out_root"], embedder="gemini")
+    with pytest.raises(ValueError, match="embedded with 'hashing'"):
+        manager.reload()
+    assert manager.info()["artifacts_dir"] is None
+
+    manager = _manager(synthetic_artifacts["out_root"], embedder="hashing", dim=768)
+    with pytest.raises(ValueError, match="dim vectors"):
+        manager.reload()
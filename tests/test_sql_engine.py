@@ -0,0 +1,66 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+from src.utils.sql_engine import TableSQL
+
+
+@pytest.fixture
+def engine(tmp_path):
+    pd.DataFrame({
+        "Year": [2022, 2022, 2023, 2023],
+        "County": ["Dublin", "Cork", "Dublin", "Cork"],
+        "VALUE": [10.0, 4.0, 12.0, 5.0],
+    }).to_csv(tmp_path / "HPM09.csv", index=False)
+    pd.DataFrame({
+        "Year": [2022, 2022, 2023, 2023],
+        "County": ["Dublin", "Cork", "Dublin", "Cork"],
+        "Population": [1000, 500, 1100, 520],
+    }).to_csv(tmp_path / "PEA01.csv", index=False)
+    engine = TableSQL(cache_dir=str(tmp_path))
+    yield engine
+    engine.close()
+
+
+def test_queries_run_over_the_cached_tables(engine):
+    result = engine.sql("SELECT Year, SUM(VALUE) AS total FROM HPM09 WHERE County = 'Dublin' GROUP BY Year ORDER BY Year")
+    assert result.to_dict("records") == [{"Year": 2022, "total": 10.0}, {"Year": 2023, "total": 12.0}]
+    assert os.path.exists(engine.parquet_path("HPM09"))
+    assert not os.path.exists(engine.parquet_path("PEA01"))
+
+    joined = engine.sql(
+        "SELECT h.County, h.VALUE / p.Population AS per_capita FROM HPM09 h JOIN PEA01 p USING (Year, County) "
+        "WHERE h.Year = 2023 ORDER BY h.County"
+    )
+    assert joined["County"].tolist() == ["Cork", "Dublin"]
+    assert joined["per_capita"].tolist() == pytest.approx([5.0 / 520, 12.0 / 1100])
+
+
+def test_results_are_truncated_to_max_rows(engine, capsys):
+    result = engine.sql("SELECT * FROM HPM09 ORDER BY VALUE", max_rows=3)
+    assert result["VALUE"].tolist() == [4.0, 5.0, 10.0]
+    assert "truncated" in capsys.readouterr().out
+
+
+def test_a_changed_csv_is_materialized_again(engine):
+    assert len(engine.sql("SELECT * FROM HPM09")) == 4
+    csv_fp = engine.csv_path("HPM09")
+    pd.DataFrame({"Year": [2024], "County": ["Galway"], "VALUE": [1.0]}).to_csv(csv_fp, index=False)
+    later = time.time() + 5
+    os.utime(csv_fp, (later, later))
+    assert engine.sql("SELECT County FROM HPM09")["County"].tolist() == ["Galway"]
+
+
+def test_invalid_queries_are_rejected(engine):
+    with pytest.raises(duckdb.ParserException):
+        engine.sql("SELEC Year FROM HPM09")
+    with pytest.raises(duckdb.CatalogException):
+        engine.sql("SELECT * FROM NOSUCHTABLE")
+    with pytest.raises(duckdb.BinderException):
+        engine.sql("SELECT Missing FROM HPM09")
+    # a failed query does not leave the engine unusable
+    assert len(engine.sql("SELECT * FROM PEA01")) == 4
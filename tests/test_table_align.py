@@ -0,0 +1,121 @@
+import itertools
+import math
+
+import pytest
+
+from src.utils.table_align import align, coded_table
+
+
+COUNTIES = {"01": "Dublin", "02": "Cork", "03": "Galway"}
+
+
+def _dataset(dims: dict, value_of, role: dict = None) -> dict:
+    """
+    A JSON-Stat dataset with the given {dimension-ID: (label, [codes])}; the value of a cell is `value_of(*codes)`.
+    """
+    ds = {"id": list(dims), "size": [len(codes) for _, codes in dims.values()], "dimension": {}}
+    for dim_id, (label, codes) in dims.items():
+        ds["dimension"][dim_id] = {
+            "label": label,
+            "category": {"index": list(codes), "label": {code: COUNTIES.get(code, code) for code in codes}},
+        }
+    ds["value"] = [value_of(*cell) for cell in itertools.product(*(codes for _, codes in dims.values()))]
+    if role:
+        ds["role"] = role
+    return ds
+
+
+def _prices():
+    ds = _dataset(
+        {
+            "STATISTIC": ("Statistic", ["HPM09C01"]),
+            "TLIST(A1)": ("Year", ["2021", "2022", "2023"]),
+            "C02196V02652": ("County", ["01", "02"]),
+        },
+        lambda statistic, year, county: float(year) + int(county) / 100,
+        role={"geo": ["C02196V02652"]},
+    )
+    return coded_table("HPM09", ds, {"STATISTIC": "fp-hpm-stat", "TLIST(A1)": "fp-years", "C02196V02652": "fp-counties"})
+
+
+def _completions(county_dim: str = "C02196V02652", fingerprints: dict = None):
+    ds = _dataset(
+        {
+            "STATISTIC": ("Statistic", ["NDA01"]),
+            "TLIST(A1)": ("Year", ["2022", "2023", "2024"]),
+            county_dim: ("Local Area", ["01", "02", "03"]),
+        },
+        lambda statistic, year, county: float(int(year) * 10 + int(county)),
+    )
+    return coded_table("NDQ01", ds, fingerprints or {})
+
+
+def _records(df) -> list:
+    return [{k: (None if isinstance(v, float) and math.isnan(v) else v) for k, v in row.items()} for row in df.to_dict("records")]
+
+
+def test_inner_join_keeps_the_common_categories():
+    df = align([_prices(), _completions()])
+
+    # joined on the year (same ID) and the county (same ID); the unlike statistics stay per-table columns
+    assert list(df.columns) == ["Year", "County", "Statistic", "HPM09", "NDQ01 Statistic", "NDQ01"]
+    assert _records(df[["Year", "County", "HPM09", "NDQ01"]]) == [
+        {"Year": "2022", "County": "Dublin", "HPM09": 2022.01, "NDQ01": 20221.0},
+        {"Year": "2022", "County": "Cork", "HPM09": 2022.02, "NDQ01": 20222.0},
+        {"Year": "2023", "County": "Dublin", "HPM09": 2023.01, "NDQ01": 20231.0},
+        {"Year": "2023", "County": "Cork", "HPM09": 2023.02, "NDQ01": 20232.0},
+    ]
+
+
+def test_outer_join_keeps_all_the_categories():
+    df = align([_prices(), _completions()], how="outer", select={"NDQ01": {"Local Area": ["Dublin", "Galway"]}})
+    got = {(row["Year"], row["County"]): (row["HPM09"], row["NDQ01"]) for row in _records(df)}
+    assert got == {
+        ("2021", "Dublin"): (2021.01, None),
+        ("2021", "Cork"): (2021.02, None),
+        ("2022", "Dublin"): (2022.01, 20221.0),
+        ("2022", "Cork"): (2022.02, None),
+        ("2023", "Dublin"): (2023.01, 20231.0),
+        ("2023", "Cork"): (2023.02, None),
+        ("2022", "Galway"): (None, 20223.0),
+        ("2023", "Galway"): (None, 20233.0),
+        ("2024", "Dublin"): (None, 20241.0),
+        ("2024", "Galway"): (None, 20243.0),
+    }
+    assert list(df["County"].cat.categories) == ["Dublin", "Cork", "Galway"]
+
+
+def test_dimensions_with_the_same_fingerprint_are_joined_whatever_their_id():
+    # another dimension-ID and no `role`: only the registry fingerprint (identical coding) matches the counties
+    completions = _completions("C03004V03625", {"TLIST(A1)": "fp-years", "C03004V03625": "fp-counties"})
+    df = align([_prices(), completions])
+    assert list(df.columns[:2]) == ["Year", "County"]
+    assert "Local Area" not in df.columns
+    assert len(df) == 4
+
+    # without the fingerprint the counties are not joined: every county of one table meets every county of the other
+    df = align([_prices(), _completions("C03004V03625")])
+    assert list(df.columns[:1]) == ["Year"] and "Local Area" in df.columns
+    assert len(df) == 2 * 2 * 3
+
+
+def test_statistics_with_the_same_coding_are_joined():
+    other = _prices()
+    other["table_id"] = "HPM09B"
+    df = align([_prices(), other])
+    assert list(df.columns) == ["Statistic", "Year", "County", "HPM09", "HPM09B"]
+    assert len(df) == 6 and (df["HPM09"] == df["HPM09B"]).all()
+
+    # `on` restricts the join: the counties of both tables are then crossed
+    df = align([_prices(), other], on=["Year"])
+    assert "HPM09B County" in df.columns
+    assert len(df) == 3 * 2 * 2
+
+
+def test_unmatched_or_too_large_alignments_are_refused():
+    with pytest.raises(ValueError, match="no match in all the tables"):
+        align([_prices(), _completions("C03004V03625")], on=["County"])
+    with pytest.raises(ValueError, match=r"4 rows \(more than 3\)"):
+        align([_prices(), _completions()], max_rows=3)
+    with pytest.raises(KeyError, match="no dimension 'Sector'"):
+        align([_prices(), _completions()], on=["Sector"])
@@ -0,0 +1,83 @@
+import asyncio
+
+from fakeredis.aioredis import FakeRedis
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from src.storage.transcript_index import TranscriptIndex
+
+
+THREAD_ID = "user@example.com"
+
+
+def _entries(n: int, offset: int = 0) -> list:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(offset, offset + n)]
+
+
+def _contents(entries: list) -> list:
+    return [entry["content"] for entry in entries]
+
+
+def test_append_and_page_back_through_the_transcript():
+    async def _run():
+        index = TranscriptIndex(FakeRedis())
+        await index.append(THREAD_ID, _entries(3))
+        await index.append(THREAD_ID, _entries(4, offset=3))
+        await index.append(THREAD_ID, [])
+        assert await index.length(THREAD_ID) == 7
+
+        latest, start = await index.page(THREAD_ID, 3)
+        assert (_contents(latest), start) == (["message 4", "message 5", "message 6"], 4)
+        assert latest[0]["role"] == "user" and "ts" in latest[0]
+
+        older, start = await index.page(THREAD_ID, 3, before=start)
+        assert (_contents(older), start) == (["message 1", "message 2", "message 3"], 1)
+        oldest, start = await index.page(THREAD_ID, 3, before=start)
+        assert (_contents(oldest), start) == (["message 0"], 0)
+        assert await index.page(THREAD_ID, 3, before=0) == ([], 0)
+
+    asyncio.run(_run())
+
+
+def test_page_of_an_unknown_thread_is_empty():
+    async def _run():
+        index = TranscriptIndex(FakeRedis())
+        assert await index.page("nobody", 20) == ([], 0)
+        assert await index.length("nobody") == 0
+
+    asyncio.run(_run())
+
+
+def test_backfill_keeps_only_the_displayed_messages_and_replaces_the_transcript():
+    async def _run():
+        index = TranscriptIndex(FakeRedis())
+        await index.append(THREAD_ID, _entries(5))
+        messages = [
+            HumanMessage(content="How did rents change?"),
+            AIMessage(content="", tool_calls=[{"name": "data_analyst_tool", "args": {}, "id": "call_0", "type": "tool_call"}]),
+            ToolMessage(content="tool output", tool_call_id="call_0"),
+            AIMessage(content="Rents rose by 5%."),
+        ]
+        assert await index.backfill(THREAD_ID, messages) == 2
+
+        entries, start = await index.page(THREAD_ID, 20)
+        assert start == 0
+        assert [(e["role"], e["content"]) for e in entries] == [
+            ("user", "How did rents change?"), ("assistant", "Rents rose by 5%."),
+        ]
+
+        assert await index.backfill(THREAD_ID, []) == 0
+        assert await index.length(THREAD_ID) == 0
+
+    asyncio.run(_run())
+
+
+def test_threads_are_separate_and_delete_clears_one():
+    async def _run():
+        index = TranscriptIndex(FakeRedis())
+        await index.append("a", _entries(2))
+        await index.append("b", _entries(1))
+        await index.delete("a")
+        assert await index.length("a") == 0
+        assert _contents((await index.page("b", 20))[0]) == ["message 0"]
+
+    asyncio.run(_run())